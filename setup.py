@@ -16,6 +16,8 @@ setuptools.setup(
             "idgenus=GenusFinder.command:main",
             "prepdb=GenusFinder.prepare_strain_data:main",
             "traingenus=GenusFinder.train_command:main",
+            "genusmetrics=GenusFinder.Metrics:main",
+            "genusd=GenusFinder.server:main",
         ],
     },
     install_requires=[
@@ -25,6 +27,7 @@ setuptools.setup(
         "scikit-learn",
         "tqdm",
     ],
+    extras_require={"parquet": ["pyarrow"], "zstd": ["zstandard"]},
     classifiers=[
         "Intended Audience :: Science/Research",
         "License :: OSI Approved :: GNU General Public License v2 or later (GPLv2+)",
@@ -1,11 +1,14 @@
 import logging
-import numpy as np
+import re
 from collections import OrderedDict
 from ete3 import Tree
 from pathlib import Path
-from sklearn.linear_model import LogisticRegression
-from sklearn.metrics import classification_report
-from sklearn.model_selection import train_test_split
+from typing import Callable
+from .Metrics import timed
+from .Storage import open_text
+
+# learn_curve fits on branch length distances scaled up by this
+DISTANCE_SCALE = 50
 
 
 class Algorithms:
@@ -15,20 +18,38 @@ class Algorithms:
     1) distance_probs which calculates subtree distance-based probabilities
     2) bootstrap_probs which calculates subtree bootstrap-based probabilities
     3) train which calculates full tree LinReg-based probabilities
+    The query is the leaf UNKNOWN, or QUERY___UNKNOWN as RAxML names it when it places one
     """
 
     def __init__(
-        self, tree_fp: Path, type_species_fp: Path, query: Path = None
+        self,
+        tree_fp: Path,
+        type_species_fp: Path,
+        query: Path = None,
+        lookup: dict = None,
     ) -> None:
-        with open(tree_fp) as f:
-            self.t = Tree(f.readline())
+        if isinstance(tree_fp, Tree):
+            # Already in memory, like a tree place_supports has put supports on
+            self.t = tree_fp
+        else:
+            with open(tree_fp) as f:
+                # Drop comments, like the branch labels RAxML puts in placement trees
+                self.t = Tree(re.sub(r"\[[^\]]*\]", "", f.readline()))
+        placed = self.t.search_nodes(name="QUERY___UNKNOWN")
+        self.query_name = "QUERY___UNKNOWN" if placed else "UNKNOWN"
 
         self.type_species_fp = type_species_fp
-        self.lookup = {}  # Store commonly accessed type species
+        # Store commonly accessed type species, can be seeded with a preloaded genus index
+        self.lookup = dict(lookup) if lookup else {}
 
-        with open(query) as f:
-            self.query = f.readline().strip()
+        # Only the query file's header, callers holding the query in memory can leave it out
+        self.query = None
+        if query:
+            with open(query) as f:
+                self.query = f.readline().strip()
+        self.clade_index = None
 
+    @timed("Algorithms.distance_probs")
     def distance_probs(self) -> OrderedDict:
         """
         Calculate distance-based genus probabilities
@@ -54,6 +75,7 @@ class Algorithms:
         dist_prob = OrderedDict(sorted(dist_prob.items(), key=lambda x: -x[1]))
         return dist_prob
 
+    @timed("Algorithms.bootstrap_probs")
     def bootstrap_probs(self) -> OrderedDict:
         """
         Calculate bootstrap-based probabilities
@@ -68,19 +90,17 @@ class Algorithms:
         boot_prob = {}
         remaining_frac = 100
 
-        node = self.t.search_nodes(name="UNKNOWN")[0]
-        node = node.up
+        index = self.get_clade_index()
+        i = index.parent[index.leaf("UNKNOWN")]
         count = 0
-        while node:
+        while i >= 0:
+            node = index.nodes[i]
             logging.debug(f"Node: {node.name}")
             logging.debug(f"Dist: {node.dist}")
             logging.debug(f"Bootstrap: {node.support}")
             factor = node.support * remaining_frac
-            sub_dict = {}
-            for n in node.traverse():
-                if n.name != "UNKNOWN" and n.name != "":
-                    g = self.get_genus(n.name, self.lookup)
-                    sub_dict[g] = sub_dict[g] + 1 if g in sub_dict else 1
+            # The query has no genus, so it isn't counted
+            sub_dict = index.histogram(i)
 
             sub_dict = {k: v / sum(sub_dict.values()) for k, v in sub_dict.items()}
             for k, v in sub_dict.items():
@@ -92,7 +112,7 @@ class Algorithms:
             count += 1
             if count > 4:
                 break
-            node = node.up
+            i = index.parent[i]
 
         boot_prob = {
             k: v / sum(boot_prob.values()) for k, v in boot_prob.items()
@@ -100,40 +120,140 @@ class Algorithms:
         boot_prob = OrderedDict(sorted(boot_prob.items(), key=lambda x: -x[1]))
         return boot_prob
 
-    def train(self, training_tree: Tree, min_neighbors: int = 50) -> dict:
+    @timed("Algorithms.train")
+    def train(self, training_tree, min_neighbors: int = 50, index=None) -> dict:
+        """
+        Fit a genus curve for each type species near the query in training_tree (a Tree or
+        a path to one) and score the query's distance to each of them, keeping the best
+        probability for each genus
+
+        index is training_tree's CladeIndex if there's one already, e.g. for the LTP tree
+        """
+        from .CladeIndex import CladeIndex
+
+        if not isinstance(training_tree, Tree):
+            with open(training_tree) as f:
+                training_tree = Tree(f.readline())
+        genus = lambda name: self.get_genus(name, self.lookup)
+        if index is None:
+            index = CladeIndex(training_tree, genus)
+
+        # A species with no genus has no curve to fit, or genus to score it under
         ts = [
-            s for s in self.get_nearby_species(min_neighbors) if self.is_type_species(s)
+            s
+            for s in self.get_nearby_species(min_neighbors)
+            if s != self.query_name and self.is_type_species(s) and genus(s)
         ]
-        lrs = {s: self.learn_curve(s, training_tree) for s in ts}
-        probs = {
-            s: self.probability_for(lr, self.distance_to_unknown)
-            for s, lr in lrs.items()
-        }
+        lrs = {}
+        for s in ts:
+            try:
+                lrs[s] = self.learn_curve(s, training_tree, genus, index)
+            except (KeyError, ValueError) as e:
+                # Not in the training tree, too small a tree or only one genus to learn from
+                logging.debug(f"No curve for {s}: {e}")
+        if not lrs:
+            return {}
+
+        names, coefs, intercepts = self.stack_models(lrs)
+        dists = self.distances_to(self.query_name)
+        P = self.score([[dists[s] for s in names]], coefs, intercepts)
+        genera, G = self.by_genus(P, [genus(s) for s in names])
+        probs = OrderedDict(sorted(zip(genera, G[0].tolist()), key=lambda x: -x[1]))
         logging.info(f"{probs}")
         return probs
 
+    @staticmethod
+    def stack_models(lrs: dict) -> tuple:
+        """
+        (names, coefficients, intercepts) of fitted curves keyed by name, as one array each
+        """
+        import numpy as np
+
+        names = list(lrs)
+        coefs = np.array([lrs[n].coef_.ravel()[0] for n in names])
+        intercepts = np.array([lrs[n].intercept_.ravel()[0] for n in names])
+        return names, coefs, intercepts
+
+    @staticmethod
+    def score(D, coefs, intercepts):
+        """
+        P[i, j], the probability query i is in curve j's genus, from distances D[i, j]
+        between query i and curve j's type species, in one NumPy evaluation\n
+        The same as each curve's predict_proba on the scaled distance, for its positive class
+        """
+        import numpy as np
+
+        z = DISTANCE_SCALE * np.asarray(D, dtype=float) * coefs + intercepts
+        # 1 / (1 + exp(-z)) without overflowing for very negative z
+        return np.exp(-np.logaddexp(0, -z))
+
+    @staticmethod
+    def by_genus(P, genera: list) -> tuple:
+        """
+        (genera, G) where G[i, k] is the best of query i's probabilities for genus k
+        """
+        import numpy as np
+
+        names = sorted(set(genera))
+        idx = np.array([names.index(g) for g in genera])
+        G = np.zeros((P.shape[0], len(names)))
+        np.maximum.at(G, (slice(None), idx), P)
+        return names, G
+
+    def distances_to(self, name: str) -> dict:
+        """
+        Path length from leaf name to every leaf, in one walk of the tree
+        """
+        start = self.t.search_nodes(name=name)[0]
+        dist = {start: 0.0}
+        stack = [start]
+        while stack:
+            n = stack.pop()
+            neighbours = [(c, c.dist) for c in n.children]
+            if n.up:
+                neighbours.append((n.up, n.dist))
+            for m, d in neighbours:
+                if m not in dist:
+                    dist[m] = dist[n] + d
+                    stack.append(m)
+        return {n.name: d for n, d in dist.items() if n.is_leaf()}
+
     def get_genus(self, id: str, lookup: dict = None) -> str:
         if lookup:
             if id in lookup:
                 return lookup[id]
 
-        with open("db/type_species.fasta") as f:
-            for l in f.readlines():
+        with open_text(self.type_species_fp) as f:
+            for l in f:
                 if l[0] == ">" and id in l:
                     return l.split("\t")[1].split(" ")[0]
 
-    def get_nearby_species(self, min_neighbors: int) -> list:
-        node = self.t.search_nodes(name="UNKNOWN")[0]
-        while len(list(node.iter_leaves())) < min_neighbors and node:
-            node = node.up
+    def get_clade_index(self):
+        """
+        CladeIndex of this tree with each leaf's genus, built the first time it's needed
+        """
+        from .CladeIndex import CladeIndex
+
+        if self.clade_index is None:
+            query = {"UNKNOWN", self.query_name}
+            self.clade_index = CladeIndex(
+                self.t,
+                lambda name: (
+                    None if name in query else self.get_genus(name, self.lookup)
+                ),
+            )
+        return self.clade_index
 
-        return [n.name for n in node.iter_leaves()]
+    @timed("Algorithms.get_nearby_species")
+    def get_nearby_species(self, min_neighbors: int) -> list:
+        index = self.get_clade_index()
+        return index.leaves(index.clade([self.query_name], min_neighbors))
 
     def is_type_species(self, species: str) -> bool:
         return True
 
     def distance_to_unknown(self, species: str) -> float:
-        return 1
+        return self.t.get_distance(self.query_name, species)
 
     def determine_probabilities(seq: str):
         insert_on_LTP_tree(seq)
@@ -147,33 +267,41 @@ class Algorithms:
         print(probs)
 
     @staticmethod
-    def learn_curve(type_species: str, t: Tree):
-        n = t.search_nodes(name=type_species)[0]
-        genus_name = type_species[0]
-        n_iter = n.up
-
-        while len(list(n_iter.iter_leaves())) < 30 and n_iter:
-            n_iter = n_iter.up
+    @timed("Algorithms.learn_curve")
+    def learn_curve(
+        type_species: str,
+        t: Tree,
+        genus: Callable[[str], str] = None,
+        index=None,
+    ):
+        """
+        Logistic curve of whether a leaf is in type_species' genus against its (scaled)
+        distance from it, over the clade of at least 30 leaves around it\n
+        genus names each leaf's genus, by default its first letter, index is t's CladeIndex
+        (with those genera) if there's one already
+        """
+        # sklearn is slow to import and only the full tree method needs it
+        import numpy as np
+        from sklearn.linear_model import LogisticRegression
+        from sklearn.metrics import classification_report
+        from sklearn.model_selection import train_test_split
+        from .CladeIndex import CladeIndex
 
-        logging.info(genus_name)
-        logging.debug(n_iter)
+        if index is None:
+            index = CladeIndex(t, genus if genus else lambda name: name[0])
+        genus_id = index.leaf_genus[index.positions[type_species]]
+        logging.info(index.genus_of(type_species))
 
-        if not n_iter:
-            logging.error("Oh no")
+        # The clade of at least 30 leaves around it (past itself, a clade of one)
+        node = index.clade([type_species], 30)
+        logging.debug(index.nodes[node])
 
-        X = [
-            n.get_distance(n_loop.name)
-            for n_loop in n_iter.iter_leaves()
-            if n_loop.name != ""
-        ]
+        named = np.array([name != "" for name in index.leaves(node)])
+        X = index.distances(type_species, node)[named]
         logging.debug(X)
-        X = np.array(X).reshape(-1, 1)
-        X *= 50
-        y = [
-            int(n_loop.name[0] == genus_name)
-            for n_loop in n_iter.iter_leaves()
-            if n_loop.name != ""
-        ]
+        X = X.reshape(-1, 1) * DISTANCE_SCALE
+        lo, hi = index.lo[node], index.hi[node]
+        y = (index.leaf_genus[lo:hi][named] == genus_id).astype(int).tolist()
         logging.debug(y)
 
         X_train, X_test, y_train, y_test = train_test_split(
@@ -192,5 +320,5 @@ class Algorithms:
         return lr
 
     @staticmethod
-    def probability_for(lr, dist):
-        return lr.predict_proba(dist)
+    def probability_for(lr, dist: float) -> float:
+        return Algorithms.score([[dist]], lr.coef_.ravel(), lr.intercept_.ravel())[0, 0]
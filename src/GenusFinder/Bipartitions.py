@@ -0,0 +1,125 @@
+import logging
+import re
+import numpy as np
+from collections import Counter
+from pathlib import Path
+from .Metrics import timed
+
+# Trees are ete3 Trees, not imported here to keep it out of idgenus start-up
+
+TOKENS = re.compile(r"[(),;]|[^(),;]+")
+
+
+class SplitCounter:
+    """
+    Counts the leaf bipartitions (splits) of bootstrap trees, to put their supports on a
+    best tree in process rather than with RAxML -f b\n
+    A split is a row of leaf membership bits canonicalized to the side without the first
+    leaf (so it doesn't matter where a tree is rooted) and packed into bytes, which hash as
+    the key of its count. Trees can be added in batches, as adaptive bootstrapping runs them
+    """
+
+    def __init__(self, names: list) -> None:
+        self.names = sorted(names)
+        self.ids = {name: i for i, name in enumerate(self.names)}
+        self.counts = Counter()
+        self.trees = 0
+
+    def split_keys(self, clades: list) -> list:
+        """
+        Packed keys of the non-trivial splits among clades (lists of leaf ids)
+        """
+        n = len(self.names)
+        if not clades:
+            return []
+        M = np.zeros((len(clades), n), dtype=bool)
+        for row, leaves in zip(M, clades):
+            row[leaves] = True
+        M[M[:, 0]] ^= True
+        sizes = M.sum(axis=1)
+        # A single leaf (or everything but one) is in every tree
+        M = M[(sizes > 1) & (sizes < n - 1)]
+        return [row.tobytes() for row in np.packbits(M, axis=1)]
+
+    def clades(self, newick: str) -> list:
+        """
+        Leaf ids under each internal node of newick, without building the tree
+        """
+        newick = re.sub(r"\[[^\]]*\]", "", newick)
+        stack = [[]]
+        clades = []
+        after_clade = False
+        for token in TOKENS.findall(newick):
+            if token == "(":
+                stack.append([])
+            elif token == ")":
+                leaves = stack.pop()
+                clades.append(leaves)
+                stack[-1] += leaves
+            elif token not in ",;" and not after_clade:
+                name = token.split(":")[0].strip()
+                if name:
+                    stack[-1].append(self.ids[name])
+            # What follows a ")" is the node's label and length, not a leaf
+            after_clade = token == ")"
+        return clades
+
+    def add(self, newick: str):
+        # A rooted tree has its root split twice, once per side
+        self.counts.update(set(self.split_keys(self.clades(newick))))
+        self.trees += 1
+
+    def add_file(self, fp: Path) -> int:
+        """
+        Count every tree in a file of newicks, one per line, returns how many there were
+        """
+        n = 0
+        with open(fp) as f:
+            for line in f:
+                if line.strip():
+                    self.add(line)
+                    n += 1
+        return n
+
+    def support(self, t):
+        """
+        Set the support of each internal node of t, except the root, to the percentage of
+        trees with its split, as RAxML -f b does\n
+        t has to have the leaves the counter was made with
+        """
+        nodes = [n for n in t.traverse("postorder") if not n.is_leaf() and n.up]
+        clades = [[self.ids[name] for name in n.get_leaf_names()] for n in nodes]
+        n = len(self.names)
+        # A split of one leaf against the rest is in every tree
+        counts = [self.trees] * len(nodes)
+        nontrivial = [i for i, leaves in enumerate(clades) if 1 < len(leaves) < n - 1]
+        keys = self.split_keys([clades[i] for i in nontrivial])
+        for i, key in zip(nontrivial, keys):
+            counts[i] = self.counts[key]
+        for node, count in zip(nodes, counts):
+            node.support = round(100 * count / self.trees) if self.trees else 0
+        return t
+
+
+@timed("place_supports")
+def place_supports(base_tree_fp: Path, bootstraps_fp: Path, out_fp: Path = None):
+    """
+    The tree in base_tree_fp with supports from the trees in bootstraps_fp, also written to
+    out_fp (like RAxML_bipartitions) if it's given
+    """
+    from ete3 import Tree
+
+    with open(base_tree_fp) as f:
+        t = Tree(re.sub(r"\[[^\]]*\]", "", f.readline()))
+    counter = SplitCounter(t.get_leaf_names())
+    n = counter.add_file(bootstraps_fp)
+    counter.support(t)
+    if out_fp:
+        write_supported(t, out_fp)
+    logging.info(f"Placed supports from {n} bootstrap trees on {base_tree_fp.name}")
+    return t
+
+
+def write_supported(t, fp: Path):
+    with open(fp, "w") as f:
+        f.write(t.write(format=0) + "\n")
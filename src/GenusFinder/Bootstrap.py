@@ -0,0 +1,114 @@
+import logging
+import re
+import shutil
+from pathlib import Path
+from typing import Callable
+from .CLI import RAxMLTreeBuilder
+from .Metrics import timed
+
+
+def max_change(old: dict, new: dict) -> float:
+    return max(abs(old.get(k, 0.0) - new.get(k, 0.0)) for k in set(old) | set(new))
+
+
+class AdaptiveBootstrap:
+    """
+    Runs bootstrap replicates in batches until the genus probabilities they lead to settle\n
+    After each batch the supports are recomputed from every replicate so far and it stops
+    once no genus probability moves by more than tol, though never before min_reps
+    replicates or after max_reps
+    """
+
+    def __init__(
+        self,
+        batch: int = 10,
+        min_reps: int = 20,
+        max_reps: int = 100,
+        tol: float = 0.01,
+        seed: int = 392781,
+    ) -> None:
+        self.batch = batch
+        self.min_reps = min_reps
+        self.max_reps = max_reps
+        self.tol = tol
+        self.seed = seed
+
+    def params(self) -> dict:
+        return {
+            "batch": self.batch,
+            "min_reps": self.min_reps,
+            "max_reps": self.max_reps,
+            "tol": self.tol,
+            "b": self.seed,
+        }
+
+    @timed("AdaptiveBootstrap.run")
+    def run(
+        self,
+        aligned_fp: Path,
+        base_tree_fp: Path,
+        w: Path,
+        bootstraps_fp: Path,
+        probs_for: Callable[[object], dict],
+        weights_fp: Path = None,
+        supported_fp: Path = None,
+    ) -> dict:
+        """
+        Fills bootstraps_fp and puts the supports so far on base_tree_fp's tree after each
+        batch, probs_for gets the supported tree. weights_fp is the alignment's -a column
+        weights, the final supported tree is written to supported_fp (by default where RAxML
+        -f b would have put it)\n
+        Returns how many replicates it took and whether the probabilities converged
+        """
+        from ete3 import Tree
+        from .Bipartitions import SplitCounter, write_supported
+
+        supported_fp = supported_fp if supported_fp else w / "RAxML_bipartitions.final"
+        with open(base_tree_fp) as f:
+            t = Tree(re.sub(r"\[[^\]]*\]", "", f.readline()))
+        # Counts carry over, so each batch only has its own replicates parsed
+        counter = SplitCounter(t.get_leaf_names())
+
+        reps = 0
+        probs = None
+        change = None
+        with open(bootstraps_fp, "w"):
+            pass
+        while reps < self.max_reps:
+            n = min(self.batch, self.max_reps - reps)
+            RAxMLTreeBuilder().call(
+                a=weights_fp,
+                b=self.seed + reps,
+                N=n,
+                m="GTRCAT",
+                n="subtree1_batch",
+                p=10000,
+                s=aligned_fp,
+                w=w,
+            )
+            batch_fp = w / "RAxML_bootstrap.subtree1_batch"
+            with open(bootstraps_fp, "a") as f_out, open(batch_fp) as f_in:
+                shutil.copyfileobj(f_in, f_out)
+            counter.add_file(batch_fp)
+            reps += n
+
+            new = probs_for(counter.support(t))
+            if probs is not None:
+                change = max_change(probs, new)
+                logging.info(
+                    f"{reps} bootstrap replicates, probabilities moved {change}"
+                )
+            probs = new
+            if change is not None and change < self.tol and reps >= self.min_reps:
+                break
+
+        write_supported(t, supported_fp)
+        converged = change is not None and change < self.tol
+        logging.info(
+            f"Stopped after {reps} bootstrap replicates ({'converged' if converged else 'hit the cap'})"
+        )
+        return {
+            "replicates": reps,
+            "max_replicates": self.max_reps,
+            "converged": converged,
+        }
@@ -1,30 +1,109 @@
 import logging
+import os
 from pathlib import Path
 import subprocess as sp
 import sys
+from .Metrics import run_child, timed
+
+# Set (e.g. with idgenus --fake_tools) to use the deterministic stand-ins in fake_tools.py
+FAKE_TOOLS_ENV = "GENUSFINDER_FAKE_TOOLS"
+FAKE_TOOLS_FP = Path(__file__).parent / "fake_tools.py"
+# Set (e.g. with idgenus --tool_timeout) to kill tools that run too long, either seconds for
+# every tool or per tool like "muscle=600,raxmlHPC=3600"
+TOOL_TIMEOUT_ENV = "GENUSFINDER_TOOL_TIMEOUT"
+
+
+def timeout_for(tool: str) -> float:
+    """
+    Seconds tool can run for before it's killed, None for no limit
+    """
+    val = os.environ.get(TOOL_TIMEOUT_ENV, "")
+    if not val:
+        return None
+    if "=" not in val:
+        return float(val)
+    for pair in val.split(","):
+        k, _, v = pair.partition("=")
+        if k.strip() == tool:
+            return float(v)
+    return None
+
+
+class ToolError(Exception):
+    """
+    A tool that failed, couldn't start or timed out, with the ToolResult saying how
+    """
+
+    def __init__(self, result) -> None:
+        super().__init__(f"{result.job.tool} {result.error}")
+        self.result = result
+
+
+def remove_stale(stale: list):
+    """
+    Remove whatever matches each (directory, glob) in stale, right before a tool runs
+    """
+    for w, pattern in stale:
+        for fp in Path(w).glob(pattern):
+            logging.debug(f"Removing stale {fp}")
+            os.remove(fp)
 
 
 class CLI:
     """
-    A template wrapper class for CLI interactions
+    A template wrapper class for CLI interactions\n
+    A tool that doesn't succeed, or runs past its timeout_for, raises a ToolError. With
+    defer, calls return a ToolJob for a ToolRunner instead of running the tool
     """
 
-    def __init__(self) -> None:
+    name = ""
+
+    def __init__(self, defer: bool = False) -> None:
         self.args = []
+        # (directory, glob) for files of an earlier run to clear when this one runs
+        self.stale = []
+        self.defer = defer
+
+    def executable(self) -> list:
+        if os.environ.get(FAKE_TOOLS_ENV):
+            return [sys.executable, str(FAKE_TOOLS_FP), self.name]
+        return [self.name]
 
     def _call(self):
-        logging.info(f"Calling: {self.args}")
+        args, stale = self.args, self.stale
+        timeout = timeout_for(self.name)
+        self.__init__(self.defer)
+        if self.defer:
+            from .Runner import ToolJob
+
+            return ToolJob(
+                self.name, args, timeout=timeout, before=lambda: remove_stale(stale)
+            )
+
+        logging.info(f"Calling: {args}")
+        remove_stale(stale)
         try:
-            sp.run(self.args, check=True)
-            logging.info(f"Completed process: {' '.join(self.args)}")
+            with timed(f"CLI:{self.name}"):
+                run_child(args, timeout)
+            logging.info(f"Completed process: {' '.join(args)}")
         except sp.CalledProcessError as e:
             logging.error(f"{' '.join(e.cmd)} returned code {e.returncode}")
-            sys.exit()
+            raise self._error(
+                args, "failed", e.returncode, f"returned code {e.returncode}"
+            )
         except sp.TimeoutExpired as e:
             logging.error(f"{' '.join(e.cmd)} timed out (timeout: {e.timeout})")
-            sys.exit()
-        
-        self.__init__()
+            raise self._error(args, "timeout", error=f"timed out after {e.timeout}s")
+        except OSError as e:
+            logging.error(f"{self.name} couldn't start: {e!r}")
+            raise self._error(args, "failed", error=repr(e))
+
+    def _error(self, args: list, status: str, returncode: int = None, error: str = ""):
+        from .Runner import ToolJob, ToolResult
+
+        return ToolError(
+            ToolResult(ToolJob(self.name, args), status, returncode, error=error)
+        )
 
 
 class MuscleAligner(CLI):
@@ -32,22 +111,27 @@ class MuscleAligner(CLI):
     v3
     """
 
+    name = "muscle"
+
     def call_simple(self, align: Path, output: Path):
-        self.args += ["muscle", "-in", str(align), "-out", str(output)]
-        self._call()
+        self.args += self.executable() + ["-in", str(align), "-out", str(output)]
+        return self._call()
 
     def call_profile(self, profile: bool, in1: Path, in2: Path, out: Path):
-        self.args.append("muscle")
+        self.args += self.executable()
         if profile:
             self.args.append("-profile")
         self.args += ["-in1", str(in1), "-in2", str(in2), "-out", str(out)]
 
-        self._call()
+        return self._call()
 
 
 class RAxMLTreeBuilder(CLI):
+    name = "raxmlHPC"
+
     def call(
         self,
+        a: Path = None,
         b: int = None,
         f: str = None,
         N: int = None,
@@ -60,10 +144,10 @@ class RAxMLTreeBuilder(CLI):
         z: Path = None,
     ):
         if n and w:
-            if (w / f"RAxML_info.{n}").exists():
-                logging.warning(f"{str(w / f'RAxML_info.{n}')} exists, skipping this tree-building step...")
-                return None
-        self.args += ["raxmlHPC"]
+            # RAxML refuses to overwrite a previous run's files, whether it finished or not
+            self.stale.append((w, f"RAxML_*.{n}"))
+        self.args += self.executable()
+        self.args += ["-a", str(a)] if a else []
         self.args += ["-b", str(b)] if b else []
         self.args += ["-f", f] if f else []
         self.args += ["-N", str(N)] if N else []
@@ -75,13 +159,14 @@ class RAxMLTreeBuilder(CLI):
         self.args += ["-w", str(w.resolve())] if w else []
         self.args += ["-z", str(z)] if z else []
 
-        self._call()
+        return self._call()
 
 
 class VsearchSearcher(CLI):
-    def call(self, u: Path, db: Path, id: float, fp: Path):
-        self.args += [
-            "vsearch",
+    name = "vsearch"
+
+    def call(self, u: Path, db: Path, id: float, fp: Path, userout: Path = None):
+        self.args += self.executable() + [
             "--usearch_global",
             str(u),
             "--db",
@@ -91,4 +176,42 @@ class VsearchSearcher(CLI):
             "--fastapairs",
             str(fp),
         ]
-        self._call()
+        if userout:
+            # Identity of each hit, for the fast path
+            self.args += ["--userout", str(userout), "--userfields", "query+target+id"]
+        return self._call()
+
+    def call_udb(
+        self, query: Path, udb: Path, id: float, fp: Path, userout: Path = None
+    ):
+        """
+        Search query against a prebuilt UDB database (make_udb), keeping every hit at id or
+        better, best first\n
+        Writes the same files as call, with the type species first in userout's rows
+        """
+        self.args += self.executable() + [
+            "--usearch_global",
+            str(query),
+            "--db",
+            str(udb),
+            "--id",
+            str(id),
+            "--maxaccepts",
+            "0",
+            "--maxrejects",
+            "0",
+            "--fastapairs",
+            str(fp),
+        ]
+        if userout:
+            self.args += ["--userout", str(userout), "--userfields", "target+query+id"]
+        return self._call()
+
+    def make_udb(self, fasta: Path, udb: Path):
+        self.args += self.executable() + [
+            "--makeudb_usearch",
+            str(fasta),
+            "--output",
+            str(udb),
+        ]
+        return self._call()
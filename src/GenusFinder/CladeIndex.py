@@ -0,0 +1,175 @@
+import logging
+import numpy as np
+from typing import Callable
+from .Metrics import timed
+
+# Trees are ete3 Trees, not imported here since only their methods are needed
+
+
+class CladeIndex:
+    """
+    Genus composition of every clade of a tree, from one walk over it\n
+    Nodes are numbered in postorder, which puts each node's leaves at contiguous positions
+    lo[node]:hi[node] in leaf order. Each leaf gets a genus id, and the ids in leaf order are
+    kept run-length encoded (relatives sit next to each other, so runs are long) plus, for
+    each genus, the sorted positions of its leaves. That gives a genus' count under a node in
+    O(log n) and a node's genus histogram in O(log n + runs under it), without storing
+    counts per node. Ancestors are found by binary lifting, so the smallest clade around
+    some leaves with at least N leaves is O(log n) too
+    """
+
+    @timed("CladeIndex.build")
+    def __init__(self, t, genus: Callable[[str], str]) -> None:
+        """
+        genus names each named leaf's genus, or None to leave it out of the counts (like
+        the query)
+        """
+        # Keep the nodes, so callers can get at their supports and distances
+        self.nodes = list(t.traverse("postorder"))
+        ids = {n: i for i, n in enumerate(self.nodes)}
+        n = len(self.nodes)
+
+        self.lo = np.empty(n, dtype=np.int64)
+        self.hi = np.empty(n, dtype=np.int64)
+        self.parent = np.full(n, -1, dtype=np.int64)
+        self.names = []
+        leaf_nodes = []
+        for i, node in enumerate(self.nodes):
+            if node.is_leaf():
+                self.lo[i] = len(self.names)
+                self.names.append(node.name)
+                leaf_nodes.append(i)
+                self.hi[i] = len(self.names)
+            else:
+                self.lo[i] = self.lo[ids[node.children[0]]]
+                self.hi[i] = self.hi[ids[node.children[-1]]]
+            if node.up:
+                self.parent[i] = ids[node.up]
+        self.leaf_nodes = np.array(leaf_nodes, dtype=np.int64)
+        self.size = self.hi - self.lo
+        self.root = n - 1
+
+        self.positions = {}
+        for pos, name in enumerate(self.names):
+            if name:
+                self.positions.setdefault(name, pos)
+
+        # Path length from the root, parents come before children in reverse postorder
+        self.depth = np.zeros(n)
+        for i in range(n - 2, -1, -1):
+            self.depth[i] = self.depth[self.parent[i]] + self.nodes[i].dist
+
+        # up[k][i] is i's 2^k-th ancestor, the root being its own parent
+        up = np.where(self.parent < 0, np.arange(n), self.parent)
+        self.up = [up]
+        for _ in range(max(1, int(n).bit_length())):
+            up = up[up]
+            self.up.append(up)
+
+        self.genus_ids = {}
+        self.leaf_genus = np.full(len(self.names), -1, dtype=np.int64)
+        for pos, name in enumerate(self.names):
+            g = genus(name) if name else None
+            if g is not None:
+                self.leaf_genus[pos] = self.genus_ids.setdefault(g, len(self.genus_ids))
+        self.genera = list(self.genus_ids)
+
+        starts = np.flatnonzero(np.diff(self.leaf_genus, prepend=-2))
+        self.run_starts = starts
+        self.run_ends = np.append(starts[1:], len(self.names))
+        self.run_genus = self.leaf_genus[starts]
+
+        order = np.argsort(self.leaf_genus, kind="stable")
+        bounds = np.searchsorted(
+            self.leaf_genus[order], np.arange(len(self.genera) + 1)
+        )
+        self.genus_positions = [
+            order[bounds[g] : bounds[g + 1]] for g in range(len(self.genera))
+        ]
+        logging.debug(
+            f"Indexed {len(self.names)} leaves of {len(self.genera)} genera in {len(starts)} runs"
+        )
+
+    def leaf(self, name: str) -> int:
+        """
+        Node id of the (first) leaf called name
+        """
+        return int(self.leaf_nodes[self.positions[name]])
+
+    def leaves(self, node: int) -> list:
+        return self.names[self.lo[node] : self.hi[node]]
+
+    def clade(self, names: list, min_leaves: int = 1) -> int:
+        """
+        The smallest clade holding all of names and at least min_leaves leaves, the root if
+        none does
+        """
+        pos = [self.positions[name] for name in names]
+        first, last = min(pos), max(pos)
+        # Holding both ends of the range means holding everything between them
+        ok = lambda i: self.hi[i] > last and self.size[i] >= min_leaves
+
+        node = int(self.leaf_nodes[first])
+        if ok(node):
+            return node
+        # Climb to the highest ancestor that still isn't big enough, then one more
+        for up in reversed(self.up):
+            if not ok(up[node]):
+                node = int(up[node])
+        return node if node == self.root else int(self.parent[node])
+
+    def count(self, node: int, genus: str) -> int:
+        """
+        How many of node's leaves are in genus
+        """
+        if genus not in self.genus_ids:
+            return 0
+        positions = self.genus_positions[self.genus_ids[genus]]
+        lo, hi = np.searchsorted(positions, [self.lo[node], self.hi[node]])
+        return int(hi - lo)
+
+    def histogram(self, node: int) -> dict:
+        """
+        Genus -> how many of node's leaves are in it, in order of first appearance
+        """
+        lo, hi = self.lo[node], self.hi[node]
+        first = np.searchsorted(self.run_starts, lo, side="right") - 1
+        last = np.searchsorted(self.run_starts, hi, side="left")
+        counts = {}
+        for start, end, g in zip(
+            self.run_starts[first:last],
+            self.run_ends[first:last],
+            self.run_genus[first:last],
+        ):
+            if g >= 0:
+                genus = self.genera[g]
+                counts[genus] = counts.get(genus, 0) + int(
+                    min(end, hi) - max(start, lo)
+                )
+        return counts
+
+    def genus_of(self, name: str) -> str:
+        g = self.leaf_genus[self.positions[name]]
+        return self.genera[g] if g >= 0 else None
+
+    def distances(self, name: str, node: int) -> np.ndarray:
+        """
+        Path length from leaf name to each of node's leaves (in leaf order), node has to be
+        one of its ancestors\n
+        Leaves first met going up at ancestor a are depth[leaf] + depth[name] - 2 depth[a]
+        away, so it's one pass up the path and a slice per ancestor
+        """
+        lo, hi = self.lo[node], self.hi[node]
+        i = self.leaf(name)
+        if not lo <= self.lo[i] < hi:
+            raise ValueError(f"{name} isn't under node {node}")
+
+        meet = np.empty(hi - lo)
+        meet[self.lo[i] - lo] = self.depth[i]
+        while i != node:
+            below = i
+            i = self.parent[i]
+            meet[self.lo[i] - lo : self.lo[below] - lo] = self.depth[i]
+            meet[self.hi[below] - lo : self.hi[i] - lo] = self.depth[i]
+        leaf_depth = self.depth[self.leaf_nodes[lo:hi]]
+        return leaf_depth + self.depth[self.leaf(name)] - 2 * meet
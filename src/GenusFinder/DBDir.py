@@ -1,79 +1,436 @@
 import collections
-import eutils
 import logging
 import os
 import re
-import requests
 import shutil
-import sys
 import tempfile
-from .CLI import MuscleAligner
+import threading
+from .CLI import MuscleAligner, VsearchSearcher
+from .FileLock import FileLock
+from .Manifest import Manifest, sha256
+from .Metrics import timed
+from .Storage import (
+    SUFFIXES,
+    BlockReader,
+    compress,
+    compressed_fp,
+    materialize,
+    open_text,
+    scratch_for,
+)
 from io import StringIO, TextIOWrapper
 from pathlib import Path
-from tqdm import tqdm
-from urllib.request import urlopen
-from xml.etree import ElementTree as ET
+
+LTP_VERSION = "06_2022"
+LTP_URL = "https://imedea.uib-csic.es/mmg/ltp/wp-content/uploads/ltp/"
+# Releases whose files don't follow the usual naming
+LTP_NAMES = {"01_2022": {"tree": "tree_LTP_all_01_2022.ntree"}}
+
+
+def ltp_names(version: str) -> dict:
+    names = {
+        "aligned": f"LTP_{version}_aligned.fasta",
+        "blastdb": f"LTP_{version}_blastdb.fasta",
+        "tree": f"LTP_all_{version}.ntree",
+        "csv": f"LTP_{version}.csv",
+    }
+    names.update(LTP_NAMES.get(version, {}))
+    return names
+
+
+def release_dir(root_fp: Path, version: str) -> Path:
+    return Path(root_fp) / f"LTP_{version}"
 
 
 class DBDir:
     """
     Controller for all of GenusFinder's database files\n
-    Maintains a 16S db made from an NCBI eutils query and mulitiple LTP files
+    Maintains a 16S db made from an NCBI eutils query and mulitiple LTP files\n
+    With compression ("gzip" or "zstd") each file is stored compressed once it's built,
+    internal readers stream it and getters hand external tools a plain copy in scratch\n
+    Everything from one LTP release, downloaded or derived, lives in its own directory so
+    releases can sit side by side, and manifest.json records how each file came to be\n
+    Any number of processes can share one DB, each file is built by whichever gets to it
+    first under a lock (in .locks) while the rest wait, and only appears, by an atomic
+    rename, once it's complete
     """
 
-    def __init__(self, fp: Path, esearch_api_key: str) -> None:
+    def __init__(
+        self,
+        fp: Path,
+        esearch_api_key: str,
+        compression: str = None,
+        scratch: Path = None,
+        ltp_version: str = LTP_VERSION,
+    ) -> None:
         self.root_fp = Path(fp)
-        os.makedirs(self.root_fp, exist_ok=True)
+        self.LTP_VERSION = ltp_version
+        self.LTP_URL = LTP_URL
+        self.release_fp = release_dir(self.root_fp, self.LTP_VERSION)
+        os.makedirs(self.release_fp, exist_ok=True)
+        self.manifest = Manifest(self.root_fp)
 
         self.key = esearch_api_key
+        self.compression = compression
+        self.scratch_fp = scratch_for(
+            self.release_fp, scratch if scratch else tempfile.gettempdir()
+        )
 
-        self.LTP_VERSION = "06_2022"
-        self.LTP_URL = f"https://imedea.uib-csic.es/mmg/ltp/wp-content/uploads/ltp/"
-
+        names = ltp_names(self.LTP_VERSION)
         self._16S_db = self.root_fp / "16S.db"
-        self.LTP_aligned_fp = self.root_fp / f"LTP_{self.LTP_VERSION}_aligned.fasta"
-        self.LTP_blastdb_fp = self.root_fp / f"LTP_{self.LTP_VERSION}_blastdb.fasta"
-        self.LTP_tree_fp = self.root_fp / f"LTP_all_{self.LTP_VERSION}.ntree"
-        self.LTP_csv_fp = self.root_fp / f"LTP_{self.LTP_VERSION}.csv"
-        self.type_species_fp = self.root_fp / "type_species.fasta"
+        self.LTP_aligned_fp = self.release_fp / names["aligned"]
+        self.LTP_blastdb_fp = self.release_fp / names["blastdb"]
+        self.LTP_tree_fp = self.release_fp / names["tree"]
+        self.LTP_csv_fp = self.release_fp / names["csv"]
+        self.type_species_fp = self.release_fp / "type_species.fasta"
+        self.kmer_index_fp = self.release_fp / "type_species_kmers"
+        self.type_species_udb_fp = self.release_fp / "type_species.udb"
+        self.genus_index = None
+        self.kmer_index = None
+        self.type_species_udb = None
+        self.LTP_tree = None
+        self.LTP_clade_index = None
+        self.LTP_aligned_offsets = None
+        # For the in-memory caches, which are shared by a batch's or a service's threads
+        self.lock = threading.Lock()
 
-    def get_16S_db(self) -> Path:
-        if not self._16S_db.exists():
-            logging.info(f"Creating {self._16S_db}...")
-            self._create_16S_db()
-        else:
-            logging.info(f"Found {self._16S_db}, skipping download...")
+        for name in list(names.values()) + [self.type_species_fp.name]:
+            if (self.root_fp / name).exists():
+                logging.warning(
+                    f"Found {self.root_fp / name} from before releases had their own "
+                    f"directories, move it (and anything derived from it) into {self.release_fp} to use it"
+                )
 
-        return self._16S_db
+    def get_16S_db(self) -> Path:
+        self._build(
+            self._16S_db,
+            self._create_16S_db,
+            "NCBI",
+            {"bioprojects": ["33175", "33317"]},
+        )
+        return self.plain(self._16S_db)
 
     def get_LTP_aligned(self) -> Path:
-        ret = self._get_LTP(self.LTP_aligned_fp, self.LTP_aligned_fp.name)
-        if not self.verify_alignment():
-            sys.exit()
-        return ret
+        self._get_LTP(self.LTP_aligned_fp, self.LTP_aligned_fp.name)
+        # Validated once, when it was built or adopted
+        if self.manifest.get(self.LTP_aligned_fp)["validated"] is False:
+            raise ValueError(
+                f"{self.LTP_aligned_fp} failed validation, remove it to download it again"
+            )
+        return self.plain(self.LTP_aligned_fp)
 
     def get_LTP_blastdb(self) -> Path:
-        return self._get_LTP(self.LTP_blastdb_fp, self.LTP_blastdb_fp.name)
+        self._get_LTP(self.LTP_blastdb_fp, self.LTP_blastdb_fp.name)
+        return self.plain(self.LTP_blastdb_fp)
 
     def get_LTP_tree(self) -> Path:
-        return self._get_LTP(self.LTP_tree_fp, self.LTP_tree_fp.name)
+        self._get_LTP(self.LTP_tree_fp, self.LTP_tree_fp.name)
+        return self.plain(self.LTP_tree_fp)
+
+    def read_LTP_tree(self):
+        """
+        Parse the LTP tree, which can span several lines and has quoted names and internal
+        node labels
+        """
+        from ete3 import Tree
+
+        with open(self.get_LTP_tree()) as f:
+            return Tree("".join(l.strip() for l in f), format=1, quoted_node_names=True)
+
+    def get_LTP_tree_object(self):
+        """
+        The parsed LTP tree, parsed once per DBDir, treat it as read-only
+        """
+        with self.lock:
+            if self.LTP_tree is None:
+                self.LTP_tree = self.read_LTP_tree()
+            return self.LTP_tree
+
+    def get_LTP_clade_index(self):
+        """
+        CladeIndex of the parsed LTP tree with each leaf's genus from the type species,
+        built once per DBDir, treat it as read-only
+        """
+        from .CladeIndex import CladeIndex
+
+        t = self.get_LTP_tree_object()
+        lookup = self.get_genus_index()
+        with self.lock:
+            if self.LTP_clade_index is None:
+                self.LTP_clade_index = CladeIndex(t, lookup.get)
+            return self.LTP_clade_index
+
+    def get_LTP_aligned_records(self, names: list) -> dict:
+        """
+        Name -> aligned sequence for just the named records, without reading the whole alignment
+        """
+        self.get_LTP_aligned()
+        stored = self.stored(self.LTP_aligned_fp)
+        if stored != self.LTP_aligned_fp:
+            with BlockReader(stored) as reader:
+                return {n: reader.get(n)[1] for n in names if n in reader}
+
+        with self.lock:
+            if self.LTP_aligned_offsets is None:
+                # Cleaned alignments alternate annotation and single line sequence
+                self.LTP_aligned_offsets = {}
+                with open(stored, "rb") as f:
+                    for line in f:
+                        if line[:1] == b">":
+                            name = line[1:].split(None, 1)[0].decode()
+                            self.LTP_aligned_offsets[name] = f.tell()
+            offsets = self.LTP_aligned_offsets
+
+        records = {}
+        with open(stored, "rb") as f:
+            for n in names:
+                if n in offsets:
+                    f.seek(offsets[n])
+                    records[n] = f.readline().strip().decode()
+        return records
 
     def get_LTP_csv(self) -> Path:
-        return self._get_LTP(self.LTP_csv_fp, self.LTP_csv_fp.name)
+        self._get_LTP(self.LTP_csv_fp, self.LTP_csv_fp.name)
+        return self.plain(self.LTP_csv_fp)
 
     def get_type_species(self) -> Path:
-        if not self.type_species_fp.exists():
-            logging.info(f"Creating {self.type_species_fp}...")
-            self._generate_type_species()
+        self.build_type_species()
+        return self.plain(self.type_species_fp)
+
+    def build_type_species(self) -> Path:
+        return self._build(
+            self.type_species_fp,
+            self._generate_type_species,
+            source=[self.manifest.key(self.LTP_blastdb_fp)],
+        )
+
+    ### Storage
+
+    def stored(self, fp: Path) -> Path:
+        """
+        fp, or its compressed form if that's how it's stored, or None if it isn't there
+        """
+        if fp.exists():
+            return fp
+        for codec in SUFFIXES:
+            if compressed_fp(fp, codec).exists():
+                return compressed_fp(fp, codec)
+        return None
+
+    def open_artifact(self, fp: Path):
+        """
+        Streaming text reader for fp however it's stored
+        """
+        return open_text(self.stored(fp))
+
+    def plain(self, fp: Path) -> Path:
+        """
+        A plain text copy of fp for external tools, decompressed to scratch if need be
+        """
+        stored = self.stored(fp)
+        if stored == fp:
+            return fp
+        with FileLock(self.lock_fp(fp, "plain")):
+            return materialize(stored, self.scratch_fp)
+
+    def lock_fp(self, fp: Path, purpose: str = "build") -> Path:
+        name = self.manifest.key(fp).replace("/", "__")
+        return self.root_fp / ".locks" / f"{name}.{purpose}.lock"
+
+    def _build(
+        self,
+        fp: Path,
+        build,
+        version: str = None,
+        params: dict = None,
+        source: list = None,
+    ) -> Path:
+        """
+        Build fp if it isn't stored yet, once however many processes want it at the same time\n
+        build(temp_fp) writes the file under fp's lock, returning whether it passed validation
+        if it went through any, and it's stored and recorded before the lock is released
+        """
+        if not self.stored(fp):
+            with FileLock(self.lock_fp(fp)):
+                # Someone else may have built it while we waited
+                if not self.stored(fp):
+                    logging.info(f"Creating {fp}...")
+                    temp_fp = fp.with_name(f".{fp.name}.{os.getpid()}.tmp")
+                    try:
+                        validated = build(temp_fp)
+                        self._store(temp_fp, fp, version, params, source, validated)
+                    finally:
+                        if temp_fp.exists():
+                            os.remove(temp_fp)
+                    return self.stored(fp)
+
+        logging.info(f"Found {fp}, skipping creation...")
+        self._adopt(fp, version)
+        return self.stored(fp)
+
+    def _store(
+        self,
+        temp_fp: Path,
+        fp: Path,
+        version: str = None,
+        params: dict = None,
+        source: list = None,
+        validated: bool = None,
+        compressed: bool = True,
+    ) -> Path:
+        """
+        Publish a finished temp_fp as fp, compressed if this DB is (and compressed), and record
+        it in the manifest
+        """
+        if self.compression and compressed:
+            dst = compress(
+                temp_fp, compressed_fp(fp, self.compression), self.compression
+            )
+            params = dict(params if params else {}, compression=self.compression)
         else:
-            logging.info(f"Found {self.type_species_fp}, skipping creation...")
+            dst = fp
+            os.replace(temp_fp, dst)
+        self.manifest.record(
+            fp, dst, version if version else self.LTP_VERSION, params, source, validated
+        )
+        return dst
 
-        return self.type_species_fp
-    
-    def _generate_type_species(self):
+    def _adopt(self, fp: Path, version: str = None):
+        """
+        Record a file that's already here but not in the manifest, like one put there by hand\n
+        The LTP alignment is validated now, this being the once it gets validated
+        """
+        if self.manifest.get(fp) is None:
+            # Or one that's still being recorded by whoever built it
+            with FileLock(self.lock_fp(fp)):
+                if self.manifest.get(fp) is None:
+                    logging.info(f"Adding existing {fp} to {self.manifest.fp}...")
+                    validated = None
+                    if fp == self.LTP_aligned_fp:
+                        validated = self.verify_alignment()
+                    self.manifest.record(
+                        fp,
+                        self.stored(fp),
+                        version if version else self.LTP_VERSION,
+                        source=["existing"],
+                        validated=validated,
+                    )
+
+    def validate(self) -> bool:
+        """
+        Check every artifact against its checksum and validate any that never have been
+        """
+        ok = not self.manifest.verify()
+        entry = self.manifest.get(self.LTP_aligned_fp)
+        if entry and entry["validated"] is None:
+            entry["validated"] = self.verify_alignment()
+            self.manifest.update(self.LTP_aligned_fp, entry)
+        return ok and (entry is None or entry["validated"])
+
+    def get_genus_index(self) -> dict:
+        """
+        Accession -> genus for every type species, parsed once per DBDir
+        """
+        with self.lock:
+            if self.genus_index is None:
+                genus_index = {}
+                with open_text(self.build_type_species()) as f:
+                    for l in f:
+                        if l[0] == ">":
+                            accession, species = l[1:].split("\t", 1)
+                            genus_index[accession] = species.split(" ")[0]
+                self.genus_index = genus_index
+            return self.genus_index
+
+    def get_kmer_index(self, k: int = 8):
+        """
+        KmerIndex over the type species, rebuilt if type_species.fasta has changed since
+        """
+        from .KmerIndex import KmerIndex
+
+        fasta_fp = self.build_type_species()
+        stat = fasta_fp.stat()
+        source = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        cached = self.kmer_index
+        if cached is None or cached.meta["source"] != source or cached.k != k:
+            with FileLock(self.lock_fp(self.kmer_index_fp)):
+                try:
+                    index = KmerIndex(self.kmer_index_fp)
+                    stale = index.meta["source"] != source or index.k != k
+                except FileNotFoundError:
+                    stale = True
+                if stale:
+                    KmerIndex.build(fasta_fp, self.kmer_index_fp, k, source)
+                    index = KmerIndex(self.kmer_index_fp)
+                else:
+                    logging.info(f"Found {self.kmer_index_fp}, skipping creation...")
+            self.kmer_index = index
+
+        return self.kmer_index
+
+    def get_type_species_udb(self) -> Path:
+        """
+        vsearch's UDB database of the type species, so searches load a prebuilt index instead
+        of indexing the FASTA every time\n
+        Rebuilt if type_species.fasta's checksum isn't the one it was built from, checked
+        once per DBDir. The checksum is kept with the UDB's build parameters along with the
+        size and mtime it was taken at, so it's only taken again once the FASTA changes.
+        It's binary and vsearch reads it directly, so it's always stored plain
+        """
+        with self.lock:
+            if self.type_species_udb is None:
+                fasta_fp = self.get_type_species()
+                fp = self.type_species_udb_fp
+                with FileLock(self.lock_fp(fp)):
+                    entry = self.manifest.get(fp)
+                    params = entry["params"] if entry else {}
+                    source = self.type_species_source(params)
+                    stored = self.stored(fp)
+                    if (
+                        stored != fp
+                        or params.get("source_sha256") != source["source_sha256"]
+                    ):
+                        if stored:
+                            logging.info(f"{fp} is out of date, rebuilding it...")
+                        temp_fp = fp.with_name(f".{fp.name}.{os.getpid()}.tmp")
+                        try:
+                            VsearchSearcher().make_udb(fasta_fp, temp_fp)
+                            # Renamed over the old one, which searches may still be reading
+                            self._store(
+                                temp_fp,
+                                fp,
+                                params=source,
+                                source=[self.manifest.key(self.type_species_fp)],
+                                compressed=False,
+                            )
+                        finally:
+                            if temp_fp.exists():
+                                os.remove(temp_fp)
+                        if stored and stored != fp:
+                            # One stored compressed before UDBs were kept plain
+                            os.remove(stored)
+                self.type_species_udb = self.plain(fp)
+            return self.type_species_udb
+
+    def type_species_source(self, params: dict) -> dict:
+        """
+        type_species.fasta's checksum, size and mtime as stored, with the checksum from params
+        (a UDB's build parameters) if the size and mtime there still match
+        """
+        stat = self.stored(self.type_species_fp).stat()
+        source = {"source_size": stat.st_size, "source_mtime_ns": stat.st_mtime_ns}
+        if all(params.get(k) == v for k, v in source.items()):
+            source["source_sha256"] = params.get("source_sha256")
+        else:
+            source["source_sha256"] = sha256(self.stored(self.type_species_fp))
+        return source
+
+    @timed("DBDir._generate_type_species")
+    def _generate_type_species(self, out_fp: Path):
         accession_cts = collections.defaultdict(int)
-        with open(self.get_LTP_blastdb()) as f_in:
-            with open(self.type_species_fp, "w") as f_out:
+        self._get_LTP(self.LTP_blastdb_fp, self.LTP_blastdb_fp.name)
+        with self.open_artifact(self.LTP_blastdb_fp) as f_in:
+            with open(out_fp, "w") as f_out:
                 for desc, seq in self._parse_fasta(f_in):
                     accession, species_name = self._parse_desc(desc)
                     if not accession or not species_name:
@@ -89,23 +446,38 @@ class DBDir:
                     f_out.write(">{0}\t{1}\n{2}\n".format(accession, species_name, seq))
 
     def _get_LTP(self, fp: Path, name: str) -> Path:
-        if not fp.exists():
-            url = self.url_for(name)
+        url = self.url_for(name)
+        params = {"url": url}
+        if "aligned" in name:
+            params["cleaned"] = True
+
+        def download(temp_fp: Path) -> bool:
+            from urllib.request import urlopen
+
             logging.info(f"Fetching {url}...")
-            with urlopen(url) as resp, open(fp, "wb") as f:
+            with timed(f"DBDir._get_LTP:{name}"), urlopen(url) as resp, open(
+                temp_fp, "wb"
+            ) as f:
                 shutil.copyfileobj(resp, f)
-            
+
             if "aligned" in name:
-                self.clean_alignment()
-        else:
-            logging.info(f"Found {fp}, skipping download...")
+                self.clean_alignment(temp_fp)
+                return self.verify_alignment(temp_fp)
+            return None
 
-        return fp
+        return self._build(fp, download, params=params, source=[url])
 
     def url_for(self, name: str) -> str:
         return f"{self.LTP_URL}{name}"
 
-    def _create_16S_db(self):
+    @timed("DBDir._create_16S_db")
+    def _create_16S_db(self, out_fp: Path):
+        # Only needed to build the DB, so kept out of every idgenus start-up
+        import eutils
+        import requests
+        from tqdm import tqdm
+        from xml.etree import ElementTree as ET
+
         def chunker(seq, size):
             return (seq[pos : pos + size] for pos in range(0, len(seq), size))
 
@@ -119,7 +491,7 @@ class DBDir:
 
         ec = eutils.Client(api_key=self.key)
 
-        with open(self._16S_db, "w") as db, tqdm(total=round(len(ids) / 250)) as pbar:
+        with open(out_fp, "w") as db, tqdm(total=round(len(ids) / 250)) as pbar:
             for group in chunker(ids, 250):
                 pbar.update(1)
                 egs = ec.efetch(db="nuccore", id=",".join(group))
@@ -127,7 +499,8 @@ class DBDir:
                     db.write(f">{str(seq)[6:-1]} {seq.organism}\n")
                     db.write(f"{seq.sequence}\n")
 
-    def clean_alignment(self):
+    @timed("DBDir.clean_alignment")
+    def clean_alignment(self, fp: Path = None):
         replacements_map = {
             " ": "", # LTP's weird syntax
             ".": "----",
@@ -151,26 +524,30 @@ class DBDir:
             "\n": "\n",
         }
 
+        from tqdm import tqdm
+
+        fp = fp if fp else self.LTP_aligned_fp
         logging.info("Cleaning LTP alignment...")
-        temp_fp = self.root_fp / "temp_alignment.fasta"
-        with open(temp_fp, "w") as f_temp, open(self.LTP_aligned_fp) as f_align:
-            with tqdm(total=len(f_align.readlines())) as pbar:
-                for line in f_align.readlines():
-                    pbar.update(1)
+        temp_fp = fp.with_name(f".{fp.name}.{os.getpid()}.clean.tmp")
+        with open(temp_fp, "w") as f_temp, open(fp) as f_align:
+            with tqdm(total=fp.stat().st_size, unit="B", unit_scale=True) as pbar:
+                for line in f_align:
+                    pbar.update(len(line))
                     if line[0] == ">":
                         f_temp.write(f"{line}")
                     else:
                         f_temp.write("".join([replacements_map[c] for c in line]))
-                
-        os.remove(self.LTP_aligned_fp)
-        os.rename(temp_fp, self.LTP_aligned_fp)
+
+        os.replace(temp_fp, fp)
     
-    def verify_alignment(self) -> bool:
-        with open(self.LTP_aligned_fp) as f:
-            last = False # False: seq last, True: annotation last
+    @timed("DBDir.verify_alignment")
+    def verify_alignment(self, fp: Path = None) -> bool:
+        acceptable_chars = set(["A", "C", "G", "T", "-", "\n"])
+        with open_text(fp) if fp else self.open_artifact(self.LTP_aligned_fp) as f:
             seq_len = 0 # Get seq len on first pass
-            for line in f.readlines():
-                if last:
+            # Cleaned alignments alternate annotation and single line sequence
+            for i, line in enumerate(f):
+                if i % 2 == 0:
                     if line[0] != ">":
                         logging.error("Annotation line doesn't start with '>'")
                         return False
@@ -178,16 +555,14 @@ class DBDir:
                         logging.error("Annotation line empty")
                         return False
                 else:
-                    acceptable_chars = set(["A", "C", "G", "T", "-", "\n"])
                     if seq_len == 0:
                         seq_len = len(line)
                     elif seq_len != len(line):
                         logging.error("Ragged alignment")
                         return False
-                    if set(list(line)).issubset(acceptable_chars):
-                        logging.error(f"{set(list(line))} is not subset of {acceptable_chars}")
+                    if not set(line).issubset(acceptable_chars):
+                        logging.error(f"{set(line)} is not subset of {acceptable_chars}")
                         return False
-                last = not last
             return True
     
     @staticmethod
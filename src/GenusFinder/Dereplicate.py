@@ -0,0 +1,108 @@
+import bisect
+import json
+import logging
+import os
+import re
+import shutil
+from pathlib import Path
+from .Metrics import timed
+
+# Sorts after every base, so a + END bounds the sorted strings starting with a
+END = "~"
+
+
+def normalize(seq: str) -> str:
+    """
+    seq without whitespace or alignment gaps, in upper case DNA
+    """
+    return re.sub(r"[\s.-]", "", seq).upper().replace("U", "T")
+
+
+def longest_extension(seqs: list, i: int) -> int:
+    """
+    Index of the longest of the sorted seqs that starts with seqs[i] (other than itself),
+    None if there aren't any
+    """
+    end = bisect.bisect_left(seqs, seqs[i] + END, i + 1)
+    if end == i + 1:
+        return None
+    return max(range(i + 1, end), key=lambda j: len(seqs[j]))
+
+
+@timed("dereplicate")
+def dereplicate(batch: list, contained: bool = False) -> list:
+    """
+    (representative's index, relation) for each (id, sequence) in batch, where relation is
+    unique, exact or contained and a representative is its own, unique, representative\n
+    Sequences are the same if they're identical once normalized, the first is kept. With
+    contained, one that is a prefix or suffix of a longer one is run as that one (through
+    any chain of them, up to the longest)
+    """
+    firsts = {}
+    reps = []
+    for i, (_, seq) in enumerate(batch):
+        first = firsts.setdefault(normalize(seq), i)
+        reps.append((first, "unique" if first == i else "exact"))
+
+    if contained:
+        uniques = [s for s in firsts if s]
+        longer = {}
+        # Prefixes of the reversed sequences are suffixes of the sequences
+        for step in (1, -1):
+            seqs = sorted(s[::step] for s in uniques)
+            for i in range(len(seqs)):
+                j = longest_extension(seqs, i)
+                if j is None:
+                    continue
+                a, b = seqs[i][::step], seqs[j][::step]
+                if len(b) > len(longer.get(a, "")):
+                    longer[a] = b
+
+        tops = {}
+        for seq, first in firsts.items():
+            top = seq
+            # Each step is strictly longer, so this ends
+            while top in longer:
+                top = longer[top]
+            if top != seq:
+                tops[first] = firsts[top]
+        reps = [
+            (tops[rep], "contained") if rep in tops else (rep, relation)
+            for rep, relation in reps
+        ]
+
+    n_unique = sum(relation == "unique" for _, relation in reps)
+    logging.info(f"Dereplicated {len(batch)} queries to {n_unique} representatives")
+    return reps
+
+
+def fan_out(rep_fp: Path, rep_id: str, fp: Path, relation: str):
+    """
+    Give a duplicate's output dir fp its representative's probabilities, plus a note of which
+    query they came from\n
+    Metrics from when it was last run itself are removed, it took no time of its own
+    """
+    os.makedirs(fp, exist_ok=True)
+    if (fp / "metrics.json").exists():
+        os.remove(fp / "metrics.json")
+    if (rep_fp / "probabilities.tsv").exists():
+        shutil.copyfile(rep_fp / "probabilities.tsv", fp / "probabilities.tsv")
+    with open(fp / "dereplicated.json", "w") as f:
+        json.dump(
+            {"representative": rep_id, "output": str(rep_fp), "relation": relation},
+            f,
+            indent=1,
+        )
+
+
+def reduction(reps: list) -> dict:
+    """
+    How much dereplicating a batch cut it down by, from dereplicate's output
+    """
+    relations = [relation for _, relation in reps]
+    return {
+        "queries": len(reps),
+        "unique": relations.count("unique"),
+        "exact": relations.count("exact"),
+        "contained": relations.count("contained"),
+    }
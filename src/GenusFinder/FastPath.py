@@ -0,0 +1,53 @@
+import collections
+import logging
+from pathlib import Path
+
+
+def read_hits(fp: Path) -> list:
+    """
+    (type species accession, percent identity) from a search's identity table, best first\n
+    Searches write the type species as the first column, whichever side of the search it was
+    """
+    hits = []
+    with open(fp) as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) >= 3:
+                hits.append((fields[0].split()[0], float(fields[2])))
+    return sorted(hits, key=lambda h: -h[1])
+
+
+class FastPath:
+    """
+    Calls the genus straight from the search hits when they leave no doubt, so the query
+    can skip alignment and tree building\n
+    A call needs at least min_hits type species at min_id percent identity or better, with
+    at least min_agreement of them from one genus
+    """
+
+    def __init__(
+        self, min_id: float = 99.0, min_agreement: float = 1.0, min_hits: int = 3
+    ) -> None:
+        self.min_id = min_id
+        self.min_agreement = min_agreement
+        self.min_hits = min_hits
+
+    def call(self, hits: list, lookup: dict) -> tuple:
+        """
+        (genus -> share of the close hits, reason) or (None, reason) if the tree is needed
+        """
+        close = [acc for acc, ident in hits if ident >= self.min_id]
+        if len(close) < self.min_hits:
+            return None, f"{len(close)} hits >= {self.min_id}% identity"
+
+        counts = collections.Counter(lookup.get(acc, "UNKNOWN") for acc in close)
+        genus, n = counts.most_common(1)[0]
+        agreement = n / len(close)
+        reason = (
+            f"{len(close)} hits >= {self.min_id}% identity, {agreement:.1%} {genus}"
+        )
+        if agreement < self.min_agreement or genus == "UNKNOWN":
+            return None, reason
+
+        logging.info(f"Fast path call: {reason}")
+        return {g: c / len(close) for g, c in counts.most_common()}, reason
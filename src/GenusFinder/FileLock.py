@@ -0,0 +1,78 @@
+import fcntl
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+# POSIX record locks belong to the process, so threads also need a lock of their own
+_thread_locks = {}
+_thread_locks_lock = threading.Lock()
+
+
+def _thread_lock(fp: Path) -> threading.Lock:
+    key = os.path.realpath(fp)
+    with _thread_locks_lock:
+        return _thread_locks.setdefault(key, threading.Lock())
+
+
+class FileLock:
+    """
+    Exclusive lock on fp between processes and threads, for use as a context manager\n
+    Uses fcntl record locks (lockf) rather than flock because NFS supports them through
+    lockd. The lock file itself is left behind, removing it would let two holders in
+    """
+
+    def __init__(self, fp: Path, timeout: float = None, poll_s: float = 0.05) -> None:
+        self.fp = Path(fp)
+        self.timeout = timeout
+        self.poll_s = poll_s
+        self.fd = None
+        self.thread_lock = _thread_lock(self.fp)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def acquire(self):
+        start = time.monotonic()
+        if not self.thread_lock.acquire(
+            timeout=self.timeout if self.timeout is not None else -1
+        ):
+            raise TimeoutError(f"Timed out waiting for {self.fp}")
+
+        try:
+            os.makedirs(self.fp.parent, exist_ok=True)
+            self.fd = os.open(self.fp, os.O_RDWR | os.O_CREAT, 0o666)
+            waiting = False
+            while True:
+                try:
+                    fcntl.lockf(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except OSError:
+                    if not waiting:
+                        logging.info(
+                            f"Waiting for another process to release {self.fp}..."
+                        )
+                        waiting = True
+                    if (
+                        self.timeout is not None
+                        and time.monotonic() - start > self.timeout
+                    ):
+                        raise TimeoutError(f"Timed out waiting for {self.fp}")
+                    time.sleep(self.poll_s)
+        except BaseException:
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+            self.thread_lock.release()
+            raise
+
+    def release(self):
+        fcntl.lockf(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+        self.fd = None
+        self.thread_lock.release()
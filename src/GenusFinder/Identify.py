@@ -0,0 +1,259 @@
+import concurrent.futures as cf
+import contextvars
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Callable
+
+from . import Subtree, parse_fasta
+from .Bootstrap import AdaptiveBootstrap
+from .CLI import MuscleAligner, RAxMLTreeBuilder, VsearchSearcher
+from .DBDir import DBDir
+from .FastPath import FastPath, read_hits
+from .Metrics import current, timed
+from .OutputDir import reduce_neighbours
+from .Prune import ReferencePruner
+from .Storage import scratch_dir
+from .Subtree import BASE_TREE_PARAMS, BOOTSTRAP_PARAMS, PLACEMENT_PARAMS
+
+
+class Workspace:
+    """
+    Directory for the files the external tools read and write, only made once one runs\n
+    A temporary one under scratch is removed by close(), one given as fp is kept
+    """
+
+    def __init__(self, fp: Path = None, scratch: str = "auto") -> None:
+        self.given = fp is not None
+        self.fp = Path(fp) if fp else None
+        self.scratch = scratch
+
+    def get(self) -> Path:
+        if self.fp is None:
+            scratch = scratch_dir(self.scratch)
+            self.fp = Path(tempfile.mkdtemp(prefix="genusfinder_", dir=scratch))
+        self.fp.mkdir(parents=True, exist_ok=True)
+        return self.fp
+
+    def close(self):
+        if self.fp and not self.given:
+            shutil.rmtree(self.fp, ignore_errors=True)
+
+
+def search(seq: str, db: DBDir, id: float, searcher: str, ws: Workspace) -> tuple:
+    """
+    (neighbour (id, sequence) records, (accession, percent identity) hits best first) for
+    seq, with the k-mer searcher entirely in memory
+    """
+    if searcher == "kmer":
+        from .KmerIndex import KmerSearcher
+
+        neighbours = KmerSearcher(db.get_kmer_index()).neighbours(seq, id)
+        records = [(label, s) for label, s, _ in neighbours]
+        # Rounded like the identity table the searchers write
+        hits = [
+            (label.split()[0], round(ident * 100, 1)) for label, _, ident in neighbours
+        ]
+        return records, hits
+
+    query_fp = ws.get() / "query.fasta"
+    with open(query_fp, "w") as f:
+        f.write(f">UNKNOWN\n{seq}\n")
+    VsearchSearcher().call_udb(
+        query_fp,
+        db.get_type_species_udb(),
+        id,
+        ws.get() / "nearest_seqs.fasta",
+        ws.get() / "nearest_hits.tsv",
+    )
+    with open(ws.get() / "nearest_seqs.fasta") as f:
+        records = list(parse_fasta(f))
+    return records, read_hits(ws.get() / "nearest_hits.tsv")
+
+
+def place(
+    seq: str,
+    db: DBDir,
+    hits: list,
+    ws: Workspace,
+    pruner: ReferencePruner = None,
+    compress: bool = False,
+) -> Path:
+    """
+    Place seq in the LTP tree for the full tree method, or with pruner in the clade around
+    its hits, returning RAxML's tree with it placed
+    """
+    query_fp = ws.get() / "query.fasta"
+    with open(query_fp, "w") as f:
+        f.write(f">UNKNOWN\n{seq}\n")
+
+    if pruner:
+        with timed("stage:prune_reference"):
+            reference_tree = ws.get() / "reference_pruned.newick"
+            reference_aligned = ws.get() / "reference_pruned.fasta"
+            info = pruner.call(
+                db.get_LTP_clade_index(),
+                db.get_LTP_aligned_records,
+                hits,
+                reference_tree,
+                reference_aligned,
+            )
+            if current():
+                current().info["prune"] = info
+    else:
+        reference_tree, reference_aligned = db.get_LTP_tree(), db.get_LTP_aligned()
+
+    with timed("stage:profile_align"):
+        combined = ws.get() / "combined_alignment.fasta"
+        MuscleAligner().call_profile(True, reference_aligned, query_fp, combined)
+
+    weights = None
+    if compress:
+        with timed("stage:compress_combined"):
+            patterns, weights = (
+                ws.get() / "combined_patterns.fasta",
+                ws.get() / "combined_weights.txt",
+            )
+            Subtree.compress("compress_combined", combined, patterns, weights)
+            combined = patterns
+
+    with timed("stage:placement"):
+        RAxMLTreeBuilder().call(
+            **PLACEMENT_PARAMS, a=weights, s=combined, t=reference_tree, w=ws.get()
+        )
+    return ws.get() / f"RAxML_labelledTree.{PLACEMENT_PARAMS['n']}"
+
+
+def identify_seq(
+    seq: str,
+    db: DBDir,
+    id: float = 0.9,
+    searcher: str = "kmer",
+    lookup: dict = None,
+    fast_path: FastPath = None,
+    adaptive: AdaptiveBootstrap = None,
+    compress: bool = False,
+    jobs: int = 2,
+    work_fp: Path = None,
+    scratch: str = "auto",
+    on_probs: Callable[[str, dict], None] = None,
+    full_tree: bool = False,
+    pruner: ReferencePruner = None,
+) -> dict:
+    """
+    Subtree method identification of one sequence, with the query, hits, neighbours and trees
+    passed between stages in memory rather than through an OutputDir, followed by the full
+    tree method (placement pruned by pruner, if given) with full_tree\n
+    Files are only written for the external tools (vsearch, muscle and RAxML), in work_fp if
+    it's given and otherwise in a temporary directory under scratch that's removed after.
+    With the k-mer searcher, a fast path call writes nothing at all. With jobs > 1 the base
+    tree is built alongside the bootstraps, and on_probs gets each method's probabilities as
+    soon as they're ready\n
+    Returns the tier, the reason for it, the search hits, the probabilities by method (keys
+    of Subtree.HEADERS) and, for the tree tier, the supported subtree
+    """
+    seq = "".join(seq.split())
+    lookup = lookup if lookup else db.get_genus_index()
+    result = {"tier": "tree", "reason": "fast path off", "probs": {}, "tree": None}
+
+    def add_probs(method: str, probs: dict):
+        result["probs"][method] = probs
+        if on_probs:
+            on_probs(method, probs)
+
+    ws = Workspace(work_fp, scratch)
+    try:
+        with timed("stage:search"):
+            neighbours, result["hits"] = search(seq, db, id, searcher, ws)
+
+        with timed("stage:triage"):
+            result["tier"], probs, result["reason"] = Subtree.triage(
+                result["hits"], fast_path, lookup
+            )
+        if probs:
+            add_probs("fast_path", probs)
+            return result
+
+        with timed("stage:reduce"):
+            reduced_fp = ws.get() / "nearest_seqs_reduced.fasta"
+            with open(reduced_fp, "w") as f:
+                for name, s in reduce_neighbours(neighbours, "UNKNOWN"):
+                    f.write(f"> {name}\n{s}\n")
+                f.write(f">UNKNOWN\n{seq}\n")
+
+        with timed("stage:align"):
+            aligned = ws.get() / "nearest_seqs_aligned.fasta"
+            MuscleAligner().call_simple(reduced_fp, aligned)
+
+        weights = None
+        if compress:
+            with timed("stage:compress_sites"):
+                patterns, weights = (
+                    ws.get() / "patterns.fasta",
+                    ws.get() / "weights.txt",
+                )
+                Subtree.compress("compress_sites", aligned, patterns, weights)
+                aligned = patterns
+
+        def base_tree():
+            with timed("stage:base_tree"):
+                Subtree.base_tree(aligned, weights, ws.get())
+
+        # Only adaptive bootstrapping needs the base tree to start
+        pool = (
+            cf.ThreadPoolExecutor(max_workers=1) if jobs > 1 and not adaptive else None
+        )
+        if pool:
+            base = pool.submit(contextvars.copy_context().run, base_tree)
+        else:
+            base_tree()
+        base_tree_fp = ws.get() / f"RAxML_bestTree.{BASE_TREE_PARAMS['n']}"
+        bootstraps_fp = ws.get() / f"RAxML_bootstrap.{BOOTSTRAP_PARAMS['n']}"
+
+        from .Algorithms import Algorithms
+        from .Bipartitions import place_supports
+
+        def load_algorithms(t) -> Algorithms:
+            return Algorithms(t, db.build_type_species(), lookup=lookup)
+
+        if adaptive:
+
+            def probs_for(t) -> dict:
+                result["tree"] = t
+                return load_algorithms(t).bootstrap_probs()
+
+            with timed("stage:bootstraps"):
+                Subtree.adaptive_bootstraps(
+                    adaptive,
+                    aligned,
+                    base_tree_fp,
+                    ws.get(),
+                    bootstraps_fp,
+                    probs_for,
+                    weights,
+                )
+        else:
+            try:
+                with timed("stage:bootstraps"):
+                    Subtree.bootstraps(aligned, weights, ws.get())
+            finally:
+                if pool:
+                    pool.shutdown()
+            if pool:
+                base.result()
+            with timed("stage:bipartitions"):
+                result["tree"] = place_supports(base_tree_fp, bootstraps_fp)
+
+        with timed("stage:subtree_probs"):
+            for method, probs in Subtree.subtree_probs(load_algorithms(result["tree"])):
+                add_probs(method, probs)
+
+        if full_tree:
+            combined_tree = place(seq, db, result["hits"], ws, pruner, compress)
+            with timed("stage:full_tree_probs"):
+                add_probs(
+                    "full_tree", Subtree.full_tree_probs(combined_tree, db, lookup)
+                )
+        return result
+    finally:
+        ws.close()
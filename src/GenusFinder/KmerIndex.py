@@ -0,0 +1,211 @@
+import json
+import logging
+import os
+import shutil
+import numpy as np
+from pathlib import Path
+from . import parse_fasta
+from .Metrics import timed
+from .Storage import open_text
+
+ENCODING = np.full(256, 255, dtype=np.uint8)
+for i, c in enumerate("ACGT"):
+    ENCODING[ord(c)] = ENCODING[ord(c.lower())] = i
+ENCODING[ord("U")] = ENCODING[ord("u")] = 3
+
+
+def kmer_codes(seq: str, k: int) -> np.ndarray:
+    """
+    Sorted unique 2-bit packed k-mers of seq, skipping any containing a non-ACGT character
+    """
+    codes = ENCODING[np.frombuffer(seq.encode(), dtype=np.uint8)]
+    if len(codes) < k:
+        return np.empty(0, dtype=np.uint32)
+    windows = np.lib.stride_tricks.sliding_window_view(codes, k)
+    windows = windows[(windows != 255).all(axis=1)].astype(np.uint32)
+    shifts = np.arange(2 * (k - 1), -1, -2, dtype=np.uint32)
+    return np.unique((windows << shifts).sum(axis=1, dtype=np.uint32))
+
+
+def identity(a: str, b: str) -> float:
+    """
+    Identity of the shorter sequence aligned anywhere in the longer one (end gaps are free,
+    as with vsearch's default identity definition) from Myers' bit-vector edit distance
+    """
+    p, t = (a, b) if len(a) <= len(b) else (b, a)
+    m = len(p)
+    if m == 0:
+        return 0.0
+    full = (1 << m) - 1
+    peq = {}
+    for i, c in enumerate(p):
+        peq[c] = peq.get(c, 0) | (1 << i)
+
+    pv, mv, score, best = full, 0, m, m
+    high = 1 << (m - 1)
+    for c in t:
+        eq = peq.get(c, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & full)
+        mh = pv & xh
+        if ph & high:
+            score += 1
+        elif mh & high:
+            score -= 1
+        ph = (ph << 1) & full
+        mh = (mh << 1) & full
+        pv = mh | (~(xv | ph) & full)
+        mv = ph & xv
+        best = min(best, score)
+    return 1 - best / m
+
+
+class KmerIndex:
+    """
+    k-mer inverted index over a FASTA file, stored as NumPy arrays that are memory-mapped
+    at load so opening it costs next to nothing\n
+    postings[offsets[kmer]:offsets[kmer + 1]] are the ids of the sequences containing kmer
+    """
+
+    FILES = ["offsets", "postings", "n_kmers", "seq_offsets", "seqs"]
+
+    def __init__(self, fp: Path) -> None:
+        self.fp = Path(fp)
+        with open(self.fp / "meta.json") as f:
+            self.meta = json.load(f)
+        self.k = self.meta["k"]
+        for name in self.FILES:
+            setattr(self, name, np.load(self.fp / f"{name}.npy", mmap_mode="r"))
+        with open(self.fp / "labels.txt") as f:
+            self.labels = [l.rstrip("\n") for l in f]
+        self.ids = {label: i for i, label in enumerate(self.labels)}
+
+    @staticmethod
+    @timed("KmerIndex.build")
+    def build(fasta_fp: Path, fp: Path, k: int = 8, source: dict = None) -> Path:
+        """
+        Index fasta_fp (plain or compressed) into directory fp, source is recorded in meta.json for staleness checks
+        """
+        logging.info(f"Building {k}-mer index of {fasta_fp}...")
+        labels, seqs, kmers = [], [], []
+        with open_text(fasta_fp) as f:
+            for desc, seq in parse_fasta(f):
+                labels.append(desc)
+                seqs.append(seq.upper())
+                kmers.append(kmer_codes(seq, k))
+
+        n_kmers = np.array([len(km) for km in kmers], dtype=np.uint32)
+        all_kmers = np.concatenate(kmers) if kmers else np.empty(0, dtype=np.uint32)
+        ids = np.repeat(np.arange(len(kmers), dtype=np.uint32), n_kmers)
+        order = np.argsort(all_kmers, kind="stable")
+        offsets = np.zeros(4**k + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(all_kmers, minlength=4**k))
+
+        encoded = [s.encode() for s in seqs]
+        seq_offsets = np.zeros(len(seqs) + 1, dtype=np.int64)
+        seq_offsets[1:] = np.cumsum([len(s) for s in encoded])
+
+        temp_fp = fp.with_name(f".{fp.name}.tmp")
+        shutil.rmtree(temp_fp, ignore_errors=True)
+        os.makedirs(temp_fp)
+        arrays = {
+            "offsets": offsets,
+            "postings": ids[order],
+            "n_kmers": n_kmers,
+            "seq_offsets": seq_offsets,
+            "seqs": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+        }
+        for name, arr in arrays.items():
+            np.save(temp_fp / f"{name}.npy", arr)
+        with open(temp_fp / "labels.txt", "w") as f:
+            f.writelines(f"{l}\n" for l in labels)
+        with open(temp_fp / "meta.json", "w") as f:
+            json.dump({"k": k, "n": len(labels), "source": source}, f)
+
+        shutil.rmtree(fp, ignore_errors=True)
+        os.rename(temp_fp, fp)
+        return fp
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def get_seq(self, i: int) -> str:
+        return bytes(self.seqs[self.seq_offsets[i] : self.seq_offsets[i + 1]]).decode()
+
+    @timed("KmerIndex.search")
+    def search(
+        self, query: str, top_n: int = 50, min_id: float = 0.0, refine: bool = True
+    ) -> list:
+        """
+        Up to top_n (label, identity) hits, best first\n
+        Candidates are ranked by shared k-mers. With refine, identity comes from aligning each
+        candidate, otherwise it is estimated as (shared fraction) ** (1 / k)
+        """
+        q = kmer_codes(query.upper(), self.k)
+        if len(q) == 0 or len(self) == 0:
+            return []
+        starts, ends = self.offsets[q], self.offsets[q + 1]
+        hits = np.concatenate(
+            [self.postings[s:e] for s, e in zip(starts, ends) if e > s] or [[]]
+        ).astype(np.int64)
+        shared = np.bincount(hits, minlength=len(self))
+
+        # Refining can reorder candidates, so look a little past top_n
+        n_candidates = min(len(self), top_n * 2 if refine else top_n)
+        candidates = np.argpartition(-shared, n_candidates - 1)[:n_candidates]
+        candidates = candidates[shared[candidates] > 0]
+
+        results = []
+        for i in candidates:
+            if refine:
+                ident = identity(query.upper(), self.get_seq(i))
+            else:
+                frac = shared[i] / min(len(q), max(int(self.n_kmers[i]), 1))
+                ident = float(frac ** (1 / self.k))
+            if ident >= min_id:
+                results.append((self.labels[i], ident, int(i)))
+
+        results.sort(key=lambda r: (-r[1], r[2]))
+        return [(label, ident) for label, ident, _ in results[:top_n]]
+
+
+class KmerSearcher:
+    """
+    In-process stand-in for VsearchSearcher, writes the same fastapairs-style neighbour file
+    """
+
+    def __init__(self, index: KmerIndex, top_n: int = 50, refine: bool = True) -> None:
+        self.index = index
+        self.top_n = top_n
+        self.refine = refine
+
+    def neighbours(self, query: str, id: float) -> list:
+        """
+        (label, sequence, identity) of each type species at id or better, best first
+        """
+        hits = self.index.search(query, self.top_n, id, self.refine)
+        logging.info(f"Found {len(hits)} neighbours with {self.index.k}-mer search")
+        return [
+            (label, self.index.get_seq(self.index.ids[label]), ident)
+            for label, ident in hits
+        ]
+
+    def call(self, u: Path, db: Path, id: float, fp: Path, userout: Path = None):
+        """
+        Same arguments as VsearchSearcher.call, u must be the FASTA the index was built from
+        """
+        with open(db) as f:
+            query_desc, query = next(parse_fasta(f))
+
+        hits = self.neighbours(query, id)
+        with open(fp, "w") as f:
+            for label, seq, _ in hits:
+                f.write(f">{label}\n{seq}\n")
+                f.write(f">{query_desc}\n{query}\n\n")
+        if userout:
+            # Same columns as VsearchSearcher's userout, type species first
+            with open(userout, "w") as f:
+                for label, _, ident in hits:
+                    f.write(f"{label.split()[0]}\t{query_desc.split()[0]}\t")
+                    f.write(f"{ident * 100:.1f}\n")
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime
+from pathlib import Path
+from .FileLock import FileLock
+
+FORMAT = 1
+
+
+def sha256(fp: Path) -> str:
+    h = hashlib.sha256()
+    with open(fp, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class Manifest:
+    """
+    manifest.json at the root of a DB, recording for each artifact (keyed by its plain path
+    relative to the root) where it's stored, its release, checksum, build parameters, what
+    it was built from and whether it passed validation (None if it never went through it)
+    """
+
+    def __init__(self, root_fp: Path) -> None:
+        self.root_fp = Path(root_fp)
+        self.fp = self.root_fp / "manifest.json"
+        # Other processes may be adding their own artifacts at the same time
+        self.lock_fp = self.root_fp / ".locks" / "manifest.json.lock"
+
+    def key(self, fp: Path) -> str:
+        return Path(fp).relative_to(self.root_fp).as_posix()
+
+    def load(self) -> dict:
+        try:
+            with open(self.fp) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"format": FORMAT, "artifacts": {}}
+
+    def get(self, fp: Path) -> dict:
+        return self.load()["artifacts"].get(self.key(fp))
+
+    def record(
+        self,
+        fp: Path,
+        stored_fp: Path,
+        version: str,
+        params: dict = None,
+        source: list = None,
+        validated: bool = None,
+    ) -> dict:
+        entry = {
+            "path": self.key(stored_fp),
+            "version": version,
+            "sha256": sha256(stored_fp),
+            "size": stored_fp.stat().st_size,
+            "params": params if params else {},
+            "source": source if source else [],
+            "validated": validated,
+            "built": datetime.now().isoformat(timespec="seconds"),
+        }
+        return self.update(fp, entry)
+
+    def update(self, fp: Path, entry: dict) -> dict:
+        with FileLock(self.lock_fp):
+            manifest = self.load()
+            manifest["artifacts"][self.key(fp)] = entry
+            temp_fp = self.fp.with_name(f".{self.fp.name}.{os.getpid()}.tmp")
+            with open(temp_fp, "w") as f:
+                json.dump(manifest, f, indent=1, sort_keys=True)
+            os.replace(temp_fp, self.fp)
+        return entry
+
+    def verify(self) -> list:
+        """
+        Keys of artifacts that are missing or no longer match their checksum
+        """
+        bad = []
+        for key, entry in self.load()["artifacts"].items():
+            fp = self.root_fp / entry["path"]
+            if not fp.exists() or sha256(fp) != entry["sha256"]:
+                logging.error(f"{fp} is missing or doesn't match its checksum")
+                bad.append(key)
+        return bad
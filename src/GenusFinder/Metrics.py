@@ -0,0 +1,259 @@
+import argparse
+import contextvars
+import json
+import logging
+import os
+import signal
+import subprocess as sp
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from .Profile import profiled
+
+
+class Metrics:
+    """
+    Collects wall time, CPU time and child process resource usage for each stage of one query\n
+    Child figures are for the tools run with run_child inside a stage (as the CLI wrappers
+    do), each measured with wait4 on its own process, so stages running at the same time
+    don't pick up each other's tools
+    """
+
+    def __init__(self) -> None:
+        self.records = []
+        # Anything else worth keeping about the query, like its I/O volume
+        self.info = {}
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+
+    def add(self, record: dict):
+        with self.lock:
+            self.records.append(record)
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            records = list(self.records)
+        return {
+            "wall_s": time.perf_counter() - self.start,
+            "child_maxrss_kb": max((r["child_maxrss_kb"] for r in records), default=0),
+            "records": records,
+            **self.info,
+        }
+
+    def write(self, fp: Path):
+        with open(fp, "w") as f:
+            json.dump(self.to_dict(), f, indent=1)
+        logging.info(f"Wrote metrics to {fp}")
+
+
+_current = contextvars.ContextVar("metrics", default=None)
+# Child usage totals of the stages being timed, innermost last
+_children = contextvars.ContextVar("children", default=())
+_children_lock = threading.Lock()
+
+
+def current() -> Metrics:
+    return _current.get()
+
+
+def set_current(metrics: Metrics) -> contextvars.Token:
+    return _current.set(metrics)
+
+
+def reset_current(token: contextvars.Token):
+    _current.reset(token)
+
+
+def add_child_usage(usage):
+    """
+    Count a finished child's rusage towards every stage it ran in
+    """
+    # Linux reports kilobytes, macOS bytes
+    maxrss = usage.ru_maxrss // 1024 if sys.platform == "darwin" else usage.ru_maxrss
+    with _children_lock:
+        for totals in _children.get():
+            totals["cpu_s"] += usage.ru_utime + usage.ru_stime
+            totals["maxrss_kb"] = max(totals["maxrss_kb"], maxrss)
+
+
+def run_child(args: list, timeout: float = None):
+    """
+    Run args to completion, like subprocess.run with check, and add its own resource usage
+    to the stages it runs in\n
+    Raises CalledProcessError if it fails and TimeoutExpired, once it's been killed, if it
+    runs past timeout
+    """
+    proc = sp.Popen(args)
+    lock = threading.Lock()
+    state = {"reaped": False, "killed": False}
+
+    def kill():
+        with lock:
+            # Only while it's unreaped, so the pid can't be someone else's by now
+            if not state["reaped"]:
+                state["killed"] = True
+                os.kill(proc.pid, signal.SIGKILL)
+
+    timer = threading.Timer(timeout, kill) if timeout else None
+    if timer:
+        timer.start()
+    try:
+        _, status, usage = os.wait4(proc.pid, 0)
+    except BaseException:
+        kill()
+        os.wait4(proc.pid, 0)
+        proc.returncode = -signal.SIGKILL
+        raise
+    finally:
+        with lock:
+            state["reaped"] = True
+        if timer:
+            timer.cancel()
+    # Popen would otherwise try to reap it again
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    add_child_usage(usage)
+    if state["killed"]:
+        raise sp.TimeoutExpired(args, timeout)
+    if proc.returncode != 0:
+        raise sp.CalledProcessError(proc.returncode, args)
+
+
+@contextmanager
+def timed(stage: str):
+    """
+    Record a stage in the current Metrics, if there is one, and profile it with the current
+    Profiler, if there is one\n
+    Works as a context manager or a decorator
+    """
+    with profiled(stage):
+        metrics = _current.get()
+        if metrics is None:
+            yield
+            return
+
+        children = {"cpu_s": 0.0, "maxrss_kb": 0}
+        token = _children.set(_children.get() + (children,))
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            _children.reset(token)
+            metrics.add(
+                {
+                    "stage": stage,
+                    "start_s": wall - metrics.start,
+                    "wall_s": time.perf_counter() - wall,
+                    "cpu_s": time.thread_time() - cpu,
+                    "child_cpu_s": children["cpu_s"],
+                    "child_maxrss_kb": children["maxrss_kb"],
+                    "ok": ok,
+                }
+            )
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = (len(values) - 1) * q / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def summarize(metrics_fps: list) -> dict:
+    """
+    Aggregate metrics files from many queries into per-stage percentiles
+    """
+    stages = {}
+    totals = {"wall_s": [], "child_maxrss_kb": []}
+    tiers = {}
+    bootstraps = []
+    for fp in metrics_fps:
+        with open(fp) as f:
+            m = json.load(f)
+        totals["wall_s"].append(m["wall_s"])
+        totals["child_maxrss_kb"].append(m["child_maxrss_kb"])
+        for k, v in m.get("io", {}).items():
+            if not isinstance(v, bool):
+                totals.setdefault(k, []).append(v)
+        if "tier" in m:
+            tiers[m["tier"]] = tiers.get(m["tier"], 0) + 1
+        if "bootstrap" in m:
+            bootstraps.append(m["bootstrap"])
+        for r in m["records"]:
+            s = stages.setdefault(
+                r["stage"],
+                {"wall_s": [], "cpu_s": [], "child_cpu_s": [], "failures": 0},
+            )
+            for k in ("wall_s", "cpu_s", "child_cpu_s"):
+                s[k].append(r[k])
+            s["failures"] += not r["ok"]
+
+    def stats(values: list) -> dict:
+        return {
+            "mean": sum(values) / len(values) if values else 0.0,
+            "p50": percentile(values, 50),
+            "p90": percentile(values, 90),
+            "p99": percentile(values, 99),
+            "max": max(values) if values else 0.0,
+        }
+
+    summary = {
+        "queries": len(metrics_fps),
+        "total": {k: stats(v) for k, v in totals.items()},
+        "stages": {
+            name: dict(
+                {k: stats(s[k]) for k in ("wall_s", "cpu_s", "child_cpu_s")},
+                count=len(s["wall_s"]),
+                failures=s["failures"],
+            )
+            for name, s in sorted(stages.items())
+        },
+    }
+    if tiers:
+        # Which queries the fast path called and which went on to the trees
+        summary["tiers"] = tiers
+        summary["fast_path_fraction"] = tiers.get("fast_path", 0) / sum(tiers.values())
+    if bootstraps:
+        # Adaptive bootstrapping, against always running the maximum
+        mean = sum(b["replicates"] for b in bootstraps) / len(bootstraps)
+        summary["bootstrap"] = {
+            "mean_replicates": mean,
+            "converged": sum(b["converged"] for b in bootstraps),
+            "speedup": sum(b["max_replicates"] for b in bootstraps)
+            / len(bootstraps)
+            / mean,
+        }
+    return summary
+
+
+def find_metrics(paths: list) -> list:
+    fps = []
+    for p in map(Path, paths):
+        fps += sorted(p.rglob("metrics.json")) if p.is_dir() else [p]
+    return fps
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(
+        description="Summarize the metrics.json files of many GenusFinder runs"
+    )
+    p.add_argument(
+        "paths", nargs="+", help="metrics files or directories to search for them"
+    )
+    p.add_argument("--output", help="where to write the summary (Default: stdout)")
+
+    args = p.parse_args(argv)
+
+    summary = summarize(find_metrics(args.paths))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=1)
+    else:
+        json.dump(summary, sys.stdout, indent=1)
@@ -1,8 +1,30 @@
 import logging
 import os
 import shutil
+import tarfile
+import tempfile
 from pathlib import Path
 from . import parse_fasta
+from .Metrics import timed
+from .Results import ResultsWriter
+
+# The most neighbours a subtree is built from
+MAX_NEIGHBOURS = 50
+
+
+def reduce_neighbours(records, query_id: str) -> list:
+    """
+    The first MAX_NEIGHBOURS distinct (id, seq) among a search's neighbour records, without
+    the query
+    """
+    ids = {}
+    for id, seq in records:
+        # Each fastapairs pair also holds the query, and taxa can't repeat in the tree
+        if len(id.strip()) > 2 and id != query_id and id not in ids:
+            ids[id] = seq
+        if len(ids) >= MAX_NEIGHBOURS:
+            break
+    return list(ids.items())
 
 
 class OutputDir:
@@ -10,15 +32,37 @@ class OutputDir:
     Controller for all of GenusFinder's output files
     """
 
-    def __init__(self, fp: Path, seq: str, overwrite: bool) -> None:
-        self.root_fp = Path(fp)
+    def __init__(
+        self,
+        fp: Path,
+        seq: str,
+        overwrite: bool,
+        results: ResultsWriter = None,
+        query_id: str = "UNKNOWN",
+        scratch: Path = None,
+    ) -> None:
+        # With scratch, intermediates go to a private workspace there and only the declared
+        # results are copied back to final_fp by finish(). The pipeline state stays in
+        # final_fp, and what a previous run left there is restored into the workspace
+        self.final_fp = Path(fp)
+        # Shared structured results, rows are labelled with query_id
+        self.results = results
+        self.query_id = query_id
 
         self.overwriteQ = overwrite
-        if overwrite and self.root_fp.exists():
-            logging.warning(f"Found existing output dir {self.root_fp}, overwriting...")
-            shutil.rmtree(self.root_fp)
+        if overwrite and self.final_fp.exists():
+            logging.warning(
+                f"Found existing output dir {self.final_fp}, overwriting..."
+            )
+            shutil.rmtree(self.final_fp)
 
-        os.makedirs(self.root_fp, exist_ok=True)
+        os.makedirs(self.final_fp, exist_ok=True)
+        if scratch:
+            os.makedirs(scratch, exist_ok=True)
+            self.root_fp = Path(tempfile.mkdtemp(prefix="genusfinder_", dir=scratch))
+            logging.info(f"Using scratch workspace {self.root_fp}")
+        else:
+            self.root_fp = self.final_fp
 
         try:
             if Path(seq).exists():
@@ -37,14 +81,27 @@ class OutputDir:
         self.bootstrapped_tree_fp = self.root_fp / "RAxML_bipartitions.final"
 
         self.combined_alignment_fp = self.root_fp / "combined_alignment.fasta"
-        self.combined_tree_fp = self.root_fp / "RAxML_bestTree.combined"
+        self.combined_patterns_fp = self.root_fp / "combined_patterns.fasta"
+        self.combined_weights_fp = self.root_fp / "combined_weights.txt"
+        self.combined_tree_fp = self.root_fp / "RAxML_labelledTree.combined"
+        self.pruned_tree_fp = self.root_fp / "reference_pruned.newick"
+        self.pruned_alignment_fp = self.root_fp / "reference_pruned.fasta"
 
         self.nearest_seqs_fp = self.root_fp / "nearest_seqs.fasta"
+        self.nearest_hits_fp = self.root_fp / "nearest_hits.tsv"
         self.temp_nearest_seqs_fp = self.root_fp / "temp_nearest_seqs.fasta"
         self.nearest_seqs_reduced_fp = self.root_fp / "nearest_seqs_reduced.fasta"
         self.nearest_seqs_aligned_fp = self.root_fp / "nearest_seqs_aligned.fasta"
+        self.nearest_seqs_patterns_fp = self.root_fp / "nearest_seqs_patterns.fasta"
+        self.nearest_seqs_weights_fp = self.root_fp / "nearest_seqs_weights.txt"
 
         self.probs_fp = self.root_fp / "probabilities.tsv"
+        self.pipeline_state_fp = self.final_fp / "pipeline_state.json"
+        self.metrics_fp = self.final_fp / "metrics.json"
+        self.archive_fp = self.final_fp / "artifacts.tar.gz"
+
+        if self.root_fp != self.final_fp:
+            self.restore()
 
     ### Getters
 
@@ -60,12 +117,27 @@ class OutputDir:
     def get_combined_alignment(self) -> Path:
         return self.combined_alignment_fp
 
+    def get_combined_patterns(self) -> Path:
+        return self.combined_patterns_fp
+
+    def get_combined_weights(self) -> Path:
+        return self.combined_weights_fp
+
     def get_combined_tree(self) -> Path:
         return self.combined_tree_fp
 
+    def get_pruned_tree(self) -> Path:
+        return self.pruned_tree_fp
+
+    def get_pruned_alignment(self) -> Path:
+        return self.pruned_alignment_fp
+
     def get_nearest_seqs(self) -> Path:
         return self.nearest_seqs_fp
-    
+
+    def get_nearest_hits(self) -> Path:
+        return self.nearest_hits_fp
+
     def get_nearest_reduced_seqs(self) -> Path:
         if not self.nearest_seqs_reduced_fp.exists():
             self.reduce_subtree()
@@ -74,37 +146,130 @@ class OutputDir:
     def get_nearest_seqs_aligned(self) -> Path:
         return self.nearest_seqs_aligned_fp
 
+    def get_nearest_seqs_patterns(self) -> Path:
+        return self.nearest_seqs_patterns_fp
+
+    def get_nearest_seqs_weights(self) -> Path:
+        return self.nearest_seqs_weights_fp
+
     def get_query(self) -> Path:
         return self.query_fp
-    
+
+    def get_pipeline_state(self) -> Path:
+        return self.pipeline_state_fp
+
+    def get_metrics(self) -> Path:
+        return self.metrics_fp
+
+    def get_declared_results(self) -> list:
+        return [
+            self.query_fp,
+            self.bootstrapped_tree_fp,
+            self.combined_tree_fp,
+            self.probs_fp,
+        ]
+
     ### Utilities
-    
+
+    @timed("OutputDir.restore")
+    def restore(self):
+        """
+        Copy a previous run's declared results and archived intermediates from final_fp into
+        the scratch workspace, so the stages that made them can be skipped
+        """
+        restored = 0
+        for fp in self.get_declared_results():
+            prev = self.final_fp / fp.name
+            if prev.exists() and not fp.exists():
+                shutil.copy2(prev, fp)
+                restored += 1
+        if self.archive_fp.exists():
+            with tarfile.open(self.archive_fp) as tar:
+                members = tar.getmembers()
+                # Only plain files under the workspace, where supported
+                kwargs = {"filter": "data"} if hasattr(tarfile, "data_filter") else {}
+                tar.extractall(self.root_fp, **kwargs)
+            restored += len(members)
+        if restored:
+            logging.info(f"Restored {restored} files from {self.final_fp}")
+
+    @timed("OutputDir.finish")
+    def finish(self, archive: bool = False) -> dict:
+        """
+        Copy the declared results (and, with archive, a gzipped tarball of everything else)
+        out of the scratch workspace and remove it\n
+        Returns the query's I/O volume, for the output dir itself when there's no scratch
+        """
+        sizes = {
+            fp: fp.stat().st_size for fp in self.root_fp.rglob("*") if fp.is_file()
+        }
+        io = {
+            "scratch": self.root_fp != self.final_fp,
+            "files": len(sizes),
+            "intermediate_bytes": sum(sizes.values()),
+            "copied_bytes": 0,
+            "archive_bytes": 0,
+        }
+        if self.root_fp == self.final_fp:
+            return io
+
+        declared = set(self.get_declared_results())
+        for fp, size in sizes.items():
+            if fp in declared:
+                shutil.copy2(fp, self.final_fp / fp.name)
+                io["copied_bytes"] += size
+        if archive:
+            with tarfile.open(self.archive_fp, "w:gz") as tar:
+                for fp in sizes:
+                    if fp not in declared:
+                        tar.add(fp, arcname=str(fp.relative_to(self.root_fp)))
+            io["archive_bytes"] = self.archive_fp.stat().st_size
+
+        shutil.rmtree(self.root_fp)
+        logging.info(
+            f"Copied {io['copied_bytes']} of {io['intermediate_bytes']} bytes out of {self.root_fp}"
+        )
+        return io
+
+    @timed("OutputDir.reduce_subtree")
     def reduce_subtree(self):
-        ids = []
-        with open(self.nearest_seqs_fp) as f_in, open(self.nearest_seqs_reduced_fp, "w") as f_out:
-            for id, seq in parse_fasta(f_in):
-                if len(id.strip()) > 2:
-                    ids.append(id)
-                    f_out.write(f"> {id}\n")
-                    f_out.write(f"{seq}\n")
-                if len(ids) >= 50:
-                    break
-
-            logging.debug(f"Reduced accessions list: {str(ids)}")
-
-        with open(self.nearest_seqs_reduced_fp, "a+") as f, open(self.query_fp) as query_f:
+        with open(self.query_fp) as f:
+            query_id = f.readline()[1:].strip()
+
+        with open(self.nearest_seqs_fp) as f_in, open(
+            self.nearest_seqs_reduced_fp, "w"
+        ) as f_out:
+            neighbours = reduce_neighbours(parse_fasta(f_in), query_id)
+            for id, seq in neighbours:
+                f_out.write(f"> {id}\n")
+                f_out.write(f"{seq}\n")
+
+            logging.debug(f"Reduced accessions list: {[id for id, _ in neighbours]}")
+
+        with open(self.nearest_seqs_reduced_fp, "a+") as f, open(
+            self.query_fp
+        ) as query_f:
             f.write(f"{query_f.readline().strip()}\n")
             f.write(f"{query_f.readline().strip()}\n")
 
     ### Writers
 
-    def write_probs(self, probs: dict, header: str = "", write_mode: str = "a+"):
+    def write_probs(
+        self, probs: dict, header: str = "", write_mode: str = "a+", method: str = ""
+    ):
+        if self.results:
+            self.results.add(self.query_id, method if method else header, probs)
         with open(self.probs_fp, write_mode) as f:
             f.write(f"\n{header}\n\n")
             for s, p in probs.items():
                 if p > 0.0001:
                     f.write(f"{s.split(' ')[0]}\t{round(p * 100, 5)}\n")
 
+    def write_tier(self, tier: str, reason: str):
+        # Starts probs_fp, so it also clears any earlier run's probabilities
+        with open(self.probs_fp, "w") as f:
+            f.write(f"Tier: {tier} ({reason})\n")
+
     def write_query(self, query: str):
         with open(self.query_fp, "w") as f:
             f.write(">UNKNOWN\n")
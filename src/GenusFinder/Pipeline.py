@@ -0,0 +1,204 @@
+import concurrent.futures as cf
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from .Metrics import timed
+from typing import Callable, Iterable, Union
+
+
+class Stage:
+    """
+    A single step of the pipeline with declared inputs, outputs and parameters\n
+    Inputs can be paths or callables returning paths (e.g. DBDir getters), callables are
+    only resolved when the stage is about to run\n
+    A stage with a when callable that returns False once its dependencies are done is
+    skipped, without resolving its inputs, and counts as done
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable,
+        inputs: Iterable[Union[Path, Callable]] = (),
+        outputs: Iterable[Path] = (),
+        params: dict = None,
+        after: Iterable[str] = (),
+        cache: bool = True,
+        when: Callable[[], bool] = None,
+    ) -> None:
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = [Path(o) for o in outputs]
+        self.params = params if params else {}
+        self.after = list(after)
+        self.cache = cache
+        self.when = when
+
+    def resolve_inputs(self) -> list:
+        return [Path(i()) if callable(i) else Path(i) for i in self.inputs]
+
+
+class Pipeline:
+    """
+    Runs a graph of Stages, concurrently where the graph allows it\n
+    Dependencies are inferred from matching one stage's inputs to another's outputs (plus any
+    explicit `after` names). A stage is skipped only if the hash of its inputs and parameters
+    matches the one stored in state_fp from its last successful run and all of its outputs exist\n
+    Paths under root are hashed relative to it, so a workspace that moves between runs (like
+    a --scratch one) still matches
+    """
+
+    def __init__(self, state_fp: Path, jobs: int = 1, root: Path = None) -> None:
+        self.state_fp = Path(state_fp)
+        self.jobs = max(1, jobs)
+        self.root = Path(root).resolve() if root else None
+        self.stages = {}
+        self.lock = threading.Lock()
+
+        self.state = {"files": {}, "stages": {}}
+        if self.state_fp.exists():
+            try:
+                with open(self.state_fp) as f:
+                    self.state = json.load(f)
+            except ValueError:
+                logging.warning(
+                    f"Couldn't read {self.state_fp}, rerunning all stages..."
+                )
+
+    def add(self, stage: Stage) -> Stage:
+        if stage.name in self.stages:
+            raise ValueError(f"Duplicate stage name: {stage.name}")
+        self.stages[stage.name] = stage
+        return stage
+
+    def dependencies(self, stage: Stage) -> set:
+        produced_by = {o: s.name for s in self.stages.values() for o in s.outputs}
+        deps = {
+            produced_by[Path(i)]
+            for i in stage.inputs
+            if not callable(i) and Path(i) in produced_by
+        }
+        deps.update(a for a in stage.after if a in self.stages)
+        deps.discard(stage.name)
+        return deps
+
+    def run(self) -> None:
+        deps = {name: self.dependencies(s) for name, s in self.stages.items()}
+        pending = dict(self.stages)
+        done = set()
+        running = {}
+
+        with cf.ThreadPoolExecutor(max_workers=self.jobs) as ex:
+            while pending or running:
+                for name in [n for n in pending if deps[n] <= done]:
+                    ctx = contextvars.copy_context()
+                    running[ex.submit(ctx.run, self._run_stage, pending.pop(name))] = (
+                        name
+                    )
+
+                if not running:
+                    raise ValueError(
+                        f"Unsatisfiable stage dependencies: {list(pending)}"
+                    )
+
+                finished, _ = cf.wait(running, return_when=cf.FIRST_COMPLETED)
+                for fut in finished:
+                    name = running.pop(fut)
+                    try:
+                        fut.result()
+                    except BaseException:
+                        for other in running:
+                            other.cancel()
+                        raise
+                    done.add(name)
+
+    def _run_stage(self, stage: Stage):
+        if stage.when and not stage.when():
+            logging.info(f"Stage {stage.name} isn't needed, skipping...")
+            return None
+
+        inputs = stage.resolve_inputs()
+        h = self.stage_hash(stage, inputs) if stage.cache else None
+
+        with self.lock:
+            prev = self.state["stages"].get(stage.name, {})
+        if h and prev.get("hash") == h and all(o.exists() for o in stage.outputs):
+            logging.info(f"Stage {stage.name} is up to date, skipping...")
+            return None
+
+        # Never let a stale or partial output stand in for this run's
+        for o in stage.outputs:
+            if o.exists():
+                logging.debug(f"Removing stale output {o}")
+                os.remove(o)
+        with self.lock:
+            self.state["stages"].pop(stage.name, None)
+            self._save()
+
+        logging.info(f"Running stage {stage.name}...")
+        with timed(f"stage:{stage.name}"):
+            stage.func()
+
+        missing = [str(o) for o in stage.outputs if not o.exists()]
+        if missing:
+            logging.warning(
+                f"Stage {stage.name} didn't produce {missing}, it will rerun next time"
+            )
+            return None
+        if h:
+            with self.lock:
+                self.state["stages"][stage.name] = {
+                    "hash": h,
+                    "outputs": [str(o) for o in stage.outputs],
+                }
+                self._save()
+
+    def stage_hash(self, stage: Stage, inputs: list) -> str:
+        h = hashlib.sha256()
+        h.update(stage.name.encode())
+        h.update(json.dumps(stage.params, sort_keys=True, default=str).encode())
+        for fp in inputs:
+            h.update(self.key(fp).encode())
+            h.update(self.file_digest(fp).encode())
+        return h.hexdigest()
+
+    def key(self, fp: Path) -> str:
+        """
+        How fp is known in the state, relative to root if it's under it
+        """
+        fp = fp.resolve()
+        if self.root and self.root in fp.parents:
+            return str(fp.relative_to(self.root))
+        return str(fp)
+
+    def file_digest(self, fp: Path) -> str:
+        """
+        Content digest of fp, cached by (size, mtime) so large DB files aren't rehashed every run
+        """
+        if not fp.exists():
+            return ""
+        st = fp.stat()
+        key = self.key(fp)
+        with self.lock:
+            cached = self.state["files"].get(key)
+        if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+            return cached[2]
+
+        h = hashlib.sha256()
+        with open(fp, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        with self.lock:
+            self.state["files"][key] = [st.st_size, st.st_mtime_ns, h.hexdigest()]
+        return h.hexdigest()
+
+    def _save(self):
+        temp_fp = self.state_fp.with_name(f".{self.state_fp.name}.tmp")
+        with open(temp_fp, "w") as f:
+            json.dump(self.state, f, indent=1)
+        os.replace(temp_fp, self.state_fp)
@@ -0,0 +1,217 @@
+import contextvars
+import cProfile
+import logging
+import os
+import pstats
+import re
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+MODES = ["cprofile", "sample"]
+# Call paths carrying less than this share of a function's time aren't worth following
+MIN_SHARE = 1e-4
+MAX_DEPTH = 128
+
+
+def frame_label(filename: str, name: str) -> str:
+    if filename == "~":
+        # Builtins, whose name already says what they are
+        return name.replace(";", ",")
+    return f"{Path(filename).name}:{name}".replace(";", ",")
+
+
+def collapse(stats: dict, root: str) -> Counter:
+    """
+    Collapsed stacks (root;caller;...;callee -> microseconds) from pstats' stats dict\n
+    cProfile only keeps caller -> callee totals, not whole stacks, so a function's time is
+    split between the paths that reach it in proportion to how much of it each caller
+    accounts for. Recursion is cut where a function would reappear on its own path
+    """
+    children = {}
+    for func, (_, _, _, ct, callers) in stats.items():
+        for caller, edge in callers.items():
+            children.setdefault(caller, []).append((func, edge[3]))
+
+    stacks = Counter()
+    todo = [
+        (func, (root,), 1.0)
+        for func, (_, _, _, _, callers) in stats.items()
+        if not any(c in stats for c in callers)
+    ]
+    while todo:
+        func, path, share = todo.pop()
+        path = path + (frame_label(func[0], func[2]),)
+        us = int(stats[func][2] * share * 1e6)
+        if us:
+            stacks[";".join(path)] += us
+        if len(path) >= MAX_DEPTH:
+            continue
+        seen = set(path)
+        for child, ct in children.get(func, []):
+            child_ct = stats[child][3]
+            child_share = share * ct / child_ct if child_ct else 0.0
+            if child_share < MIN_SHARE or frame_label(child[0], child[2]) in seen:
+                continue
+            todo.append((child, path, child_share))
+    return stacks
+
+
+class Profiler:
+    """
+    Profiles each stage (the outermost timed block on a thread) and writes what it found to
+    a directory when it's closed\n
+    In cprofile mode every call is traced, giving <stage>.prof for pstats or snakeviz and
+    <stage>.folded collapsed stacks for flamegraph.pl. In sample mode a background thread
+    records the stack of each stage's thread every interval seconds instead, which costs
+    much less, and only the collapsed stacks are written\n
+    Either way, only the stage's own thread is profiled, not threads it starts
+    """
+
+    def __init__(
+        self, fp: Path, mode: str = "cprofile", interval: float = 0.005
+    ) -> None:
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiling mode: {mode}")
+        self.fp = Path(fp)
+        self.mode = mode
+        self.interval = interval
+        self.lock = threading.Lock()
+        # Thread ident -> stage it's running
+        self.active = {}
+        self.profiles = {}
+        self.samples = {}
+
+        self.stop = threading.Event()
+        self.sampler = None
+        if mode == "sample":
+            self.sampler = threading.Thread(target=self._sample, daemon=True)
+            self.sampler.start()
+
+    @contextmanager
+    def stage(self, name: str):
+        ident = threading.get_ident()
+        with self.lock:
+            # Nested timed blocks are already covered by the stage around them
+            nested = ident in self.active
+            if not nested:
+                self.active[ident] = name
+        if nested:
+            yield
+            return
+
+        profile = None
+        if self.mode == "cprofile":
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError as e:
+                # Python 3.12+ only allows one profiler at a time, across threads
+                logging.warning(f"Couldn't profile {name}: {e}")
+                profile = None
+        try:
+            yield
+        finally:
+            if profile:
+                profile.disable()
+            with self.lock:
+                self.active.pop(ident)
+                if profile:
+                    self.profiles.setdefault(name, []).append(profile)
+
+    def _sample(self):
+        while not self.stop.wait(self.interval):
+            with self.lock:
+                active = dict(self.active)
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for ident, name in active.items():
+                frame = frames.get(ident)
+                stack = []
+                while frame:
+                    stack.append(
+                        frame_label(frame.f_code.co_filename, frame.f_code.co_name)
+                    )
+                    frame = frame.f_back
+                # Leave out this module's own frames at the bottom of the stage
+                stack = [s for s in stack if not s.startswith("Profile.py:")]
+                key = ";".join([name] + stack[::-1])
+                with self.lock:
+                    self.samples.setdefault(name, Counter())[key] += 1
+
+    def close(self) -> list:
+        """
+        Write each stage's profile, returns the files written
+        """
+        if self.sampler:
+            self.stop.set()
+            self.sampler.join()
+
+        with self.lock:
+            profiles, samples = dict(self.profiles), dict(self.samples)
+        if not profiles and not samples:
+            return []
+
+        os.makedirs(self.fp, exist_ok=True)
+        written = []
+        for name in sorted(set(profiles) | set(samples)):
+            base = re.sub(r"[^\w.-]+", "_", name)
+            if name in profiles:
+                stats = pstats.Stats(profiles[name][0])
+                for profile in profiles[name][1:]:
+                    stats.add(profile)
+                stats.dump_stats(self.fp / f"{base}.prof")
+                written.append(self.fp / f"{base}.prof")
+                stacks = collapse(stats.stats, name)
+            else:
+                stacks = samples[name]
+            with open(self.fp / f"{base}.folded", "w") as f:
+                for stack, count in sorted(stacks.items()):
+                    f.write(f"{stack} {count}\n")
+            written.append(self.fp / f"{base}.folded")
+        logging.info(
+            f"Wrote {self.mode} profiles of {len(set(profiles) | set(samples))} stages to {self.fp}"
+        )
+        return written
+
+
+_current = contextvars.ContextVar("profiler", default=None)
+
+
+def current() -> Profiler:
+    return _current.get()
+
+
+@contextmanager
+def profiling(fp: Path, mode: str = "cprofile", interval: float = 0.005):
+    """
+    Profile the timed stages run in this context (and contexts copied from it), writing
+    them to fp at the end, or do nothing if mode is empty
+    """
+    if not mode:
+        yield None
+        return
+
+    profiler = Profiler(fp, mode, interval)
+    token = _current.set(profiler)
+    try:
+        yield profiler
+    finally:
+        _current.reset(token)
+        profiler.close()
+
+
+@contextmanager
+def profiled(stage: str):
+    """
+    Profile a stage with the current Profiler, if there is one
+    """
+    profiler = _current.get()
+    if profiler is None:
+        yield
+        return
+    with profiler.stage(stage):
+        yield
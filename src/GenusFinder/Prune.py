@@ -0,0 +1,166 @@
+import logging
+import threading
+from pathlib import Path
+from typing import Callable
+from .Metrics import timed
+
+# Trees are ete3 Trees, not imported here to keep it out of idgenus start-up
+
+# Characters that can't appear in an unquoted Newick label
+NEWICK_SPECIAL = set(" \t()[]',:;")
+
+
+def accession(name: str) -> str:
+    """
+    The accession a reference leaf or alignment record is known by, its first word\n
+    LTP's tree labels leaves like 'AB000001 Genus species, strain' while its alignment and
+    the search hits only go by the accession
+    """
+    return name.split(None, 1)[0] if name and name.strip() else name
+
+
+def quote(name: str) -> str:
+    """
+    name as a Newick label, single quoted (with quotes doubled) if it needs to be
+    """
+    if NEWICK_SPECIAL.isdisjoint(name):
+        return name
+    return "'" + name.replace("'", "''") + "'"
+
+
+def induced_newick(t, keep: set, label: Callable[[str], str] = str) -> str:
+    """
+    Newick of the subtree of t spanning only the leaves named in keep, with the branch
+    lengths between them preserved and each leaf written as label(name), quoted if needed\n
+    Doesn't modify t (so a parsed reference tree can be shared between threads) and doesn't
+    recurse (so deep trees are fine)
+    """
+    reps = {}
+    for n in t.traverse("postorder"):
+        if n.is_leaf():
+            reps[n] = (quote(label(n.name)), n.dist) if n.name in keep else None
+            continue
+        kids = [reps.pop(c) for c in n.children]
+        kids = [k for k in kids if k]
+        if not kids:
+            reps[n] = None
+        elif len(kids) == 1:
+            # Unary after pruning, so it's folded into the branch below
+            reps[n] = (kids[0][0], kids[0][1] + n.dist)
+        else:
+            reps[n] = ("(" + ",".join(f"{s}:{d:.6f}" for s, d in kids) + ")", n.dist)
+
+    root = reps[t]
+    return f"{root[0] if root else ''};\n"
+
+
+class ReferencePruner:
+    """
+    Cuts the reference tree and alignment down to the clade around a query's search hits,
+    so placement works on a neighbourhood rather than all of LTP\n
+    The clade is the smallest one holding the n_hits best hits and at least min_leaves
+    leaves, plus the closest leaf outside it as an outgroup to anchor where it was cut.
+    Leaves, alignment rows and hits are matched by accession, which is also what the pruned
+    tree and alignment call them
+    """
+
+    def __init__(self, min_leaves: int = 50, n_hits: int = 10) -> None:
+        self.min_leaves = min_leaves
+        self.n_hits = n_hits
+        # Accession -> leaf name for the last index seen, the reference's is shared
+        self.leaf_names = (None, {})
+        self.lock = threading.Lock()
+
+    def params(self) -> dict:
+        return {"min_leaves": self.min_leaves, "n_hits": self.n_hits}
+
+    def accessions(self, index) -> dict:
+        """
+        Accession -> leaf name for the leaves of index (a CladeIndex), the first leaf for
+        an accession that's on more than one
+        """
+        with self.lock:
+            if self.leaf_names[0] is not index:
+                leaf_names = {}
+                for name in index.names:
+                    if name:
+                        leaf_names.setdefault(accession(name), name)
+                self.leaf_names = (index, leaf_names)
+            return self.leaf_names[1]
+
+    def clade(self, index, hits: list) -> tuple:
+        """
+        (clade leaf names, outgroup name or None) for (accession, identity) hits, best
+        first, on the tree of index (a CladeIndex)
+        """
+        import numpy as np
+
+        leaf_names = self.accessions(index)
+        found = [leaf_names[acc] for acc, _ in hits if acc in leaf_names][: self.n_hits]
+        if not found:
+            logging.warning("None of the search hits are in the reference tree")
+            return [name for name in index.names if name], None
+
+        node = index.clade(found, self.min_leaves)
+        names = [name for name in index.leaves(node) if name]
+        if node == index.root:
+            return names, None
+
+        # Nearest leaf in the rest of the tree below the clade's parent, the one with the
+        # shortest path from the root
+        parent = index.parent[node]
+        lo, hi = index.lo[parent], index.hi[parent]
+        depth = index.depth[index.leaf_nodes[lo:hi]]
+        depth[index.lo[node] - lo : index.hi[node] - lo] = np.inf
+        return names, index.names[lo + int(np.argmin(depth))]
+
+    @timed("ReferencePruner.call")
+    def call(
+        self,
+        index,
+        read_aligned: Callable[[list], dict],
+        hits: list,
+        tree_fp: Path,
+        aligned_fp: Path,
+    ) -> dict:
+        """
+        Write the pruned tree and alignment of the reference index (a CladeIndex) is of,
+        read_aligned(accessions) gives the reference rows\n
+        Both call leaves by their accession. Columns that are all gaps in what's left are
+        dropped
+        """
+        import numpy as np
+
+        names, outgroup = self.clade(index, hits)
+        if outgroup:
+            names.append(outgroup)
+        ids = {}
+        for name in names:
+            ids.setdefault(accession(name), name)
+        rows = read_aligned(list(ids))
+        missing = [ids[i] for i in ids if i not in rows]
+        if missing:
+            logging.warning(f"{len(missing)} leaves aren't in the alignment: {missing}")
+        ids = {i: name for i, name in ids.items() if i in rows}
+
+        seqs = np.array([np.frombuffer(rows[i].encode(), np.uint8) for i in ids])
+        informative = (seqs != ord("-")).any(axis=0)
+        with open(aligned_fp, "w") as f:
+            for i, seq in zip(ids, seqs[:, informative]):
+                f.write(f">{i}\n{seq.tobytes().decode()}\n")
+        with open(tree_fp, "w") as f:
+            f.write(
+                induced_newick(index.nodes[index.root], set(ids.values()), accession)
+            )
+
+        info = {
+            "leaves": len(ids),
+            "reference_leaves": len(index.names),
+            "columns": int(informative.sum()),
+            "reference_columns": int(seqs.shape[1]),
+            "outgroup": outgroup,
+        }
+        logging.info(
+            f"Pruned the reference to {info['leaves']}/{info['reference_leaves']} leaves and {info['columns']}/{info['reference_columns']} columns"
+        )
+        return info
@@ -0,0 +1,162 @@
+import json
+import logging
+import queue
+import threading
+import time
+from pathlib import Path
+
+COLUMNS = ["query", "method", "genus", "probability"]
+FORMATS = ["tsv", "jsonl", "parquet"]
+# Same cutoff as OutputDir.write_probs
+MIN_PROB = 0.0001
+
+
+class ResultsWriter:
+    """
+    Streams one row per query x method x genus to a single TSV, JSONL or Parquet file\n
+    Any number of threads can add rows, one writer thread owns the file and writes them out
+    in chunks of buffer_rows, or whatever has arrived once flush_s has passed since the last
+    write\n
+    TSV and JSONL files are appended to, Parquet files (which need pyarrow) are replaced
+    """
+
+    def __init__(
+        self,
+        fp: Path,
+        fmt: str = None,
+        buffer_rows: int = 1000,
+        flush_s: float = 1.0,
+    ) -> None:
+        self.fp = Path(fp)
+        self.fmt = fmt if fmt else self.fp.suffix.lstrip(".")
+        if self.fmt not in FORMATS:
+            raise ValueError(f"Unknown results format {self.fmt}, expected {FORMATS}")
+        self.buffer_rows = buffer_rows
+        self.flush_s = flush_s
+        self.rows_written = 0
+        self.error = None
+
+        if self.fmt == "parquet":
+            try:
+                import pyarrow
+                import pyarrow.parquet
+            except ImportError:
+                raise ImportError("Parquet results need pyarrow, pip install pyarrow")
+            self.pa = pyarrow
+            self.schema = pyarrow.schema(
+                [(c, pyarrow.string()) for c in COLUMNS[:-1]]
+                + [("probability", pyarrow.float64())]
+            )
+            self.f = pyarrow.parquet.ParquetWriter(str(self.fp), self.schema)
+        else:
+            new = not self.fp.exists() or self.fp.stat().st_size == 0
+            self.f = open(self.fp, "a")
+            if self.fmt == "tsv" and new:
+                self.f.write("\t".join(COLUMNS) + "\n")
+
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, query: str, method: str, probs: dict):
+        if self.error:
+            raise self.error
+        self.queue.put(
+            [
+                (query, method, genus.split(" ")[0], float(p))
+                for genus, p in probs.items()
+                if p > MIN_PROB
+            ]
+        )
+
+    def extend(self, fp: Path):
+        """
+        Add every row of another results file in the same format, like a worker's
+        """
+        if self.fmt == "parquet":
+            table = self.pa.parquet.read_table(str(fp))
+            rows = [tuple(r[c] for c in COLUMNS) for r in table.to_pylist()]
+        else:
+            with open(fp) as f:
+                if self.fmt == "jsonl":
+                    rows = [tuple(json.loads(l)[c] for c in COLUMNS) for l in f]
+                else:
+                    next(f, None)
+                    rows = [l.rstrip("\n").split("\t") for l in f]
+                    rows = [(q, m, g, float(p)) for q, m, g, p in rows]
+        self.queue.put(rows)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.f.close()
+        if self.error:
+            raise self.error
+        logging.info(f"Wrote {self.rows_written} result rows to {self.fp}")
+
+    def _run(self):
+        buffer = []
+        last_flush = time.monotonic()
+        done = False
+        while not done:
+            # Rows trickling in still get written flush_s after the last write
+            wait = self.flush_s - (time.monotonic() - last_flush)
+            try:
+                rows = self.queue.get(timeout=max(wait, 0))
+                if rows is None:
+                    done = True
+                else:
+                    buffer.extend(rows)
+            except queue.Empty:
+                pass
+            due = time.monotonic() - last_flush >= self.flush_s
+            if not (done or due or len(buffer) >= self.buffer_rows):
+                continue
+
+            if buffer and not self.error:
+                try:
+                    self._write(buffer)
+                    self.rows_written += len(buffer)
+                except Exception as e:
+                    logging.error(f"Failed writing results to {self.fp}: {e!r}")
+                    self.error = e
+            buffer = []
+            last_flush = time.monotonic()
+
+    def _write(self, rows: list):
+        if self.fmt == "parquet":
+            columns = list(zip(*rows))
+            self.f.write_table(
+                self.pa.Table.from_arrays(
+                    [self.pa.array(c) for c in columns], schema=self.schema
+                )
+            )
+        elif self.fmt == "jsonl":
+            self.f.write(
+                "".join(json.dumps(dict(zip(COLUMNS, r))) + "\n" for r in rows)
+            )
+        else:
+            self.f.write("".join(f"{q}\t{m}\t{g}\t{p}\n" for q, m, g, p in rows))
+        if self.fmt != "parquet":
+            self.f.flush()
+
+
+class FanOut:
+    """
+    Passes rows on to a ResultsWriter for a query and again for each of its duplicates, so
+    a dereplicated batch still gets rows for every query
+    """
+
+    def __init__(self, results: ResultsWriter, duplicates: list) -> None:
+        self.results = results
+        self.duplicates = duplicates
+
+    def add(self, query: str, method: str, probs: dict):
+        for q in [query] + self.duplicates:
+            self.results.add(q, method, probs)
@@ -0,0 +1,221 @@
+import asyncio
+import logging
+import time
+from pathlib import Path
+from typing import Callable, Iterable
+
+
+class ToolJob:
+    """
+    One tool invocation for a ToolRunner, what a wrapper made with defer=True returns\n
+    The jobs named in after have to succeed before this one starts, or it's cancelled, and
+    before is called right before it starts
+    """
+
+    def __init__(
+        self,
+        tool: str,
+        args: list,
+        name: str = None,
+        after: Iterable[str] = (),
+        timeout: float = None,
+        cwd: Path = None,
+        before: Callable[[], None] = None,
+    ) -> None:
+        self.tool = tool
+        self.args = [str(a) for a in args]
+        self.name = name if name else tool
+        self.after = list(after)
+        self.timeout = timeout
+        self.cwd = cwd
+        self.before = before
+
+
+class ToolResult:
+    """
+    How a ToolJob went, status is ok, failed (a nonzero exit or it couldn't start), timeout
+    or cancelled (by ToolRunner.cancel, or because a job it depends on didn't succeed)
+    """
+
+    def __init__(
+        self,
+        job: ToolJob,
+        status: str,
+        returncode: int = None,
+        stdout: str = "",
+        stderr: str = "",
+        wall_s: float = 0.0,
+        error: str = "",
+    ) -> None:
+        self.job = job
+        self.status = status
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.wall_s = wall_s
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.status == "ok"
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.job.name,
+            "tool": self.job.tool,
+            "args": self.job.args,
+            "status": self.status,
+            "returncode": self.returncode,
+            "wall_s": self.wall_s,
+            "error": self.error,
+        }
+
+
+class ToolRunner:
+    """
+    Runs ToolJobs as asyncio subprocesses, at most max_concurrency at once, each with its own
+    captured stdout and stderr and killed if it runs past its timeout (or the runner's)\n
+    A job that doesn't succeed cancels everything that depends on it while the rest carry
+    on, and nothing raises or exits because of a tool, run returns a ToolResult for every job
+    """
+
+    def __init__(self, max_concurrency: int = 4, timeout: float = None) -> None:
+        self.max_concurrency = max(1, max_concurrency)
+        self.timeout = timeout
+        self.jobs = {}
+        self.tasks = {}
+
+    def add(
+        self,
+        job: ToolJob,
+        name: str = None,
+        after: Iterable[str] = (),
+        timeout: float = None,
+    ) -> ToolJob:
+        job.name = name if name else job.name
+        job.after += list(after)
+        job.timeout = timeout if timeout else job.timeout
+        if job.name in self.jobs:
+            raise ValueError(f"Duplicate job name: {job.name}")
+        self.jobs[job.name] = job
+        return job
+
+    def cancel(self, name: str) -> bool:
+        """
+        Cancel a job that hasn't finished, killing its process if it's started, from the
+        event loop's thread (e.g. another coroutine)
+        """
+        task = self.tasks.get(name)
+        return task.cancel() if task else False
+
+    def run(self) -> dict:
+        return asyncio.run(self.run_async())
+
+    async def run_async(self) -> dict:
+        """
+        Job name -> ToolResult, once every job has finished or been cancelled
+        """
+        self.check()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        # All created before any of them runs, so each can wait on its dependencies' tasks
+        self.tasks = {
+            name: asyncio.ensure_future(self._job(job, semaphore))
+            for name, job in self.jobs.items()
+        }
+        try:
+            results = await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+        finally:
+            for task in self.tasks.values():
+                task.cancel()
+        return {
+            name: self._result(name, result)
+            for name, result in zip(self.tasks, results)
+        }
+
+    def _result(self, name: str, result) -> ToolResult:
+        # Only a job cancelled before it even started ends without a ToolResult
+        if isinstance(result, ToolResult):
+            return result
+        return ToolResult(self.jobs[name], "cancelled", error="cancelled")
+
+    def check(self):
+        unknown = {a for job in self.jobs.values() for a in job.after} - set(self.jobs)
+        if unknown:
+            raise ValueError(f"Jobs depend on jobs that don't exist: {sorted(unknown)}")
+
+        done = set()
+        pending = dict(self.jobs)
+        while pending:
+            ready = [n for n, job in pending.items() if set(job.after) <= done]
+            if not ready:
+                raise ValueError(f"Unsatisfiable job dependencies: {list(pending)}")
+            for n in ready:
+                pending.pop(n)
+                done.add(n)
+
+    async def _job(self, job: ToolJob, semaphore: asyncio.Semaphore) -> ToolResult:
+        try:
+            for dep in job.after:
+                try:
+                    result = self._result(dep, await asyncio.shield(self.tasks[dep]))
+                except asyncio.CancelledError:
+                    if not self.tasks[dep].cancelled():
+                        raise
+                    result = self._result(dep, None)
+                if not result.ok:
+                    logging.warning(f"Cancelling {job.name}, {dep} {result.status}")
+                    return ToolResult(job, "cancelled", error=f"{dep} {result.status}")
+            async with semaphore:
+                return await self._run(job)
+        except asyncio.CancelledError:
+            return ToolResult(job, "cancelled", error="cancelled")
+
+    async def _run(self, job: ToolJob) -> ToolResult:
+        timeout = job.timeout if job.timeout else self.timeout
+        logging.info(f"Calling: {job.args}")
+        start = time.perf_counter()
+        try:
+            if job.before:
+                job.before()
+            proc = await asyncio.create_subprocess_exec(
+                *job.args,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                cwd=job.cwd,
+            )
+        except OSError as e:
+            logging.error(f"{job.name} couldn't start: {e!r}")
+            return ToolResult(job, "failed", error=repr(e))
+
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            proc.kill()
+            stdout, stderr = await proc.communicate()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            logging.error(f"{job.name} timed out (timeout: {timeout})")
+            return ToolResult(
+                job,
+                "timeout",
+                proc.returncode,
+                stdout.decode(errors="replace"),
+                stderr.decode(errors="replace"),
+                time.perf_counter() - start,
+                f"timed out after {timeout}s",
+            )
+
+        result = ToolResult(
+            job,
+            "ok" if proc.returncode == 0 else "failed",
+            proc.returncode,
+            stdout.decode(errors="replace"),
+            stderr.decode(errors="replace"),
+            time.perf_counter() - start,
+        )
+        if result.ok:
+            logging.info(f"Completed process: {' '.join(job.args)}")
+        else:
+            result.error = f"returned code {proc.returncode}"
+            logging.error(f"{' '.join(job.args)} returned code {proc.returncode}")
+        return result
@@ -0,0 +1,84 @@
+import logging
+from pathlib import Path
+from . import parse_fasta
+from .Metrics import timed
+
+# Two 64 bit FNV-1a style hashes per column, so distinct site patterns colliding is
+# vanishingly unlikely even for alignments with hundreds of thousands of columns
+HASH_BASES = (0xCBF29CE484222325, 0x84222325CBF29CE4)
+HASH_PRIMES = (0x100000001B3, 0x1000193)
+
+
+def read_records(aligned_fp: Path):
+    """
+    (name, sequence bytes) for each record in aligned_fp, one at a time
+    """
+    import numpy as np
+
+    with open(aligned_fp) as f:
+        for desc, seq in parse_fasta(f):
+            yield desc.split()[0], np.frombuffer(seq.encode(), np.uint8)
+
+
+def hash_columns(aligned_fp: Path) -> tuple:
+    """
+    (hashes, informative) for the columns of aligned_fp, where hashes has a row per column
+    that's equal for columns with the same site pattern and informative is whether each
+    column has anything other than gaps\n
+    Built up a sequence at a time, so only one sequence of the alignment is held at once
+    """
+    import numpy as np
+
+    hashes = informative = None
+    for _, seq in read_records(aligned_fp):
+        if hashes is None:
+            hashes = np.tile(np.array(HASH_BASES, np.uint64), (len(seq), 1))
+            informative = np.zeros(len(seq), bool)
+        elif len(seq) != len(hashes):
+            raise ValueError(f"{aligned_fp} is ragged, it isn't an alignment")
+        for i, prime in enumerate(HASH_PRIMES):
+            # Wraps around at 64 bits, which is what the hash wants
+            hashes[:, i] = (hashes[:, i] ^ seq) * np.uint64(prime)
+        informative |= seq != ord("-")
+    if hashes is None:
+        return np.zeros((0, 2), np.uint64), np.zeros(0, bool)
+    return hashes, informative
+
+
+@timed("compress_sites")
+def compress_sites(aligned_fp: Path, out_fp: Path, weights_fp: Path) -> dict:
+    """
+    Write aligned_fp with its all-gap columns dropped and each distinct column (site
+    pattern) kept once, in order of first appearance, plus a RAxML -a weights file with how
+    many times each one occurs\n
+    All-gap columns are missing data everywhere and a site's likelihood only depends on its
+    pattern, so RAxML's trees and supports are the same as for the original alignment.
+    Columns are matched by a hash built up over one pass of the alignment and the patterns
+    written on a second, so memory goes with the number of columns rather than the size of
+    the alignment
+    """
+    import numpy as np
+
+    hashes, informative = hash_columns(aligned_fp)
+    columns = np.flatnonzero(informative)
+    _, first, counts = np.unique(
+        hashes[columns], axis=0, return_index=True, return_counts=True
+    )
+    order = np.argsort(first)
+    kept = columns[first[order]]
+
+    with open(out_fp, "w") as f:
+        for name, seq in read_records(aligned_fp):
+            f.write(f">{name}\n{seq[kept].tobytes().decode()}\n")
+    with open(weights_fp, "w") as f:
+        f.write(" ".join(str(c) for c in counts[order]) + "\n")
+
+    info = {
+        "columns": len(informative),
+        "informative_columns": len(columns),
+        "patterns": len(kept),
+    }
+    logging.info(
+        f"Compressed {aligned_fp.name} from {info['columns']} columns to {info['patterns']} site patterns"
+    )
+    return info
@@ -0,0 +1,211 @@
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from . import parse_fasta
+
+SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+INDEX_SUFFIX = ".idx"
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstd compression needs zstandard, pip install zstandard")
+    return zstandard
+
+
+def codec_for(fp: Path) -> str:
+    for codec, suffix in SUFFIXES.items():
+        if fp.name.endswith(suffix):
+            return codec
+    return None
+
+
+def compressed_fp(fp: Path, codec: str) -> Path:
+    return fp.with_name(fp.name + SUFFIXES[codec])
+
+
+def index_fp(fp: Path) -> Path:
+    return fp.with_name(fp.name + INDEX_SUFFIX)
+
+
+def compress(
+    src: Path, dst: Path, codec: str = "gzip", block_size: int = 1 << 20, level: int = 6
+) -> Path:
+    """
+    Compress src into independently compressed blocks of about block_size bytes, each
+    holding whole lines (whole records for FASTA), and write a block index next to dst\n
+    Concatenated gzip members and zstd frames are still ordinary .gz and .zst files, so
+    anything that can read those can read these
+    """
+    if codec == "gzip":
+        pack = lambda data: gzip.compress(data, compresslevel=level, mtime=0)
+    else:
+        pack = _zstandard().ZstdCompressor(level=level).compress
+
+    index = {"codec": codec, "blocks": [], "records": {}}
+    temp_fp = dst.with_name(f".{dst.name}.{os.getpid()}.tmp")
+    with open(src, "rb") as f_in, open(temp_fp, "wb") as f_out:
+        buf = bytearray()
+        fasta = f_in.peek(1)[:1] == b">"
+
+        def flush():
+            data = pack(bytes(buf))
+            index["blocks"].append([f_out.tell(), len(data), len(buf)])
+            f_out.write(data)
+            buf.clear()
+
+        for line in f_in:
+            at_record = line[:1] == b">" if fasta else True
+            if at_record and len(buf) >= block_size:
+                flush()
+            if fasta and line[:1] == b">":
+                name = line[1:].split(None, 1)[0].decode()
+                index["records"][name] = len(index["blocks"])
+            buf += line
+        if buf:
+            flush()
+
+    with open(index_fp(temp_fp), "w") as f:
+        json.dump(index, f)
+    os.replace(index_fp(temp_fp), index_fp(dst))
+    os.replace(temp_fp, dst)
+    logging.info(
+        f"Compressed {src} to {dst} ({src.stat().st_size} -> {dst.stat().st_size} bytes)"
+    )
+    return dst
+
+
+def open_text(fp: Path):
+    """
+    Streaming text reader for a plain, gzip or zstd file
+    """
+    codec = codec_for(Path(fp))
+    if codec == "gzip":
+        return gzip.open(fp, "rt")
+    if codec == "zstd":
+        f = open(fp, "rb")
+        reader = (
+            _zstandard().ZstdDecompressor().stream_reader(f, read_across_frames=True)
+        )
+        return io.TextIOWrapper(reader)
+    return open(fp)
+
+
+def uncompressed_size(fp: Path) -> int:
+    with open(index_fp(fp)) as f:
+        return sum(b[2] for b in json.load(f)["blocks"])
+
+
+def materialize(fp: Path, dest_dir: Path) -> Path:
+    """
+    Plain copy of a compressed file in dest_dir for tools that can't read it compressed,
+    reused for as long as the compressed file is unchanged
+    """
+    fp = Path(fp)
+    codec = codec_for(fp)
+    if codec is None:
+        return fp
+
+    dest = Path(dest_dir) / fp.name[: -len(SUFFIXES[codec])]
+    stat = fp.stat()
+    if (
+        dest.exists()
+        and dest.stat().st_mtime_ns == stat.st_mtime_ns
+        and dest.stat().st_size == uncompressed_size(fp)
+    ):
+        return dest
+
+    logging.info(f"Decompressing {fp} to {dest}...")
+    os.makedirs(dest_dir, exist_ok=True)
+    temp_fp = dest.with_name(f".{dest.name}.{os.getpid()}.tmp")
+    with open(temp_fp, "wb") as f_out:
+        if codec == "gzip":
+            with gzip.open(fp, "rb") as f_in:
+                shutil.copyfileobj(f_in, f_out, 1 << 20)
+        else:
+            with open(fp, "rb") as f_in:
+                _zstandard().ZstdDecompressor().copy_stream(f_in, f_out)
+    os.utime(temp_fp, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    os.replace(temp_fp, dest)
+    return dest
+
+
+def scratch_dir(scratch: str) -> Path:
+    """
+    The directory for scratch files, where "auto" is /dev/shm if it's writable and the
+    system temporary directory otherwise
+    """
+    if scratch != "auto":
+        return Path(scratch) if scratch else None
+    shm = Path("/dev/shm")
+    if shm.is_dir() and os.access(shm, os.W_OK):
+        return shm
+    return Path(tempfile.gettempdir())
+
+
+def scratch_for(root_fp: Path, scratch: Path) -> Path:
+    """
+    Where a DB's materialized files go, distinct per DB so several can share a scratch dir
+    """
+    digest = hashlib.sha1(str(Path(root_fp).resolve()).encode()).hexdigest()[:8]
+    return Path(scratch) / f"genusfinder_db_{digest}"
+
+
+class BlockReader:
+    """
+    Random access to the records of a file written by compress() through its block index
+    """
+
+    def __init__(self, fp: Path) -> None:
+        self.fp = Path(fp)
+        with open(index_fp(self.fp)) as f:
+            self.index = json.load(f)
+        if self.index["codec"] == "gzip":
+            self.unpack = gzip.decompress
+        else:
+            self.unpack = _zstandard().ZstdDecompressor().decompress
+        self.f = open(self.fp, "rb")
+        self.cached = (None, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.f.close()
+
+    def __len__(self) -> int:
+        return len(self.index["records"])
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.index["records"]
+
+    def names(self) -> list:
+        return list(self.index["records"])
+
+    def read_block(self, i: int) -> bytes:
+        if self.cached[0] != i:
+            offset, length, _ = self.index["blocks"][i]
+            self.f.seek(offset)
+            self.cached = (i, self.unpack(self.f.read(length)))
+        return self.cached[1]
+
+    def get(self, name: str) -> tuple:
+        """
+        (description, sequence) of the record whose id is name
+        """
+        block = self.read_block(self.index["records"][name])
+        for desc, seq in parse_fasta(io.StringIO(block.decode())):
+            if desc.split(None, 1)[0] == name:
+                return desc, seq
+        raise KeyError(name)
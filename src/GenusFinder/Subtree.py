@@ -0,0 +1,98 @@
+from pathlib import Path
+from typing import Callable
+
+from .Bootstrap import AdaptiveBootstrap
+from .CLI import RAxMLTreeBuilder
+from .FastPath import FastPath
+from .Metrics import current
+
+# RAxML runs of the subtree method, the base tree and the bootstrap replicates
+BASE_TREE_PARAMS = {"m": "GTRCAT", "n": "subtree2", "p": 10000}
+BOOTSTRAP_PARAMS = {"b": 392781, "N": 100, "m": "GTRCAT", "n": "subtree1", "p": 10000}
+# RAxML run of the full tree method, placing the query in the (maybe pruned) reference
+PLACEMENT_PARAMS = {"f": "y", "m": "GTRCAT", "n": "combined", "p": 10000}
+
+# What each method's probabilities are called in probabilities.tsv
+HEADERS = {
+    "fast_path": "Fast path probabilities (search identity)",
+    "subtree_distance": "Distance-based subtree probabilities",
+    "subtree_bootstrap": "Bootstrap-based subtree probabilities",
+    "full_tree": "Full tree alignment probabilities",
+}
+
+
+def triage(hits: list, fast_path: FastPath, lookup: dict) -> tuple:
+    """
+    (tier, fast path probabilities or None, reason) for a query's search hits, the tier
+    being fast_path if the fast path answered and tree if the query needs its trees
+    """
+    probs, reason = None, "fast path off"
+    if fast_path:
+        probs, reason = fast_path.call(hits, lookup)
+    tier = "fast_path" if probs else "tree"
+    if current():
+        current().info["tier"] = tier
+    return tier, probs, reason
+
+
+def compress(name: str, aligned_fp: Path, patterns_fp: Path, weights_fp: Path) -> dict:
+    """
+    compress_sites, with what it did kept in the current Metrics under name
+    """
+    from .SitePatterns import compress_sites
+
+    info = compress_sites(aligned_fp, patterns_fp, weights_fp)
+    if current():
+        current().info.setdefault("sites", {})[name] = info
+    return info
+
+
+def base_tree(aligned_fp: Path, weights_fp: Path, w: Path):
+    RAxMLTreeBuilder().call(**BASE_TREE_PARAMS, a=weights_fp, s=aligned_fp, w=w)
+
+
+def bootstraps(aligned_fp: Path, weights_fp: Path, w: Path):
+    RAxMLTreeBuilder().call(**BOOTSTRAP_PARAMS, a=weights_fp, s=aligned_fp, w=w)
+
+
+def adaptive_bootstraps(
+    adaptive: AdaptiveBootstrap,
+    aligned_fp: Path,
+    base_tree_fp: Path,
+    w: Path,
+    bootstraps_fp: Path,
+    probs_for: Callable[[object], dict],
+    weights_fp: Path = None,
+    supported_fp: Path = None,
+) -> dict:
+    """
+    AdaptiveBootstrap.run, with how it went kept in the current Metrics
+    """
+    info = adaptive.run(
+        aligned_fp, base_tree_fp, w, bootstraps_fp, probs_for, weights_fp, supported_fp
+    )
+    if current():
+        current().info["bootstrap"] = info
+    return info
+
+
+def subtree_probs(algorithms):
+    """
+    (method, probabilities) for each subtree method (keys of HEADERS), each as it's ready
+    """
+    yield "subtree_distance", algorithms.distance_probs()
+    yield "subtree_bootstrap", algorithms.bootstrap_probs()
+
+
+def full_tree_probs(combined_tree, db, lookup: dict = None) -> dict:
+    """
+    Full tree method probabilities for the query placed in combined_tree (a Tree or a path
+    to one)\n
+    Curves are fit on the whole LTP tree, parsed and indexed once per DB, even when
+    placement was pruned, so pruning doesn't move the clades they're fit on
+    """
+    from .Algorithms import Algorithms
+
+    lookup = lookup if lookup else db.get_genus_index()
+    algorithms = Algorithms(combined_tree, db.build_type_species(), lookup=lookup)
+    return algorithms.train(db.get_LTP_tree_object(), index=db.get_LTP_clade_index())
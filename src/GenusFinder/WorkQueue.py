@@ -0,0 +1,234 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from . import parse_fasta
+
+STATES = ["pending", "claimed", "done", "failed", "results"]
+
+
+class Shard:
+    """
+    A file of queries in one of a WorkQueue's state directories, named <name>.<attempt>.fasta
+    where attempt counts how many times it's been claimed before
+    """
+
+    def __init__(self, fp: Path) -> None:
+        self.fp = Path(fp)
+        self.name, attempt, _ = self.fp.name.split(".")
+        self.attempt = int(attempt)
+
+    @property
+    def lease_fp(self) -> Path:
+        return self.fp.with_name(f"{self.name}.{self.attempt}.lease")
+
+    def read(self) -> tuple:
+        """
+        ([(query id, sequence)], [output subdirectory]) in the order they were enqueued
+        """
+        batch, dirs = [], []
+        with open(self.fp) as f:
+            for desc, seq in parse_fasta(f):
+                name, query_id = desc.split("\t", 1)
+                batch.append((query_id, seq))
+                dirs.append(name)
+        return batch, dirs
+
+
+class WorkQueue:
+    """
+    A batch split into shards in a directory every node can see, for workers to claim and
+    run\n
+    Claiming is an atomic rename from pending/ to claimed/, so each shard goes to exactly one
+    worker, which keeps a lease file next to it fresh for as long as it's working on it. A
+    shard whose lease hasn't been renewed for lease_s is taken to belong to a crashed worker
+    and goes back to pending/, or to failed/ once it's been tried max_attempts times. Lease
+    ages come from file times, so the nodes' clocks need to roughly agree
+    """
+
+    def __init__(self, fp: Path, lease_s: float = 300, max_attempts: int = 3) -> None:
+        self.root_fp = Path(fp)
+        self.lease_s = lease_s
+        self.max_attempts = max_attempts
+        self.info_fp = self.root_fp / "queue.json"
+        # How often idle workers and the coordinator look at the queue
+        self.poll_s = min(1.0, lease_s / 10)
+        for state in STATES:
+            os.makedirs(self.root_fp / state, exist_ok=True)
+
+    def dir(self, state: str) -> Path:
+        return self.root_fp / state
+
+    def shards(self, state: str) -> list:
+        return sorted(
+            (Shard(fp) for fp in self.dir(state).glob("*.fasta")), key=lambda s: s.name
+        )
+
+    def enqueue(self, batch: list, dirs: list, shard_size: int = 10) -> int:
+        """
+        Write (query id, sequence) pairs as shards of shard_size, each query going to its
+        entry in dirs under the output directory, returns the number of shards
+        """
+        if self.info_fp.exists():
+            raise ValueError(
+                f"{self.root_fp} already holds a batch, use a new queue directory"
+            )
+
+        n = 0
+        for n, start in enumerate(range(0, len(batch), shard_size), 1):
+            shard_fp = self.dir("pending") / f"{n - 1:05d}.0.fasta"
+            temp_fp = self.root_fp / f".{shard_fp.name}.tmp"
+            with open(temp_fp, "w") as f:
+                for (query_id, seq), name in zip(
+                    batch[start : start + shard_size], dirs[start : start + shard_size]
+                ):
+                    f.write(f">{name}\t{query_id}\n{seq}\n")
+            os.replace(temp_fp, shard_fp)
+
+        # Last, so workers can tell a batch that's still being written from one that's empty
+        temp_fp = self.root_fp / f".{self.info_fp.name}.tmp"
+        with open(temp_fp, "w") as f:
+            json.dump({"shards": n, "queries": len(batch)}, f)
+        os.replace(temp_fp, self.info_fp)
+        logging.info(f"Queued {len(batch)} queries as {n} shards in {self.root_fp}")
+        return n
+
+    def claim(self, worker: str) -> Shard:
+        """
+        The next pending shard, now claimed by worker, or None if nothing's pending
+        """
+        for shard in self.shards("pending"):
+            claimed_fp = self.dir("claimed") / shard.fp.name
+            try:
+                os.rename(shard.fp, claimed_fp)
+            except FileNotFoundError:
+                # Another worker got there first
+                continue
+            claimed = Shard(claimed_fp)
+            temp_fp = self.root_fp / f".{claimed.lease_fp.name}.{os.getpid()}.tmp"
+            with open(temp_fp, "w") as f:
+                json.dump({"worker": worker, "claimed": time.time()}, f)
+            os.replace(temp_fp, claimed.lease_fp)
+            logging.info(f"{worker} claimed shard {claimed.name}")
+            return claimed
+        return None
+
+    @contextmanager
+    def lease(self, shard: Shard):
+        """
+        Keep shard's lease fresh for as long as the block runs
+        """
+        stop = threading.Event()
+
+        def renew():
+            while not stop.wait(self.lease_s / 4):
+                try:
+                    os.utime(shard.lease_fp)
+                except FileNotFoundError:
+                    logging.warning(f"Lost the lease on shard {shard.name}")
+                    return
+
+        thread = threading.Thread(target=renew, daemon=True)
+        thread.start()
+        try:
+            yield shard
+        finally:
+            stop.set()
+            thread.join()
+
+    def complete(self, shard: Shard, info: dict) -> bool:
+        """
+        Record a claimed shard as done, False if its lease had already been taken from us
+        """
+        done_fp = self.dir("done") / shard.fp.name
+        try:
+            os.rename(shard.fp, done_fp)
+        except FileNotFoundError:
+            logging.warning(
+                f"Shard {shard.name} was reclaimed while it ran, discarding this attempt"
+            )
+            return False
+        self._remove(shard.lease_fp)
+
+        info = dict(info, attempt=shard.attempt)
+        temp_fp = self.root_fp / f".{shard.name}.json.{os.getpid()}.tmp"
+        with open(temp_fp, "w") as f:
+            json.dump(info, f)
+        os.replace(temp_fp, self.dir("done") / f"{shard.name}.json")
+        return True
+
+    def reclaim(self) -> list:
+        """
+        Requeue claimed shards whose leases have gone stale, returns their names
+        """
+        reclaimed = []
+        now = time.time()
+        for shard in self.shards("claimed"):
+            try:
+                # Before its lease is written a claim's age is the rename's (ctime)
+                fp = shard.lease_fp if shard.lease_fp.exists() else shard.fp
+                st = fp.stat()
+                age = now - (st.st_mtime if fp == shard.lease_fp else st.st_ctime)
+            except FileNotFoundError:
+                continue
+            if age < self.lease_s:
+                continue
+
+            attempt = shard.attempt + 1
+            if attempt >= self.max_attempts:
+                dst = self.dir("failed") / shard.fp.name
+            else:
+                dst = self.dir("pending") / f"{shard.name}.{attempt}.fasta"
+            try:
+                os.rename(shard.fp, dst)
+            except FileNotFoundError:
+                continue
+            self._remove(shard.lease_fp)
+            logging.warning(
+                f"Shard {shard.name}'s lease went {age:.0f}s without renewal, moved it to {dst.parent.name}"
+            )
+            reclaimed.append(shard.name)
+        return reclaimed
+
+    def results_fp(self, name: str, attempt: int, fmt: str) -> Path:
+        # One per attempt, so a crashed attempt's partial results are never merged
+        return self.dir("results") / f"{name}.{attempt}.{fmt}"
+
+    def status(self) -> dict:
+        info = {}
+        if self.info_fp.exists():
+            with open(self.info_fp) as f:
+                info = json.load(f)
+        return {
+            "shards": info.get("shards"),
+            "pending": len(self.shards("pending")),
+            "claimed": len(self.shards("claimed")),
+            "done": len(list(self.dir("done").glob("*.json"))),
+            "failed": len(self.shards("failed")),
+        }
+
+    def finished(self) -> bool:
+        status = self.status()
+        return status["shards"] is not None and (
+            status["done"] + status["failed"] >= status["shards"]
+        )
+
+    def done(self) -> dict:
+        """
+        Shard name -> what its worker recorded when it finished it
+        """
+        done = {}
+        for fp in sorted(self.dir("done").glob("*.json")):
+            with open(fp) as f:
+                done[fp.stem] = json.load(f)
+        return done
+
+    @staticmethod
+    def _remove(fp: Path):
+        try:
+            os.remove(fp)
+        except FileNotFoundError:
+            pass
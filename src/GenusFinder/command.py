@@ -1,19 +1,60 @@
 import argparse
+import concurrent.futures as cf
+import json
 import logging
+import os
+import re
+import socket
 import sys
+import time
+from pathlib import Path
+from typing import Callable
 
-from .CLI import MuscleAligner, RAxMLTreeBuilder, VsearchSearcher
-from .DBDir import DBDir
+from . import Subtree
+from .Bootstrap import AdaptiveBootstrap
+from .CLI import (
+    FAKE_TOOLS_ENV,
+    TOOL_TIMEOUT_ENV,
+    MuscleAligner,
+    RAxMLTreeBuilder,
+    ToolError,
+    VsearchSearcher,
+)
+from .DBDir import LTP_VERSION, DBDir
+from .Dereplicate import dereplicate, fan_out, reduction
+from .FastPath import FastPath, read_hits
 from .OutputDir import OutputDir
-from .Algorithms import Algorithms
+from .fake_tools import LATENCY_ENV
+from . import parse_fasta
+from .Metrics import (
+    Metrics,
+    current,
+    reset_current,
+    set_current,
+    summarize,
+)
+from .Results import FanOut, ResultsWriter
+from .Pipeline import Pipeline, Stage
+from .Profile import MODES, profiling
+from .Prune import ReferencePruner
+from .Storage import scratch_dir
+from .Subtree import BASE_TREE_PARAMS, BOOTSTRAP_PARAMS, HEADERS, PLACEMENT_PARAMS
+from .WorkQueue import WorkQueue
 
 
 def main(argv=None):
     p = argparse.ArgumentParser()
     p.add_argument(
-        "--seq", help="the 16S sequence to be identified or a file containing it"
+        "--seq",
+        help="the 16S sequence to be identified or a file containing it, a FASTA file with several records is run as a batch",
     )
     p.add_argument("--id", help="the identity value to use with vsearch", default="0.9")
+    p.add_argument(
+        "--searcher",
+        help="how to find the nearest type species, vsearch or an in-process k-mer index (Default: vsearch)",
+        choices=["vsearch", "kmer"],
+        default="vsearch",
+    )
     p.add_argument(
         "--ncbi_api_key",
         help="your NCBI API key for making more esearch requests per second",
@@ -25,6 +66,17 @@ def main(argv=None):
     p.add_argument(
         "--db", help="the directory in which to put all database files", default="db/"
     )
+    p.add_argument(
+        "--ltp_version",
+        help=f"the LTP release to use, each has its own directory under --db (Default: {LTP_VERSION})",
+        default=LTP_VERSION,
+    )
+    p.add_argument(
+        "--db_compression",
+        help="store database files built from now on compressed, external tools get decompressed copies in --scratch or the temp dir (Default: none)",
+        choices=["none", "gzip", "zstd"],
+        default="none",
+    )
     p.add_argument(
         "--overwrite",
         help="overwrites any existing files of the same name, otherwise assumes existing files should be used as they are",
@@ -35,6 +87,167 @@ def main(argv=None):
         help="only use the subtree method, not more computationally intensive full tree alignment",
         action="store_false",
     )
+    p.add_argument(
+        "--fast_path",
+        help="call the genus straight from the search hits, skipping the trees, when they're close and agree",
+        action="store_true",
+    )
+    p.add_argument(
+        "--fast_id",
+        type=float,
+        help="the percent identity a hit needs to count towards a fast path call (Default: 99.0)",
+        default=99.0,
+    )
+    p.add_argument(
+        "--fast_agreement",
+        type=float,
+        help="the fraction of those hits that have to be from one genus (Default: 1.0)",
+        default=1.0,
+    )
+    p.add_argument(
+        "--fast_min_hits",
+        type=int,
+        help="the number of those hits needed to make a fast path call at all (Default: 3)",
+        default=3,
+    )
+    p.add_argument(
+        "--adaptive_bootstrap",
+        help="run bootstrap replicates in batches until the bootstrap-based probabilities stop changing, instead of always 100",
+        action="store_true",
+    )
+    p.add_argument(
+        "--bootstrap_batch",
+        type=int,
+        help="replicates per batch with --adaptive_bootstrap (Default: 10)",
+        default=10,
+    )
+    p.add_argument(
+        "--bootstrap_min",
+        type=int,
+        help="the fewest replicates to run with --adaptive_bootstrap (Default: 20)",
+        default=20,
+    )
+    p.add_argument(
+        "--bootstrap_max",
+        type=int,
+        help="the most replicates to run with --adaptive_bootstrap (Default: 100)",
+        default=100,
+    )
+    p.add_argument(
+        "--bootstrap_tol",
+        type=float,
+        help="stop once no genus probability changes by more than this between batches (Default: 0.01)",
+        default=0.01,
+    )
+    p.add_argument(
+        "--prune_reference",
+        help="place the query in just the LTP clade around its search hits (plus an outgroup) rather than the whole LTP tree",
+        action="store_true",
+    )
+    p.add_argument(
+        "--prune_min_leaves",
+        type=int,
+        help="the fewest leaves the pruned clade can have (Default: 50)",
+        default=50,
+    )
+    p.add_argument(
+        "--prune_hits",
+        type=int,
+        help="how many of the best search hits the pruned clade has to hold (Default: 10)",
+        default=10,
+    )
+    p.add_argument(
+        "--compress_sites",
+        help="drop all-gap alignment columns and give RAxML each distinct column once, with how often it occurs as its weight",
+        action="store_true",
+    )
+    p.add_argument(
+        "--results",
+        help="also write one row per query, method and genus to this .tsv, .jsonl or .parquet (needs pyarrow) file",
+        default="",
+    )
+    p.add_argument(
+        "--workers",
+        type=int,
+        help="the number of queries in a batch to run at once (Default: 1)",
+        default=1,
+    )
+    p.add_argument(
+        "--dereplicate",
+        choices=["exact", "contained"],
+        help="run each distinct sequence in a batch once and copy its results to its duplicates, contained also counts one that's a prefix or suffix of a longer one as a duplicate of it",
+        default=None,
+    )
+    p.add_argument(
+        "--queue",
+        help="run a batch through a work queue in this directory on a filesystem every node shares, with --seq this writes the batch as shards and waits for workers to finish them",
+        default="",
+    )
+    p.add_argument(
+        "--worker",
+        help="claim and run shards from --queue until its batch is finished",
+        action="store_true",
+    )
+    p.add_argument(
+        "--shard_size",
+        type=int,
+        help="queries per shard with --queue (Default: 10)",
+        default=10,
+    )
+    p.add_argument(
+        "--lease",
+        type=float,
+        help="seconds a worker can go without renewing its claim on a shard before it's taken to have crashed and the shard is requeued (Default: 300)",
+        default=300,
+    )
+    p.add_argument(
+        "--max_attempts",
+        type=int,
+        help="times a shard is claimed before it's given up on (Default: 3)",
+        default=3,
+    )
+    p.add_argument(
+        "--scratch",
+        help="keep intermediate files in a per-query workspace under this directory (e.g. a tmpfs), 'auto' for /dev/shm if available, and only copy results back to --output",
+        default="",
+    )
+    p.add_argument(
+        "--archive",
+        help="with --scratch, also save the intermediate files to artifacts.tar.gz in the output",
+        action="store_true",
+    )
+    p.add_argument(
+        "--jobs",
+        type=int,
+        help="the number of independent pipeline stages to run at once (Default: 4)",
+        default=4,
+    )
+    p.add_argument(
+        "--profile",
+        help="profile each pipeline stage's Python code into profile/ in each query's output, cprofile traces every call, sample is cheaper for production batches",
+        choices=MODES,
+    )
+    p.add_argument(
+        "--profile_interval",
+        type=float,
+        help="seconds between stack samples with --profile sample (Default: 0.005)",
+        default=0.005,
+    )
+    p.add_argument(
+        "--fake_tools",
+        help="use deterministic stand-ins for muscle, RAxML and vsearch (for benchmarking orchestration offline)",
+        action="store_true",
+    )
+    p.add_argument(
+        "--fake_latency",
+        help="simulated runtime of each fake tool, seconds or per tool like 'muscle=0.1,raxmlHPC=0.5'",
+        default="",
+    )
+    p.add_argument(
+        "--tool_timeout",
+        help="seconds muscle, RAxML or vsearch can run before it's killed and the query fails, or per tool like 'muscle=600,raxmlHPC=3600' (Default: no limit)",
+        default="",
+    )
     p.add_argument(
         "--log_level",
         type=int,
@@ -43,88 +256,653 @@ def main(argv=None):
     )
 
     args = p.parse_args(argv)
-    if not args.seq:
+    if not args.seq and not (args.queue and args.worker):
         p.print_help(sys.stderr)
         sys.exit(1)
     logging.basicConfig()
     logging.getLogger().setLevel(args.log_level)
 
-    out = OutputDir(args.output, args.seq, args.overwrite)
+    if args.fake_tools:
+        os.environ[FAKE_TOOLS_ENV] = "1"
+        if args.fake_latency:
+            os.environ[LATENCY_ENV] = args.fake_latency
+    if args.tool_timeout:
+        os.environ[TOOL_TIMEOUT_ENV] = args.tool_timeout
 
-    db = DBDir(args.db, args.ncbi_api_key)
+    args.scratch = scratch_dir(args.scratch)
+    db = DBDir(
+        args.db,
+        args.ncbi_api_key,
+        None if args.db_compression == "none" else args.db_compression,
+        args.scratch,
+        args.ltp_version,
+    )
+    # Workers write their results per shard
+    results = ResultsWriter(args.results) if args.results and not args.worker else None
 
-    ### Subtree alignment method ###
+    try:
+        batch = None if args.queue else read_batch(args.seq)
+        if args.queue:
+            failed = run_queue(db, args, results)
+        elif batch:
+            failed = run_batch(batch, db, args, results)
+        else:
+            out = OutputDir(
+                args.output, args.seq, args.overwrite, results, scratch=args.scratch
+            )
+            run_query(out, db, args)
+            failed = []
+    except ToolError:
+        # Already logged, with the command that failed
+        sys.exit(1)
+    finally:
+        if results:
+            results.close()
 
-    searcher = VsearchSearcher()
-    if not (args.overwrite or out.get_nearest_seqs().exists()):
-        searcher.call(db.get_type_species(), out.get_query(), 0.9, out.get_nearest_seqs())
+    if failed:
+        logging.error(f"{len(failed)} queries failed: {', '.join(failed)}")
+        sys.exit(1)
 
-    aligner = MuscleAligner()
-    if not (args.overwrite or out.get_nearest_seqs_aligned().exists()):
-        aligner.call_simple(out.get_nearest_reduced_seqs(), out.get_nearest_seqs_aligned())
 
-    tree_builder = RAxMLTreeBuilder()
-    # Create 100 bootstrap trees
-    tree_builder.call(
-        b=392781,
-        N=100,
-        m="GTRCAT",
-        n="subtree1",
-        p=10000,
-        s=out.get_nearest_seqs_aligned(),
-        w=out.root_fp,
+def run_query(out: OutputDir, db: DBDir, args: argparse.Namespace, lookup: dict = None):
+    pipeline = Pipeline(out.get_pipeline_state(), args.jobs, out.root_fp)
+    fast_path = None
+    if args.fast_path:
+        fast_path = FastPath(args.fast_id, args.fast_agreement, args.fast_min_hits)
+    adaptive = None
+    if args.adaptive_bootstrap:
+        adaptive = AdaptiveBootstrap(
+            args.bootstrap_batch,
+            args.bootstrap_min,
+            args.bootstrap_max,
+            args.bootstrap_tol,
+        )
+    needs_tree = add_subtree_stages(
+        pipeline,
+        out,
+        db,
+        float(args.id),
+        lookup,
+        args.searcher,
+        fast_path,
+        adaptive,
+        args.compress_sites,
     )
-    # Create the base tree to use the bootstrapping trees with
-    tree_builder.call(
-        m="GTRCAT",
-        n="subtree2",
-        p=10000,
-        s=out.get_nearest_seqs_aligned(),
-        w=out.root_fp,
+    if args.subtree_only:
+        pruner = None
+        if args.prune_reference:
+            pruner = ReferencePruner(args.prune_min_leaves, args.prune_hits)
+        add_full_tree_stages(pipeline, out, db, needs_tree, pruner, args.compress_sites)
+
+    metrics = Metrics()
+    token = set_current(metrics)
+    try:
+        with profiling(out.final_fp / "profile", args.profile, args.profile_interval):
+            pipeline.run()
+    finally:
+        try:
+            metrics.info["io"] = out.finish(args.archive)
+        finally:
+            reset_current(token)
+            metrics.write(out.get_metrics())
+
+
+def read_batch(seq: str) -> list:
+    """
+    (id, sequence) for each record if seq is a FASTA file with more than one, otherwise None
+    """
+    try:
+        if not Path(seq).is_file():
+            return None
+    except OSError:
+        # Too long to be a path
+        return None
+    with open(seq) as f:
+        records = [(desc.split()[0] if desc else "", s) for desc, s in parse_fasta(f)]
+    return records if len(records) > 1 else None
+
+
+def query_dirs(batch: list) -> list:
+    """
+    Output subdirectory for each (id, sequence), unique within the batch
+    """
+    dirs = {}
+    for i, (query_id, _) in enumerate(batch):
+        name = re.sub(r"[^\w.-]", "_", query_id) or f"query{i}"
+        dirs[i] = name if name not in dirs.values() else f"{name}_{i}"
+    return [dirs[i] for i in range(len(batch))]
+
+
+def run_batch(
+    batch: list,
+    db: DBDir,
+    args: argparse.Namespace,
+    results: ResultsWriter,
+    dirs: list = None,
+    summary: bool = True,
+    info: dict = None,
+) -> list:
+    """
+    Identify each (id, sequence) in its own output subdirectory, returns the ids that failed\n
+    With --dereplicate only one of each set of duplicates is run, and how many were skipped
+    goes in info if it's given
+    """
+    # Build or load everything shared up front, rather than racing to in every query
+    db.get_type_species()
+    lookup = db.get_genus_index()
+    if args.searcher == "kmer":
+        db.get_kmer_index()
+    else:
+        db.get_type_species_udb()
+    if args.subtree_only:
+        db.get_LTP_aligned()
+        db.get_LTP_tree()
+
+    dirs = dirs if dirs else query_dirs(batch)
+    reps = [(i, "unique") for i in range(len(batch))]
+    if args.dereplicate:
+        reps = dereplicate(batch, args.dereplicate == "contained")
+    duplicates = {}
+    for i, (rep, relation) in enumerate(reps):
+        if i != rep:
+            duplicates.setdefault(rep, []).append((i, relation))
+    derep = reduction(reps) if duplicates else None
+    if info is not None and derep:
+        info["dereplication"] = derep
+
+    def run_one(i: int):
+        query_id, seq = batch[i]
+        fanned = results
+        if results and i in duplicates:
+            fanned = FanOut(results, [batch[j][0] for j, _ in duplicates[i]])
+        out = OutputDir(
+            Path(args.output) / dirs[i],
+            seq,
+            args.overwrite,
+            fanned,
+            query_id,
+            args.scratch,
+        )
+        run_query(out, db, args, lookup)
+        for j, relation in duplicates.get(i, []):
+            fan_out(out.final_fp, query_id, Path(args.output) / dirs[j], relation)
+
+    failed = []
+    with cf.ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = {
+            pool.submit(run_one, i): i for i, (rep, _) in enumerate(reps) if i == rep
+        }
+        for future in cf.as_completed(futures):
+            try:
+                future.result()
+            except BaseException as e:
+                i = futures[future]
+                logging.error(f"Query {batch[i][0]} failed: {e!r}")
+                failed.append(batch[i][0])
+                failed += [batch[j][0] for j, _ in duplicates.get(i, [])]
+
+    if summary:
+        write_summary(args, dirs, failed, derep)
+    return failed
+
+
+def write_summary(
+    args: argparse.Namespace, dirs: list, failed: list, dereplication: dict = None
+):
+    """
+    Summarize the metrics of this run's queries, in dirs under --output, into
+    batch_metrics.json, leaving out anything else that's there from earlier runs
+    """
+    n = len(dirs)
+    summary_fp = Path(args.output) / "batch_metrics.json"
+    metrics_fps = [Path(args.output) / d / "metrics.json" for d in dirs]
+    summary = summarize([fp for fp in metrics_fps if fp.exists()])
+    if dereplication:
+        # Assuming a skipped duplicate would have taken as long as the average query did
+        skipped = dereplication["queries"] - dereplication["unique"]
+        dereplication = dict(
+            dereplication,
+            reduction=skipped / dereplication["queries"],
+            time_saved_s=skipped * summary["total"]["wall_s"]["mean"],
+        )
+        summary["dereplication"] = dereplication
+    with open(summary_fp, "w") as f:
+        json.dump(summary, f, indent=1)
+    logging.info(f"Finished {n - len(failed)}/{n} queries")
+    if dereplication:
+        logging.info(
+            f"Dereplication ran {dereplication['unique']}/{n} queries "
+            f"({dereplication['reduction']:.1%} fewer), saving about "
+            f"{dereplication['time_saved_s']:.1f}s"
+        )
+    if args.fast_path:
+        tiers = summary.get("tiers", {})
+        logging.info(
+            f"Fast path called {tiers.get('fast_path', 0)}/{summary['queries']} queries"
+        )
+
+
+def run_queue(db: DBDir, args: argparse.Namespace, results: ResultsWriter) -> list:
+    """
+    Work on the batch in --queue with --worker, otherwise queue --seq's batch there and wait
+    for workers to finish it, returns the ids that failed
+    """
+    queue = WorkQueue(args.queue, args.lease, args.max_attempts)
+    if args.worker:
+        return run_worker(queue, db, args)
+
+    batch = read_batch(args.seq)
+    if not batch:
+        batch = [("query", args.seq)]
+        if Path(args.seq).is_file():
+            with open(args.seq) as f:
+                batch = [(desc.split()[0], s) for desc, s in parse_fasta(f)]
+    dirs = query_dirs(batch)
+    queue.enqueue(batch, dirs, args.shard_size)
+
+    status = None
+    while not queue.finished():
+        # Workers reclaim stale shards too, but there may be none left to
+        queue.reclaim()
+        if queue.status() != status:
+            status = queue.status()
+            logging.info(f"Queue {args.queue}: {status}")
+        time.sleep(queue.poll_s)
+
+    failed = []
+    derep = None
+    fmt = Path(args.results).suffix.lstrip(".")
+    for name, info in queue.done().items():
+        failed += info["failed"]
+        # Workers dereplicate within their shards
+        if "dereplication" in info:
+            derep = derep if derep else dict.fromkeys(info["dereplication"], 0)
+            for k, v in info["dereplication"].items():
+                derep[k] += v
+        results_fp = queue.results_fp(name, info["attempt"], fmt)
+        if results and results_fp.exists():
+            results.extend(results_fp)
+    for shard in queue.shards("failed"):
+        shard_batch, _ = shard.read()
+        logging.error(
+            f"Shard {shard.name} was given up on after {shard.attempt + 1} attempts"
+        )
+        failed += [query_id for query_id, _ in shard_batch]
+
+    if derep:
+        # Shards with no duplicates didn't report, their queries were all run
+        derep["unique"] += len(batch) - derep["queries"]
+        derep["queries"] = len(batch)
+    write_summary(args, dirs, failed, derep)
+    return failed
+
+
+def run_worker(queue: WorkQueue, db: DBDir, args: argparse.Namespace) -> list:
+    """
+    Claim and run shards until the queue's batch is finished, returns the ids that failed
+    """
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    fmt = Path(args.results).suffix.lstrip(".")
+    failed = []
+    while True:
+        queue.reclaim()
+        shard = queue.claim(worker)
+        if shard is None:
+            if queue.finished():
+                break
+            time.sleep(queue.poll_s)
+            continue
+
+        batch, dirs = shard.read()
+        results = None
+        if args.results:
+            results = ResultsWriter(queue.results_fp(shard.name, shard.attempt, fmt))
+        info = {"worker": worker, "queries": len(batch)}
+        with queue.lease(shard):
+            try:
+                shard_failed = run_batch(
+                    batch, db, args, results, dirs, summary=False, info=info
+                )
+            finally:
+                if results:
+                    results.close()
+        info["failed"] = shard_failed
+        if queue.complete(shard, info):
+            failed += shard_failed
+
+    logging.info(f"{worker} is done, the queue's batch is finished")
+    return failed
+
+
+def add_subtree_stages(
+    pipeline: Pipeline,
+    out: OutputDir,
+    db: DBDir,
+    id: float,
+    lookup: dict = None,
+    searcher: str = "vsearch",
+    fast_path: FastPath = None,
+    adaptive: AdaptiveBootstrap = None,
+    compress: bool = False,
+) -> Callable:
+    """
+    Returns whether the query still needs its trees, which triage decides once the search is
+    done, for any other stages that depend on them
+    """
+
+    # Wrappers build up their args on the instance, so concurrent stages each get their own
+    def search():
+        if searcher == "kmer":
+            from .KmerIndex import KmerSearcher
+
+            # The index holds the sequences, so a compressed DB stays compressed
+            KmerSearcher(db.get_kmer_index()).call(
+                db.build_type_species(),
+                out.get_query(),
+                id,
+                out.get_nearest_seqs(),
+                out.get_nearest_hits(),
+            )
+        else:
+            VsearchSearcher().call_udb(
+                out.get_query(),
+                db.get_type_species_udb(),
+                id,
+                out.get_nearest_seqs(),
+                out.get_nearest_hits(),
+            )
+
+    pipeline.add(
+        Stage(
+            "search",
+            search,
+            inputs=[
+                (
+                    db.get_type_species_udb
+                    if searcher == "vsearch"
+                    else db.build_type_species
+                ),
+                out.get_query(),
+            ],
+            outputs=[out.get_nearest_seqs(), out.get_nearest_hits()],
+            params={"id": id, "searcher": searcher},
+        )
     )
-    # Create bootstrapped tree
-    tree_builder.call(
-        f="b",
-        m="PROTGAMMAILG",
-        n="final",
-        t=out.get_base_tree(),
-        w=out.root_fp,
-        z=out.get_bootstraps(),
+
+    tier = {}
+
+    def triage():
+        tier["name"], probs, reason = Subtree.triage(
+            read_hits(out.get_nearest_hits()),
+            fast_path,
+            lookup if lookup else db.get_genus_index(),
+        )
+        out.write_tier(tier["name"], reason)
+        if probs:
+            out.write_probs(probs, HEADERS["fast_path"], method="fast_path")
+            logging.info(f"Fast path finished! Check {out.probs_fp} for results.")
+
+    # Cheap and it starts probs_fp, so it always runs
+    pipeline.add(Stage("triage", triage, inputs=[out.get_nearest_hits()], cache=False))
+    needs_tree = lambda: tier["name"] == "tree"
+
+    pipeline.add(
+        Stage(
+            "reduce",
+            out.reduce_subtree,
+            inputs=[out.get_nearest_seqs(), out.get_query()],
+            outputs=[out.nearest_seqs_reduced_fp],
+            after=["triage"],
+            when=needs_tree,
+        )
     )
+    pipeline.add(
+        Stage(
+            "align",
+            lambda: MuscleAligner().call_simple(
+                out.nearest_seqs_reduced_fp, out.get_nearest_seqs_aligned()
+            ),
+            inputs=[out.nearest_seqs_reduced_fp],
+            outputs=[out.get_nearest_seqs_aligned()],
+            when=needs_tree,
+        )
+    )
+
+    aligned, weights = out.get_nearest_seqs_aligned(), None
+    if compress:
+        aligned = out.get_nearest_seqs_patterns()
+        weights = out.get_nearest_seqs_weights()
+        add_compress_stage(
+            pipeline,
+            "compress_sites",
+            out.get_nearest_seqs_aligned(),
+            aligned,
+            weights,
+            needs_tree,
+        )
+    alignment = [aligned, weights] if weights else [aligned]
+
+    # The supported tree, kept from the stage that made it so it isn't read back in
+    supported = {}
+
+    def load_algorithms():
+        from .Algorithms import Algorithms
+
+        return Algorithms(
+            supported.get("tree", out.get_bootstrapped_tree()),
+            db.build_type_species(),
+            out.get_query(),
+            lookup,
+        )
+
+    # Create the base tree to use the bootstrapping trees with
+    pipeline.add(
+        Stage(
+            "base_tree",
+            lambda: Subtree.base_tree(aligned, weights, out.root_fp),
+            inputs=alignment,
+            outputs=[out.get_base_tree()],
+            params=BASE_TREE_PARAMS,
+            when=needs_tree,
+        )
+    )
+
+    if adaptive:
+
+        def probs_for(t) -> dict:
+            supported["tree"] = t
+            return load_algorithms().bootstrap_probs()
+
+        def bootstraps():
+            Subtree.adaptive_bootstraps(
+                adaptive,
+                aligned,
+                out.get_base_tree(),
+                out.root_fp,
+                out.get_bootstraps(),
+                probs_for,
+                weights,
+                out.get_bootstrapped_tree(),
+            )
 
-    algorithms = Algorithms(
-        out.get_bootstrapped_tree(), db.get_type_species(), out.get_query()
+        # Supports are placed after every batch, so this stands in for bipartitions too
+        pipeline.add(
+            Stage(
+                "bootstraps",
+                bootstraps,
+                inputs=alignment + [out.get_base_tree()],
+                outputs=[out.get_bootstraps(), out.get_bootstrapped_tree()],
+                params=adaptive.params(),
+                when=needs_tree,
+            )
+        )
+    else:
+        # Create 100 bootstrap trees
+        pipeline.add(
+            Stage(
+                "bootstraps",
+                lambda: Subtree.bootstraps(aligned, weights, out.root_fp),
+                inputs=alignment,
+                outputs=[out.get_bootstraps()],
+                params=BOOTSTRAP_PARAMS,
+                when=needs_tree,
+            )
+        )
+
+        # Create bootstrapped tree, counting the bootstrap trees' splits in process
+        # rather than with RAxML -f b
+        def bipartitions():
+            from .Bipartitions import place_supports
+
+            supported["tree"] = place_supports(
+                out.get_base_tree(), out.get_bootstraps(), out.get_bootstrapped_tree()
+            )
+
+        pipeline.add(
+            Stage(
+                "bipartitions",
+                bipartitions,
+                inputs=[out.get_base_tree(), out.get_bootstraps()],
+                outputs=[out.get_bootstrapped_tree()],
+                params={"supports": "splits"},
+                when=needs_tree,
+            )
+        )
+
+    def subtree_probs():
+        for method, probs in Subtree.subtree_probs(load_algorithms()):
+            out.write_probs(probs, HEADERS[method], method=method)
+        logging.info(f"Subtree method finished! Check {out.probs_fp} for results.")
+
+    # Probabilities are cheap to recompute and share probs_fp, so they always run
+    pipeline.add(
+        Stage(
+            "subtree_probs",
+            subtree_probs,
+            inputs=[out.get_bootstrapped_tree()],
+            cache=False,
+            when=needs_tree,
+        )
     )
-    # Set write_mode to "w" to clear any existing output
-    out.write_probs(algorithms.distance_probs(), "Distance-based subtree probabilities", "w")
-    out.write_probs(
-        algorithms.bootstrap_probs(), "Bootstrap-based subtree probabilities"
+    return needs_tree
+
+
+def add_compress_stage(
+    pipeline: Pipeline,
+    name: str,
+    aligned_fp: Path,
+    patterns_fp: Path,
+    weights_fp: Path,
+    when: Callable = None,
+):
+    pipeline.add(
+        Stage(
+            name,
+            lambda: Subtree.compress(name, aligned_fp, patterns_fp, weights_fp),
+            inputs=[aligned_fp],
+            outputs=[patterns_fp, weights_fp],
+            when=when,
+        )
     )
 
-    logging.info(f"Subtree method finished! Check {out.probs_fp} for results.")
 
-    ### Full tree alignment method ###
+def add_full_tree_stages(
+    pipeline: Pipeline,
+    out: OutputDir,
+    db: DBDir,
+    when: Callable = None,
+    pruner: ReferencePruner = None,
+    compress: bool = False,
+):
+    reference_aligned, reference_tree = db.get_LTP_aligned, db.get_LTP_tree
+    if pruner:
 
-    if args.subtree_only:
-        aligner.call_profile(
-            True, db.get_LTP_aligned(), out.get_query(), out.get_combined_alignment()
+        def prune():
+            info = pruner.call(
+                db.get_LTP_clade_index(),
+                db.get_LTP_aligned_records,
+                read_hits(out.get_nearest_hits()),
+                out.get_pruned_tree(),
+                out.get_pruned_alignment(),
+            )
+            if current():
+                current().info["prune"] = info
+
+        pipeline.add(
+            Stage(
+                "prune_reference",
+                prune,
+                inputs=[out.get_nearest_hits(), db.get_LTP_aligned, db.get_LTP_tree],
+                outputs=[out.get_pruned_tree(), out.get_pruned_alignment()],
+                params=pruner.params(),
+                after=["triage"],
+                when=when,
+            )
         )
+        reference_aligned = out.get_pruned_alignment()
+        reference_tree = out.get_pruned_tree()
 
-        tree_builder.call(
-            None,
-            "y",
-            None,
-            "GTRCAT",
-            "combined",
-            10000,
+    def resolve(reference) -> Path:
+        return reference() if callable(reference) else reference
+
+    pipeline.add(
+        Stage(
+            "profile_align",
+            lambda: MuscleAligner().call_profile(
+                True,
+                resolve(reference_aligned),
+                out.get_query(),
+                out.get_combined_alignment(),
+            ),
+            inputs=[reference_aligned, out.get_query()],
+            outputs=[out.get_combined_alignment()],
+            after=["triage"],
+            when=when,
+        )
+    )
+    combined, weights = out.get_combined_alignment(), None
+    if compress:
+        combined, weights = out.get_combined_patterns(), out.get_combined_weights()
+        add_compress_stage(
+            pipeline,
+            "compress_combined",
             out.get_combined_alignment(),
-            db.get_LTP_tree(),
-            out.root_fp,
-            None,
+            combined,
+            weights,
+            when,
+        )
+    pipeline.add(
+        Stage(
+            "placement",
+            lambda: RAxMLTreeBuilder().call(
+                **PLACEMENT_PARAMS,
+                a=weights,
+                s=combined,
+                t=resolve(reference_tree),
+                w=out.root_fp,
+            ),
+            inputs=([combined, weights] if weights else [combined]) + [reference_tree],
+            outputs=[out.get_combined_tree()],
+            params=PLACEMENT_PARAMS,
+            when=when,
         )
+    )
 
+    def full_tree_probs():
         out.write_probs(
-            algorithms.train(db.get_LTP_tree()), "Full tree alignment probabilities"
+            Subtree.full_tree_probs(out.get_combined_tree(), db),
+            HEADERS["full_tree"],
+            method="full_tree",
         )
+        logging.info(f"Full tree method finished! Check {out.probs_fp} for results.")
 
-        logging.info(f"Full tree method finished! Check {out.probs_fp} for results.")
\ No newline at end of file
+    pipeline.add(
+        Stage(
+            "full_tree_probs",
+            full_tree_probs,
+            inputs=[out.get_combined_tree()],
+            after=["subtree_probs"],
+            cache=False,
+            when=when,
+        )
+    )
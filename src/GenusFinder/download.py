@@ -8,8 +8,8 @@ import logging
 import os
 import shutil
 import subprocess
-import urllib.request
 from io import StringIO
+from .DBDir import LTP_URL, LTP_VERSION, ltp_names, release_dir
 
 ### from unassigner.parse import parse_fasta ###
 def parse_fasta(f, trim_desc=False):
@@ -65,26 +65,31 @@ LTP_METADATA_COLS = [
     "rel_ltp",
     "NJ_support_pk4_ltp",
 ]
-LTP_METADATA_URL = (
-    "https://imedea.uib-csic.es/mmg/ltp/wp-content/uploads/ltp/LTP_01_2022.csv"
-)
-LTP_SEQS_URL = "https://imedea.uib-csic.es/mmg/ltp/wp-content/uploads/ltp/LTP_01_2022_blastdb.fasta"
-LTP_ALIGN_URL = "https://imedea.uib-csic.es/mmg/ltp/wp-content/uploads/ltp/LTP_01_2022_aligned.fasta"
-LTP_TREE_URL = "https://imedea.uib-csic.es/mmg/ltp/wp-content/uploads/ltp/tree_LTP_all_01_2022.ntree"
+
+
+def ltp_urls(version=LTP_VERSION):
+    return {kind: f"{LTP_URL}{name}" for kind, name in ltp_names(version).items()}
+
+
+LTP_METADATA_URL = ltp_urls()["csv"]
+LTP_SEQS_URL = ltp_urls()["blastdb"]
+LTP_ALIGN_URL = ltp_urls()["aligned"]
+LTP_TREE_URL = ltp_urls()["tree"]
 SPECIES_FASTA_FP = "type_species.fasta"
 REFSEQS_FASTA_FP = "refseqs.fasta"
 
 
-def clean(db_dir):
+def clean(db_dir, version=LTP_VERSION):
+    urls = ltp_urls(version)
     fps = [
-        url_fp(LTP_METADATA_URL),
-        url_fp(LTP_SEQS_URL),
-        url_fp(LTP_ALIGN_URL),
+        url_fp(urls["csv"]),
+        url_fp(urls["blastdb"]),
+        url_fp(urls["aligned"]),
         SPECIES_FASTA_FP,
         REFSEQS_FASTA_FP,
     ]
     for fp in fps:
-        fp_full = os.path.join(db_dir, fp)
+        fp_full = os.path.join(release_dir(db_dir, version), fp)
         if os.path.exists(fp_full):
             os.remove(fp_full)
 
@@ -98,6 +103,8 @@ def gunzip_fp(fp):
 
 
 def get_url(url, fp):
+    import urllib.request
+
     logging.info("Downloading {0}".format(url))
     with urllib.request.urlopen(url) as resp, open(fp, "wb") as f:
         shutil.copyfileobj(resp, f)
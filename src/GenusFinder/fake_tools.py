@@ -0,0 +1,411 @@
+"""
+Deterministic stand-ins for muscle, raxmlHPC and vsearch
+
+Outputs are well-formed (alignments, Newick trees with supports, bootstrap files,
+fastapairs) but carry no biological meaning, so orchestration overhead can be
+measured without the real binaries or LTP data. Standalone and stdlib only so it
+starts fast. Select it for the CLI wrappers with GENUSFINDER_FAKE_TOOLS=1 (or
+idgenus --fake_tools) and simulate work with GENUSFINDER_FAKE_LATENCY, either
+seconds for every tool or per tool like "muscle=0.1,raxmlHPC=0.5,vsearch=0.05".
+GENUSFINDER_FAKE_LOG names a file to append each launch's tool and time to
+
+    python fake_tools.py muscle -in seqs.fasta -out aligned.fasta
+"""
+
+import time
+
+# Before anything else so the launch time excludes our own imports
+LAUNCHED = time.time()
+
+import os
+import random
+import sys
+import zlib
+from pathlib import Path
+
+LATENCY_ENV = "GENUSFINDER_FAKE_LATENCY"
+LOG_ENV = "GENUSFINDER_FAKE_LOG"
+UDB_TAG = "# fake vsearch UDB"
+
+
+def latency_for(tool: str) -> float:
+    val = os.environ.get(LATENCY_ENV, "")
+    if not val:
+        return 0.0
+    if "=" not in val:
+        return float(val)
+    for pair in val.split(","):
+        k, _, v = pair.partition("=")
+        if k.strip() == tool:
+            return float(v)
+    return 0.0
+
+
+def seed_for(*vals) -> int:
+    return zlib.crc32("|".join(str(v) for v in vals).encode())
+
+
+def read_fasta(fp) -> list:
+    records = []
+    with open(fp) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith(">"):
+                records.append([line[1:].strip(), []])
+            elif line and records:
+                records[-1][1].append(line)
+    return [(desc, "".join(seq)) for desc, seq in records]
+
+
+def write_fasta(fp, records: list):
+    with open(fp, "w") as f:
+        for desc, seq in records:
+            f.write(f">{desc}\n{seq}\n")
+
+
+def parse_opts(argv: list, flags: tuple = ()) -> dict:
+    """
+    Collect "-x value" / "--xx value" pairs, names listed in flags take no value
+    """
+    opts = {}
+    i = 0
+    while i < len(argv):
+        key = argv[i].lstrip("-")
+        if key in flags:
+            opts[key] = True
+            i += 1
+        else:
+            opts[key] = argv[i + 1]
+            i += 2
+    return opts
+
+
+### Newick
+
+
+class Node:
+    def __init__(self, name: str = "", dist: float = None, children: list = None):
+        self.name = name
+        self.dist = dist
+        self.children = children if children else []
+        self.support = None
+
+    def leaves(self) -> list:
+        if not self.children:
+            return [self.name]
+        return [l for c in self.children for l in c.leaves()]
+
+    def internal(self) -> list:
+        if not self.children:
+            return []
+        return [self] + [n for c in self.children for n in c.internal()]
+
+    def to_newick(self) -> str:
+        s = ""
+        if self.children:
+            s = f"({','.join(c.to_newick() for c in self.children)})"
+            if self.support is not None:
+                s += str(self.support)
+        else:
+            s = self.name
+        if self.dist is not None:
+            s += f":{self.dist:.6f}"
+        return s
+
+
+def parse_newick(s: str) -> Node:
+    s = s.strip().rstrip(";")
+    pos = 0
+
+    def node() -> Node:
+        nonlocal pos
+        n = Node()
+        if s[pos] == "(":
+            pos += 1
+            n.children.append(node())
+            while s[pos] == ",":
+                pos += 1
+                n.children.append(node())
+            pos += 1  # ")"
+        start = pos
+        while pos < len(s) and s[pos] not in ",():":
+            pos += 1
+        label = s[start:pos]
+        if n.children:
+            n.support = label if label else None
+        else:
+            n.name = label
+        if pos < len(s) and s[pos] == ":":
+            pos += 1
+            start = pos
+            while pos < len(s) and s[pos] not in ",()":
+                pos += 1
+            n.dist = float(s[start:pos])
+        return n
+
+    return node()
+
+
+def read_trees(fp) -> list:
+    with open(fp) as f:
+        return [parse_newick(l) for l in f if l.strip()]
+
+
+### Trees
+
+
+def distances(records: list, weights: list = None) -> dict:
+    """
+    Pairwise p-distances, for an alignment only over columns that aren't all gaps (RAxML
+    treats them as missing data) with each column counted weights[i] times (-a)
+    """
+    if len({len(s) for _, s in records}) == 1:
+        length = len(records[0][1])
+        weights = weights if weights else [1] * length
+        keep = [
+            i
+            for i in range(length)
+            if weights[i] and any(s[i] != "-" for _, s in records)
+        ]
+        records = [(k, [s[i] for i in keep]) for k, s in records]
+        weights = [weights[i] for i in keep]
+        total = max(sum(weights), 1)
+    else:
+        weights = None
+
+    d = {}
+    for i, (a, sa) in enumerate(records):
+        for b, sb in records[i + 1 :]:
+            if weights:
+                d[(a, b)] = d[(b, a)] = (
+                    sum(w for x, y, w in zip(sa, sb, weights) if x != y) / total
+                )
+                continue
+            length = max(len(sa), len(sb), 1)
+            diff = sum(x != y for x, y in zip(sa, sb)) + abs(len(sa) - len(sb))
+            d[(a, b)] = d[(b, a)] = diff / length
+    return d
+
+
+def read_weights(fp) -> list:
+    with open(fp) as f:
+        return [int(w) for w in f.read().split()]
+
+
+def upgma(names: list, d: dict, rng: random.Random = None) -> Node:
+    """
+    Agglomerative tree over names, rng perturbs distances to mimic bootstrap resampling
+    """
+    names = sorted(names)
+    dist = {}
+    for i, a in enumerate(names):
+        for b in names[i + 1 :]:
+            dist[(a, b)] = d[(a, b)] * (rng.uniform(0.8, 1.2) if rng else 1.0)
+
+    # Average linkage with Lance-Williams updates
+    clusters = {name: (Node(name), 1, 0.0) for name in names}
+    while len(clusters) > 2:
+        (a, b), ab = min(dist.items(), key=lambda x: (x[1], x[0]))
+        (na, sa, ha), (nb, sb, hb) = clusters.pop(a), clusters.pop(b)
+        del dist[(a, b)]
+        for k in clusters:
+            dk = [dist.pop(p) for p in ((a, k), (k, a), (b, k), (k, b)) if p in dist]
+            dist[(a, k) if a < k else (k, a)] = (sa * dk[0] + sb * dk[1]) / (sa + sb)
+        height = max(ab / 2, ha, hb)
+        na.dist = max(height - ha, 1e-6)
+        nb.dist = max(height - hb, 1e-6)
+        clusters[a] = (Node(children=[na, nb]), sa + sb, height)
+
+    # RAxML writes unrooted trees, a trifurcation at the top
+    (na, _, ha), (nb, _, hb) = clusters.values()
+    na.dist = nb.dist = max(ha, hb, 1e-6) / 2
+    if na.children:
+        for c in na.children:
+            c.dist += na.dist
+        return Node(children=na.children + [nb])
+    return Node(children=[na, nb])
+
+
+def splits(t: Node, ref: str) -> dict:
+    """
+    Leaf bipartition of each internal node, canonicalized to the side without ref
+    """
+    everything = frozenset(t.leaves())
+    out = {}
+    for n in t.internal():
+        side = frozenset(n.leaves())
+        out[id(n)] = everything - side if ref in side else side
+    return out
+
+
+### Tools
+
+
+def muscle(argv: list):
+    opts = parse_opts(argv, ("profile",))
+    if opts.get("profile"):
+        profile = read_fasta(opts["in1"])
+        length = max((len(s) for _, s in profile), default=0)
+        added = [
+            (desc, s[:length].ljust(length, "-")) for desc, s in read_fasta(opts["in2"])
+        ]
+        write_fasta(opts["out"], profile + added)
+    else:
+        records = read_fasta(opts["in"])
+        length = max((len(s) for _, s in records), default=0)
+        write_fasta(opts["out"], [(desc, s.ljust(length, "-")) for desc, s in records])
+
+
+def raxml(argv: list):
+    opts = parse_opts(argv)
+    n = opts["n"]
+    w = Path(opts.get("w", "."))
+    mode = opts.get("f")
+    weights = read_weights(opts["a"]) if "a" in opts else None
+
+    def out(kind: str) -> Path:
+        return w / f"RAxML_{kind}.{n}"
+
+    if (out("info")).exists():
+        sys.stderr.write(f"RAxML output files with the run ID <{n}> already exist\n")
+        sys.exit(1)
+
+    if mode == "b":
+        best = read_trees(opts["t"])[0]
+        boots = read_trees(opts["z"])
+        ref = sorted(best.leaves())[0]
+        boot_splits = {}
+        for b in boots:
+            for s in splits(b, ref).values():
+                boot_splits[s] = boot_splits.get(s, 0) + 1
+        best_splits = splits(best, ref)
+        for node in best.internal()[1:]:
+            node.support = round(
+                100 * boot_splits.get(best_splits[id(node)], 0) / len(boots)
+            )
+        with open(out("bipartitions"), "w") as f:
+            f.write(f"{best.to_newick()};\n")
+        with open(out("bipartitionsBranchLabels"), "w") as f:
+            f.write(f"{best.to_newick()};\n")
+    elif mode == "y":
+        t = read_trees(opts["t"])[0]
+        records = {desc.split()[0]: s for desc, s in read_fasta(opts["s"])}
+        known = set(t.leaves())
+        ref_records = [(k, s) for k, s in records.items() if k in known]
+        with open(out("originalLabelledTree"), "w") as f:
+            f.write(f"{t.to_newick()};\n")
+        classification = []
+        for name, seq in records.items():
+            if name in known:
+                continue
+            # Attach as sister of the most similar reference leaf
+            d = distances([(name, seq)] + ref_records, weights)
+            nearest = min((k for k, _ in ref_records), key=lambda k: (d[(name, k)], k))
+            for parent in t.internal():
+                for i, c in enumerate(parent.children):
+                    if c.name == nearest and not c.children:
+                        dist = c.dist if c.dist else 0.0
+                        c.dist = dist / 2
+                        q = Node(f"QUERY___{name}", d[(name, nearest)] / 2)
+                        parent.children[i] = Node(children=[c, q], dist=dist / 2)
+            classification.append(f"{name} {nearest} 1 {d[(name, nearest)]:.6f}")
+        with open(out("labelledTree"), "w") as f:
+            f.write(f"{t.to_newick()};\n")
+        with open(out("classification"), "w") as f:
+            f.write("\n".join(classification) + "\n")
+    else:
+        records = [(desc.split()[0], s) for desc, s in read_fasta(opts["s"])]
+        names = [k for k, _ in records]
+        for k in set(names):
+            if names.count(k) > 1:
+                sys.stderr.write(
+                    f"ERROR: Taxon Name {k} is contained twice in alignment\n"
+                )
+                sys.exit(1)
+        d = distances(records, weights)
+        if "b" in opts:
+            reps = int(opts.get("N", 1))
+            with open(out("bootstrap"), "w") as f:
+                for r in range(reps):
+                    rng = random.Random(seed_for(opts["b"], r, *names))
+                    f.write(f"{upgma(names, d, rng).to_newick()};\n")
+        else:
+            tree = f"{upgma(names, d).to_newick()};\n"
+            for kind in ("bestTree", "parsimonyTree", "result"):
+                with open(out(kind), "w") as f:
+                    f.write(tree)
+            with open(out("log"), "w") as f:
+                f.write("0.0 -1000.0\n")
+
+    with open(out("info"), "w") as f:
+        f.write(f"Fake RAxML run {n}: {' '.join(argv)}\n")
+
+
+def vsearch(argv: list):
+    opts = parse_opts(argv, ("notrunclabels",))
+    min_id = float(opts.get("id", 0))
+    maxaccepts = int(opts.get("maxaccepts", 1))
+    fields = opts.get("userfields", "query+target+id").split("+")
+
+    def label(desc: str) -> str:
+        return desc if opts.get("notrunclabels") else desc.split()[0]
+
+    if "makeudb_usearch" in opts:
+        # A "UDB" that's the FASTA with labels as they'd be stored, read_fasta skips the tag
+        with open(opts["output"], "w") as f:
+            f.write(f"{UDB_TAG}\n")
+            for desc, s in read_fasta(opts["makeudb_usearch"]):
+                f.write(f">{label(desc)}\n{s}\n")
+        return
+
+    targets = [(label(desc), s) for desc, s in read_fasta(opts["db"])]
+    queries = [(label(desc), s) for desc, s in read_fasta(opts["usearch_global"])]
+
+    pairs = []
+    for q_desc, q_seq in queries:
+        hits = []
+        for t_desc, t_seq in targets:
+            length = max(len(q_seq), len(t_seq), 1)
+            mism = sum(a != b for a, b in zip(q_seq, t_seq))
+            gaps = abs(len(q_seq) - len(t_seq))
+            ident = (length - mism - gaps) / length
+            if ident >= min_id:
+                hits.append((-ident, t_desc, t_seq, length, mism, gaps))
+        hits.sort()
+        for h in hits[: maxaccepts if maxaccepts else None]:
+            pairs.append((q_desc, q_seq) + h)
+
+    if "fastapairs" in opts:
+        with open(opts["fastapairs"], "w") as f:
+            for q_desc, q_seq, _, t_desc, t_seq, length, _, _ in pairs:
+                f.write(f">{q_desc}\n{q_seq.ljust(length, '-')}\n")
+                f.write(f">{t_desc}\n{t_seq.ljust(length, '-')}\n\n")
+    if "userout" in opts:
+        with open(opts["userout"], "w") as f:
+            for q_desc, _, ident, t_desc, _, length, mism, gaps in pairs:
+                vals = {
+                    "query": q_desc,
+                    "target": t_desc,
+                    "id": f"{-ident * 100:.1f}",
+                    "alnlen": length,
+                    "mism": mism,
+                    "gaps": gaps,
+                }
+                f.write("\t".join(str(vals[k]) for k in fields) + "\n")
+
+
+TOOLS = {"muscle": muscle, "raxmlHPC": raxml, "vsearch": vsearch}
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    tool = argv[0]
+    if os.environ.get(LOG_ENV):
+        with open(os.environ[LOG_ENV], "a") as f:
+            f.write(f"{tool}\t{LAUNCHED}\n")
+    time.sleep(latency_for(tool))
+    TOOLS[tool](argv[1:])
+
+
+if __name__ == "__main__":
+    main()
@@ -7,20 +7,21 @@ import argparse
 import sys
 import os
 
+from GenusFinder.DBDir import LTP_VERSION, release_dir
+from GenusFinder.Metrics import timed
+from GenusFinder.Profile import MODES, profiling
 from GenusFinder.download import (
-    LTP_TREE_URL,
     get_url,
     clean,
-    LTP_METADATA_URL,
-    LTP_SEQS_URL,
-    LTP_ALIGN_URL,
+    ltp_urls,
     # process_ltp_seqs,
 )
 
 
 def use_or_download(optional_fp, url, db_dir):
     if optional_fp is None:
-        return get_url(url, os.path.join(db_dir, os.path.basename(url)))
+        with timed(f"download:{os.path.basename(url)}"):
+            return get_url(url, os.path.join(db_dir, os.path.basename(url)))
     else:
         return optional_fp
 
@@ -56,6 +57,30 @@ def main(argv=None):
     p.add_argument(
         "--db-dir", help=("Filepath to download the files to " "[default: db/]")
     )
+    p.add_argument(
+        "--ltp_version",
+        help=f"LTP release to download, files go in its own directory under the db dir [default: {LTP_VERSION}]",
+        default=LTP_VERSION,
+    )
+    p.add_argument(
+        "--profile",
+        help=(
+            "Profile each download's Python code, cprofile traces every call "
+            "and sample is cheaper [default: off]"
+        ),
+        choices=MODES,
+    )
+    p.add_argument(
+        "--profile_dir",
+        help="Directory to write profiles to [default: profile/]",
+        default="profile/",
+    )
+    p.add_argument(
+        "--profile_interval",
+        type=float,
+        help="Seconds between stack samples with --profile sample [default: 0.005]",
+        default=0.005,
+    )
     args = p.parse_args(argv)
 
     if args.db_dir:
@@ -66,11 +91,15 @@ def main(argv=None):
         db_dir = os.path.join(os.getcwd(), "db/")
 
     if args.clean is True:
-        clean(db_dir)
+        clean(db_dir, args.ltp_version)
         sys.exit(0)
 
-    ltp_metadata_fp = use_or_download(args.ltp_metadata_fp, LTP_METADATA_URL, db_dir)
-    ltp_seqs_fp = use_or_download(args.ltp_seqs_fp, LTP_SEQS_URL, db_dir)
-    # process_ltp_seqs(ltp_seqs_fp, db_dir)
-    ltp_align_fp = use_or_download(args.ltp_align_fp, LTP_ALIGN_URL, db_dir)
-    ltp_tree_fp = use_or_download(None, LTP_TREE_URL, db_dir)
+    urls = ltp_urls(args.ltp_version)
+    release_fp = str(release_dir(db_dir, args.ltp_version))
+    os.makedirs(release_fp, exist_ok=True)
+    with profiling(args.profile_dir, args.profile, args.profile_interval):
+        ltp_metadata_fp = use_or_download(args.ltp_metadata_fp, urls["csv"], release_fp)
+        ltp_seqs_fp = use_or_download(args.ltp_seqs_fp, urls["blastdb"], release_fp)
+        # process_ltp_seqs(ltp_seqs_fp, db_dir)
+        ltp_align_fp = use_or_download(args.ltp_align_fp, urls["aligned"], release_fp)
+        ltp_tree_fp = use_or_download(None, urls["tree"], release_fp)
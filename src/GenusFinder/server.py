@@ -0,0 +1,470 @@
+import argparse
+import concurrent.futures as cf
+import http.client
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from .Bootstrap import AdaptiveBootstrap
+from .CLI import FAKE_TOOLS_ENV, TOOL_TIMEOUT_ENV, ToolError
+from .DBDir import LTP_VERSION, DBDir
+from .FastPath import FastPath
+from .Identify import identify_seq
+from .Metrics import Metrics, reset_current, set_current
+from .Prune import ReferencePruner
+from .Subtree import HEADERS
+from .fake_tools import LATENCY_ENV
+
+
+class IdentificationService:
+    """
+    Holds the DB and genus index in memory and runs identification jobs on a worker pool,
+    so a job's latency doesn't include any cold-start costs\n
+    fast_path, adaptive, compress, full_tree and pruner apply to every job, as in
+    identify_seq. With full_tree, the LTP alignment, tree and clade index are loaded up
+    front too
+    """
+
+    def __init__(
+        self,
+        db: DBDir,
+        work_fp: Path,
+        workers: int = 2,
+        jobs: int = 2,
+        keep_jobs: bool = False,
+        searcher: str = "vsearch",
+        fast_path: FastPath = None,
+        adaptive: AdaptiveBootstrap = None,
+        compress: bool = False,
+        full_tree: bool = False,
+        pruner: ReferencePruner = None,
+    ) -> None:
+        self.db = db
+        self.work_fp = Path(work_fp)
+        self.jobs = jobs
+        self.keep_jobs = keep_jobs
+        self.searcher = searcher
+        self.fast_path = fast_path
+        self.adaptive = adaptive
+        self.compress = compress
+        self.full_tree = full_tree
+        self.pruner = pruner
+        os.makedirs(self.work_fp, exist_ok=True)
+
+        start = time.perf_counter()
+        # Pay for the heavy imports (sklearn, ete3) and every DB check now rather than per query
+        from .Algorithms import Algorithms
+
+        self.type_species_fp = self.db.get_type_species()
+        self.lookup = self.db.get_genus_index()
+        if self.searcher == "kmer":
+            self.db.get_kmer_index()
+        else:
+            self.db.get_type_species_udb()
+        if self.full_tree:
+            self.db.get_LTP_aligned()
+            self.db.get_LTP_tree()
+            self.db.get_LTP_clade_index()
+        logging.info(
+            f"Loaded {len(self.lookup)} type species in {time.perf_counter() - start:.2f}s"
+        )
+
+        self.pool = cf.ThreadPoolExecutor(max_workers=workers)
+        self.running = 0
+        self.lock = threading.Lock()
+
+    def submit(self, seq: str, id: float = 0.9, job_id: str = None) -> queue.Queue:
+        """
+        Queue a job, its events (dicts, ending with "done" or "error") arrive on the returned queue
+        """
+        job_id = job_id if job_id else uuid.uuid4().hex
+        events = queue.Queue()
+        events.put({"event": "accepted", "job": job_id})
+        self.pool.submit(self._run, job_id, seq, id, events)
+        return events
+
+    def _run(self, job_id: str, seq: str, id: float, events: queue.Queue):
+        with self.lock:
+            self.running += 1
+        # Only kept jobs get a directory of their own, the rest only write what the tools
+        # need, to a temporary one
+        job_fp = self.work_fp / job_id if self.keep_jobs else None
+        start = time.perf_counter()
+        metrics = Metrics()
+        token = set_current(metrics)
+
+        def stream(method: str, probs: dict):
+            events.put(
+                {"event": "probabilities", "method": HEADERS[method], "probs": probs}
+            )
+
+        try:
+            identify_seq(
+                seq,
+                self.db,
+                id,
+                self.searcher,
+                self.lookup,
+                self.fast_path,
+                self.adaptive,
+                self.compress,
+                jobs=self.jobs,
+                work_fp=job_fp,
+                scratch=str(self.work_fp),
+                on_probs=stream,
+                full_tree=self.full_tree,
+                pruner=self.pruner,
+            )
+            if job_fp:
+                metrics.write(job_fp / "metrics.json")
+            result = {"event": "done", "job": job_id}
+        except ToolError as e:
+            logging.error(f"Job {job_id} failed: {e}")
+            result = {
+                "event": "error",
+                "job": job_id,
+                "message": str(e),
+                "tool": e.result.to_dict(),
+            }
+        except BaseException as e:
+            logging.error(f"Job {job_id} failed: {e!r}")
+            result = {"event": "error", "job": job_id, "message": repr(e)}
+        finally:
+            reset_current(token)
+            with self.lock:
+                self.running -= 1
+
+        result["latency_s"] = time.perf_counter() - start
+        events.put(result)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """
+    POST /identify with {"seq": ..., "id": 0.9} streams newline-delimited JSON events,
+    GET /health reports the number of running jobs
+    """
+
+    protocol_version = "HTTP/1.1"
+    service: IdentificationService = None
+
+    def address_string(self) -> str:
+        # Unix socket clients have no address
+        return str(self.client_address[0]) if self.client_address else "unix"
+
+    def log_message(self, format: str, *args):
+        logging.debug(f"{self.address_string()} {format % args}")
+
+    def send_json(self, code: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path != "/health":
+            return self.send_json(404, {"error": f"Unknown path {self.path}"})
+        self.send_json(200, {"status": "ok", "running": self.service.running})
+
+    def do_POST(self):
+        if self.path != "/identify":
+            return self.send_json(404, {"error": f"Unknown path {self.path}"})
+        try:
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            seq = body["seq"]
+            id = float(body.get("id", 0.9))
+        except (KeyError, TypeError, ValueError) as e:
+            return self.send_json(
+                400, {"error": f"Expected JSON with a seq and a numeric id: {e!r}"}
+            )
+
+        events = self.service.submit(seq, id, body.get("job"))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        while True:
+            event = events.get()
+            line = (json.dumps(event) + "\n").encode()
+            self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+            self.wfile.flush()
+            if event["event"] in ("done", "error"):
+                break
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class ThreadingUnixHTTPServer(
+    socketserver.ThreadingMixIn, socketserver.UnixStreamServer
+):
+    daemon_threads = True
+
+
+def make_server(service: IdentificationService, address: str):
+    """
+    address is "host:port" for TCP or a filesystem path for a Unix socket
+    """
+    handler = type("Handler", (ServiceHandler,), {"service": service})
+    if ":" in address:
+        host, port = address.rsplit(":", 1)
+        return ThreadingHTTPServer((host, int(port)), handler)
+    if os.path.exists(address):
+        os.remove(address)
+    return ThreadingUnixHTTPServer(address, handler)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float = None) -> None:
+        super().__init__("localhost", timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+def request_identification(
+    address: str, seq: str, id: float = 0.9, timeout: float = None
+):
+    """
+    Client for a running service, yields each event as it arrives
+    """
+    if ":" in address:
+        host, port = address.rsplit(":", 1)
+        conn = http.client.HTTPConnection(host, int(port), timeout=timeout)
+    else:
+        conn = UnixHTTPConnection(address, timeout=timeout)
+    try:
+        conn.request(
+            "POST",
+            "/identify",
+            json.dumps({"seq": seq, "id": id}),
+            {"Content-Type": "application/json"},
+        )
+        resp = conn.getresponse()
+        if resp.status != 200:
+            raise RuntimeError(f"Service returned {resp.status}: {resp.read()!r}")
+        for line in resp:
+            yield json.loads(line)
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(
+        description="Serve genus identifications with references preloaded"
+    )
+    p.add_argument(
+        "--address",
+        help="host:port to listen on, or a path for a Unix socket (Default: 127.0.0.1:8016)",
+        default="127.0.0.1:8016",
+    )
+    p.add_argument(
+        "--ncbi_api_key",
+        help="your NCBI API key for making more esearch requests per second",
+        default="",
+    )
+    p.add_argument(
+        "--db", help="the directory in which to put all database files", default="db/"
+    )
+    p.add_argument(
+        "--ltp_version",
+        help=f"the LTP release to use (Default: {LTP_VERSION})",
+        default=LTP_VERSION,
+    )
+    p.add_argument(
+        "--db_compression",
+        help="store database files built from now on compressed (Default: none)",
+        choices=["none", "gzip", "zstd"],
+        default="none",
+    )
+    p.add_argument(
+        "--workdir",
+        help="the directory in which to put each job's files (Default: genusd_jobs/)",
+        default="genusd_jobs/",
+    )
+    p.add_argument(
+        "--workers", type=int, help="jobs to run at once (Default: 2)", default=2
+    )
+    p.add_argument(
+        "--jobs",
+        type=int,
+        help="the number of independent pipeline stages to run at once per job (Default: 2)",
+        default=2,
+    )
+    p.add_argument(
+        "--searcher",
+        help="how to find the nearest type species, vsearch or an in-process k-mer index (Default: vsearch)",
+        choices=["vsearch", "kmer"],
+        default="vsearch",
+    )
+    p.add_argument(
+        "--fast_path",
+        help="call the genus straight from the search hits, skipping the trees, when they're close and agree",
+        action="store_true",
+    )
+    p.add_argument(
+        "--fast_id",
+        type=float,
+        help="the percent identity a hit needs to count towards a fast path call (Default: 99.0)",
+        default=99.0,
+    )
+    p.add_argument(
+        "--fast_agreement",
+        type=float,
+        help="the fraction of those hits that have to be from one genus (Default: 1.0)",
+        default=1.0,
+    )
+    p.add_argument(
+        "--fast_min_hits",
+        type=int,
+        help="the number of those hits needed to make a fast path call at all (Default: 3)",
+        default=3,
+    )
+    p.add_argument(
+        "--adaptive_bootstrap",
+        help="run bootstrap replicates in batches until the bootstrap-based probabilities stop changing, instead of always 100",
+        action="store_true",
+    )
+    p.add_argument(
+        "--bootstrap_batch",
+        type=int,
+        help="replicates per batch with --adaptive_bootstrap (Default: 10)",
+        default=10,
+    )
+    p.add_argument(
+        "--bootstrap_min",
+        type=int,
+        help="the fewest replicates to run with --adaptive_bootstrap (Default: 20)",
+        default=20,
+    )
+    p.add_argument(
+        "--bootstrap_max",
+        type=int,
+        help="the most replicates to run with --adaptive_bootstrap (Default: 100)",
+        default=100,
+    )
+    p.add_argument(
+        "--bootstrap_tol",
+        type=float,
+        help="stop once no genus probability changes by more than this between batches (Default: 0.01)",
+        default=0.01,
+    )
+    p.add_argument(
+        "--compress_sites",
+        help="drop all-gap alignment columns and give RAxML each distinct column once, with how often it occurs as its weight",
+        action="store_true",
+    )
+    p.add_argument(
+        "--full_tree",
+        help="also run the more computationally intensive full tree method, with the LTP tree and alignment preloaded",
+        action="store_true",
+    )
+    p.add_argument(
+        "--prune_reference",
+        help="with --full_tree, place each query in the clade around its search hits instead of the whole LTP tree",
+        action="store_true",
+    )
+    p.add_argument(
+        "--prune_min_leaves",
+        type=int,
+        help="the fewest leaves the pruned clade can have (Default: 50)",
+        default=50,
+    )
+    p.add_argument(
+        "--prune_hits",
+        type=int,
+        help="how many of the best search hits the pruned clade has to hold (Default: 10)",
+        default=10,
+    )
+    p.add_argument(
+        "--keep_jobs",
+        help="keep each job's files when it finishes",
+        action="store_true",
+    )
+    p.add_argument(
+        "--fake_tools",
+        help="use deterministic stand-ins for muscle, RAxML and vsearch",
+        action="store_true",
+    )
+    p.add_argument(
+        "--fake_latency", help="simulated runtime of each fake tool", default=""
+    )
+    p.add_argument(
+        "--tool_timeout",
+        help="seconds muscle, RAxML or vsearch can run before it's killed and the job fails, or per tool like 'muscle=600,raxmlHPC=3600' (Default: 3600)",
+        default="3600",
+    )
+    p.add_argument(
+        "--log_level",
+        type=int,
+        help="Sets the log level, default is info, 10 for debug (Default: 20)",
+        default=20,
+    )
+
+    args = p.parse_args(argv)
+    logging.basicConfig()
+    logging.getLogger().setLevel(args.log_level)
+
+    if args.fake_tools:
+        os.environ[FAKE_TOOLS_ENV] = "1"
+        if args.fake_latency:
+            os.environ[LATENCY_ENV] = args.fake_latency
+    if args.tool_timeout:
+        os.environ[TOOL_TIMEOUT_ENV] = args.tool_timeout
+
+    fast_path = None
+    if args.fast_path:
+        fast_path = FastPath(args.fast_id, args.fast_agreement, args.fast_min_hits)
+    adaptive = None
+    if args.adaptive_bootstrap:
+        adaptive = AdaptiveBootstrap(
+            args.bootstrap_batch,
+            args.bootstrap_min,
+            args.bootstrap_max,
+            args.bootstrap_tol,
+        )
+    pruner = None
+    if args.prune_reference:
+        pruner = ReferencePruner(args.prune_min_leaves, args.prune_hits)
+    service = IdentificationService(
+        DBDir(
+            args.db,
+            args.ncbi_api_key,
+            None if args.db_compression == "none" else args.db_compression,
+            ltp_version=args.ltp_version,
+        ),
+        args.workdir,
+        args.workers,
+        args.jobs,
+        args.keep_jobs,
+        args.searcher,
+        fast_path,
+        adaptive,
+        args.compress_sites,
+        args.full_tree,
+        pruner,
+    )
+    server = make_server(service, args.address)
+    logging.info(f"Listening on {args.address}...")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info("Shutting down...")
+    finally:
+        server.server_close()
+        service.shutdown()
+        sys.exit(0)
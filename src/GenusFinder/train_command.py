@@ -1,15 +1,47 @@
 import argparse
-from ete3 import Tree
-
-from GenusFinder.train import learn_curve
+from GenusFinder.DBDir import LTP_VERSION, DBDir
+from GenusFinder.Metrics import timed
+from GenusFinder.Profile import MODES, profiling
 
 
 def main(argv=None):
     p = argparse.ArgumentParser()
     p.add_argument("type_species", help="The exact name of the type species node")
+    p.add_argument(
+        "--db",
+        help="the directory with all database files (Default: db/)",
+        default="db/",
+    )
+    p.add_argument(
+        "--ltp_version",
+        help=f"the LTP release whose tree to train on (Default: {LTP_VERSION})",
+        default=LTP_VERSION,
+    )
+    p.add_argument(
+        "--profile",
+        help="profile loading the tree and training, cprofile traces every call and sample is cheaper",
+        choices=MODES,
+    )
+    p.add_argument(
+        "--profile_dir",
+        help="the directory to write profiles to (Default: profile/)",
+        default="profile/",
+    )
+    p.add_argument(
+        "--profile_interval",
+        type=float,
+        help="seconds between stack samples with --profile sample (Default: 0.005)",
+        default=0.005,
+    )
 
     args = p.parse_args(argv)
 
-    with open("db/tree_LTP_all_01_2022.ntree") as f:
-        t_str = "".join(([s.strip() for s in f.readlines()]))
-        learn_curve(args.type_species, Tree(t_str, format=1, quoted_node_names=True))
+    # Heavy imports wait until the arguments are known to be good
+    from GenusFinder.train import learn_curve
+
+    db = DBDir(args.db, "", ltp_version=args.ltp_version)
+    with profiling(args.profile_dir, args.profile, args.profile_interval):
+        with timed("load_tree"):
+            t = db.read_LTP_tree()
+        with timed("learn_curve"):
+            learn_curve(args.type_species, t)
@@ -0,0 +1,292 @@
+"""
+Microbenchmarks for GenusFinder's Python hot paths on generated data
+
+Record a baseline, then compare a later run against it:
+
+    python -m tests.benchmark.bench run --output baseline.json
+    python -m tests.benchmark.bench run --output current.json
+    python -m tests.benchmark.bench compare baseline.json current.json --threshold 0.2
+"""
+
+import argparse
+import json
+import logging
+import numpy as np
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from ete3 import Tree
+from pathlib import Path
+from .. import INC
+from src.GenusFinder import parse_fasta
+from src.GenusFinder.Algorithms import Algorithms
+from src.GenusFinder.Bipartitions import place_supports
+from src.GenusFinder.CladeIndex import CladeIndex
+from src.GenusFinder.DBDir import DBDir
+from src.GenusFinder.OutputDir import OutputDir
+from .generate import (
+    leaf_names,
+    write_fastapairs,
+    write_ltp_alignment,
+    write_query,
+    write_tree,
+    write_type_species,
+)
+
+DEFAULT_SIZES = [50, 200, 1000]
+N_GENERA = 10
+
+
+def setup_algorithms(d: Path, n: int, rng: random.Random) -> Algorithms:
+    names = leaf_names(n, N_GENERA)
+    return Algorithms(
+        write_tree(d / "tree.nwk", names, rng),
+        write_type_species(d / "type_species.fasta", names, rng),
+        write_query(d / "query.fasta", rng),
+    )
+
+
+def bench_distance_probs(d: Path, n: int, rng: random.Random):
+    a = setup_algorithms(d, n, rng)
+    return lambda: Algorithms.distance_probs(a)
+
+
+def bench_bootstrap_probs(d: Path, n: int, rng: random.Random):
+    a = setup_algorithms(d, n, rng)
+    return lambda: Algorithms.bootstrap_probs(a)
+
+
+def bench_get_genus(d: Path, n: int, rng: random.Random):
+    a = setup_algorithms(d, n, rng)
+    names = leaf_names(n, N_GENERA)
+    return lambda: [a.get_genus(name) for name in names[:: max(1, n // 50)]]
+
+
+def bench_learn_curve(d: Path, n: int, rng: random.Random):
+    names = leaf_names(n, N_GENERA)
+    with open(write_tree(d / "tree.nwk", names, rng)) as f:
+        t = Tree(f.readline())
+    return lambda: Algorithms.learn_curve(names[0], t)
+
+
+def bench_score(d: Path, n: int, rng: random.Random):
+    names = leaf_names(max(n, 30), N_GENERA)
+    with open(write_tree(d / "tree.nwk", names, rng)) as f:
+        lr = Algorithms.learn_curve(names[0], Tree(f.readline()))
+    _, coefs, intercepts = Algorithms.stack_models({name: lr for name in names[:n]})
+    # 100 placed queries against every type species
+    D = np.array([[rng.uniform(0, 0.3) for _ in range(n)] for _ in range(100)])
+    return lambda: Algorithms.score(D, coefs, intercepts)
+
+
+def bench_CladeIndex_build(d: Path, n: int, rng: random.Random):
+    names = leaf_names(n, N_GENERA)
+    with open(write_tree(d / "tree.nwk", names, rng)) as f:
+        t = Tree(f.readline())
+    return lambda: CladeIndex(t, lambda name: name[0])
+
+
+def bench_CladeIndex_query(d: Path, n: int, rng: random.Random):
+    names = leaf_names(n, N_GENERA)
+    with open(write_tree(d / "tree.nwk", names, rng)) as f:
+        index = CladeIndex(Tree(f.readline()), lambda name: name[0])
+    sample = names[:: max(1, n // 50)]
+    # What learn_curve asks of it for each type species
+    return lambda: [index.histogram(index.clade([name], 30)) for name in sample]
+
+
+def bench_place_supports(d: Path, n: int, rng: random.Random):
+    names = leaf_names(n, N_GENERA)
+    write_tree(d / "best.nwk", names, rng)
+    # 100 bootstrap replicates, as the subtree method runs
+    with open(d / "bootstraps.nwk", "w") as f:
+        for _ in range(100):
+            with open(write_tree(d / "boot.nwk", names, rng)) as f_in:
+                f.write(f_in.read().strip() + "\n")
+    return lambda: place_supports(d / "best.nwk", d / "bootstraps.nwk")
+
+
+def bench_parse_fasta(d: Path, n: int, rng: random.Random):
+    fp = write_type_species(d / "type_species.fasta", leaf_names(n, N_GENERA), rng)
+
+    def f():
+        with open(fp) as f_in:
+            for _ in parse_fasta(f_in):
+                pass
+
+    return f
+
+
+def bench_DBDir_parse_fasta(d: Path, n: int, rng: random.Random):
+    fp = write_type_species(d / "type_species.fasta", leaf_names(n, N_GENERA), rng)
+
+    def f():
+        with open(fp) as f_in:
+            for _ in DBDir._parse_fasta(f_in):
+                pass
+
+    return f
+
+
+def setup_db(d: Path, n: int, rng: random.Random) -> DBDir:
+    db = DBDir(d / "db", "")
+    write_ltp_alignment(d / "raw_alignment.fasta", leaf_names(n, N_GENERA), rng)
+    return db
+
+
+def bench_clean_alignment(d: Path, n: int, rng: random.Random):
+    db = setup_db(d, n, rng)
+
+    def f():
+        shutil.copy(d / "raw_alignment.fasta", db.LTP_aligned_fp)
+        db.clean_alignment()
+
+    return f
+
+
+def bench_verify_alignment(d: Path, n: int, rng: random.Random):
+    db = setup_db(d, n, rng)
+    shutil.copy(d / "raw_alignment.fasta", db.LTP_aligned_fp)
+    db.clean_alignment()
+    return db.verify_alignment
+
+
+def bench_reduce_subtree(d: Path, n: int, rng: random.Random):
+    out = OutputDir(d / "output", write_query(d / "query.fasta", rng), False)
+    write_fastapairs(out.get_nearest_seqs(), leaf_names(n, N_GENERA), rng)
+    return out.reduce_subtree
+
+
+BENCHMARKS = {
+    "Algorithms.distance_probs": bench_distance_probs,
+    "Algorithms.bootstrap_probs": bench_bootstrap_probs,
+    "Algorithms.get_genus": bench_get_genus,
+    "Algorithms.learn_curve": bench_learn_curve,
+    "Algorithms.score": bench_score,
+    "CladeIndex.build": bench_CladeIndex_build,
+    "CladeIndex.query": bench_CladeIndex_query,
+    "place_supports": bench_place_supports,
+    "parse_fasta": bench_parse_fasta,
+    "DBDir._parse_fasta": bench_DBDir_parse_fasta,
+    "DBDir.clean_alignment": bench_clean_alignment,
+    "DBDir.verify_alignment": bench_verify_alignment,
+    "OutputDir.reduce_subtree": bench_reduce_subtree,
+}
+
+
+def time_it(f, repeat: int) -> dict:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - start)
+    return {
+        "median_s": statistics.median(times),
+        "min_s": min(times),
+        "max_s": max(times),
+        "repeat": repeat,
+    }
+
+
+def run(
+    sizes: list = None, repeat: int = 5, names: list = None, seed: int = 42
+) -> dict:
+    results = {}
+    for name in names if names else BENCHMARKS:
+        for n in sizes if sizes else DEFAULT_SIZES:
+            d = Path(tempfile.mkdtemp())
+            try:
+                f = BENCHMARKS[name](d, n, random.Random(seed))
+                results[f"{name}[n={n}]"] = time_it(f, repeat)
+            finally:
+                shutil.rmtree(d)
+            print(
+                f"{name}[n={n}]: {results[f'{name}[n={n}]']['median_s']:.6f}s",
+                file=sys.stderr,
+            )
+
+    return {
+        "meta": {
+            "date": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": seed,
+        },
+        "results": results,
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float = 0.2) -> list:
+    """
+    Benchmarks whose median got slower than baseline by more than threshold (a fraction)
+    """
+    regressions = []
+    for name, cur in current["results"].items():
+        base = baseline["results"].get(name)
+        if not base:
+            continue
+        ratio = cur["median_s"] / base["median_s"] if base["median_s"] else 1.0
+        if ratio > 1 + threshold:
+            regressions.append(
+                {
+                    "benchmark": name,
+                    "baseline_s": base["median_s"],
+                    "current_s": cur["median_s"],
+                    "ratio": ratio,
+                }
+            )
+    return regressions
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="GenusFinder microbenchmarks")
+    sub = p.add_subparsers(dest="command", required=True)
+
+    p_run = sub.add_parser("run", help="run the benchmarks and store the results")
+    p_run.add_argument("--output", help="JSON file to write (Default: stdout)")
+    p_run.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    p_run.add_argument("--repeat", type=int, default=5)
+    p_run.add_argument("--bench", nargs="+", choices=list(BENCHMARKS))
+
+    p_compare = sub.add_parser("compare", help="flag regressions against a baseline")
+    p_compare.add_argument("baseline")
+    p_compare.add_argument("current")
+    p_compare.add_argument(
+        "--threshold",
+        type=float,
+        help="the allowed slowdown as a fraction of the baseline (Default: 0.2)",
+        default=0.2,
+    )
+
+    args = p.parse_args(argv)
+    # The code under test logs at info level inside its loops
+    logging.basicConfig()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    if args.command == "run":
+        results = run(args.sizes, args.repeat, args.bench)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=1)
+        else:
+            json.dump(results, sys.stdout, indent=1)
+    else:
+        with open(args.baseline) as f_base, open(args.current) as f_cur:
+            regressions = compare(json.load(f_base), json.load(f_cur), args.threshold)
+        for r in regressions:
+            print(
+                f"REGRESSION {r['benchmark']}: {r['baseline_s']:.6f}s -> "
+                f"{r['current_s']:.6f}s ({r['ratio']:.2f}x)"
+            )
+        if regressions:
+            sys.exit(1)
+        print("No regressions")
+
+
+if __name__ == "__main__":
+    main()
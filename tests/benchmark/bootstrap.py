@@ -0,0 +1,144 @@
+"""
+Replicates, wall time and agreement of adaptive bootstrapping against the fixed 100
+replicates on generated neighbourhoods. Uses the fake tools unless --real is given and
+raxmlHPC is on the PATH
+
+    python -m tests.benchmark.bootstrap --sizes 20 50 --queries 5 --output bootstrap.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from .. import INC
+from src.GenusFinder.Algorithms import Algorithms
+from src.GenusFinder.Bipartitions import place_supports
+from src.GenusFinder.Bootstrap import AdaptiveBootstrap, max_change
+from src.GenusFinder.CLI import FAKE_TOOLS_ENV, RAxMLTreeBuilder
+from .generate import clustered_seqs, genus_of, leaf_names, mutate
+
+N_GENERA = 4
+
+
+def write_neighbourhood(d: Path, n: int, rng: random.Random, length: int) -> dict:
+    names = leaf_names(n, N_GENERA)
+    seqs = clustered_seqs(names, rng, length)
+    query = mutate(rng, seqs[rng.choice(names)], 0.03)
+    with open(d / "aligned.fasta", "w") as f:
+        for name, seq in seqs.items():
+            f.write(f">{name}\n{seq}\n")
+        f.write(f">UNKNOWN\n{query}\n")
+    with open(d / "type_species.fasta", "w") as f:
+        for name, seq in seqs.items():
+            f.write(f">{name}\t{genus_of(name)} species\n{seq}\n")
+    with open(d / "query.fasta", "w") as f:
+        f.write(f">UNKNOWN\n{query}\n")
+    return {name: genus_of(name) for name in names}
+
+
+def bootstrap_probs(d: Path, lookup: dict, tree=None) -> dict:
+    return Algorithms(
+        tree if tree else d / "RAxML_bipartitions.final",
+        d / "type_species.fasta",
+        d / "query.fasta",
+        lookup,
+    ).bootstrap_probs()
+
+
+def fixed(d: Path, lookup: dict, reps: int = 100) -> dict:
+    RAxMLTreeBuilder().call(
+        b=392781, N=reps, m="GTRCAT", n="subtree1", p=10000, s=d / "aligned.fasta", w=d
+    )
+    tree = place_supports(
+        d / "RAxML_bestTree.subtree2",
+        d / "RAxML_bootstrap.subtree1",
+        d / "RAxML_bipartitions.final",
+    )
+    return bootstrap_probs(d, lookup, tree)
+
+
+def run(
+    sizes: list = None,
+    n_queries: int = 5,
+    length: int = 300,
+    adaptive: AdaptiveBootstrap = None,
+    seed: int = 42,
+) -> dict:
+    adaptive = adaptive if adaptive else AdaptiveBootstrap()
+    results = {}
+    for n in sizes if sizes else [20, 50]:
+        rng = random.Random(seed)
+        stats = {"fixed_s": [], "adaptive_s": [], "replicates": [], "max_diff": []}
+        for _ in range(n_queries):
+            d = Path(tempfile.mkdtemp())
+            try:
+                lookup = write_neighbourhood(d, n, rng, length)
+                RAxMLTreeBuilder().call(
+                    m="GTRCAT", n="subtree2", p=10000, s=d / "aligned.fasta", w=d
+                )
+
+                start = time.perf_counter()
+                fixed_probs = fixed(d, lookup, adaptive.max_reps)
+                stats["fixed_s"].append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                info = adaptive.run(
+                    d / "aligned.fasta",
+                    d / "RAxML_bestTree.subtree2",
+                    d,
+                    d / "RAxML_bootstrap.adaptive",
+                    lambda t: bootstrap_probs(d, lookup, t),
+                )
+                stats["adaptive_s"].append(time.perf_counter() - start)
+                stats["replicates"].append(info["replicates"])
+                stats["max_diff"].append(
+                    max_change(fixed_probs, bootstrap_probs(d, lookup))
+                )
+            finally:
+                shutil.rmtree(d)
+
+        results[f"n={n}"] = {
+            "mean_replicates": statistics.mean(stats["replicates"]),
+            "fixed_s": statistics.mean(stats["fixed_s"]),
+            "adaptive_s": statistics.mean(stats["adaptive_s"]),
+            "speedup": sum(stats["fixed_s"]) / sum(stats["adaptive_s"]),
+            "max_prob_diff": max(stats["max_diff"]),
+        }
+        print(f"n={n}: {json.dumps(results[f'n={n}'])}", file=sys.stderr)
+
+    return {"params": adaptive.params(), "seed": seed, "results": results}
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Adaptive bootstrap benchmark")
+    p.add_argument("--output", help="JSON file to write (Default: stdout)")
+    p.add_argument("--sizes", type=int, nargs="+", default=[20, 50])
+    p.add_argument("--queries", type=int, default=5)
+    p.add_argument("--length", type=int, default=300)
+    p.add_argument(
+        "--real", help="use raxmlHPC rather than the fake tools", action="store_true"
+    )
+
+    args = p.parse_args(argv)
+    logging.basicConfig()
+    logging.getLogger().setLevel(logging.WARNING)
+    if not args.real:
+        os.environ[FAKE_TOOLS_ENV] = "1"
+
+    results = run(args.sizes, args.queries, args.length)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+    else:
+        json.dump(results, sys.stdout, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import random
+from ete3 import Tree
+from pathlib import Path
+
+BASES = "ACGT"
+# Characters found in raw LTP alignments, weighted towards gaps like the real thing
+LTP_CHARS = "." * 12 + "-" * 6 + "ACGU" * 3 + "RYN"
+
+
+def leaf_names(n: int, n_genera: int) -> list:
+    """
+    Fixed-width ids so get_genus's substring matching can't hit the wrong record,
+    the first letter is the genus as learn_curve expects
+    """
+    return [f"{chr(65 + i % n_genera)}{i:06d}" for i in range(n)]
+
+
+def genus_of(name: str) -> str:
+    return f"Genus{name[0]}"
+
+
+def random_seq(rng: random.Random, length: int) -> str:
+    return "".join(rng.choice(BASES) for _ in range(length))
+
+
+def mutate(rng: random.Random, seq: str, rate: float) -> str:
+    return "".join(rng.choice(BASES) if rng.random() < rate else c for c in seq)
+
+
+def clustered_seqs(
+    names: list, rng: random.Random, length: int = 1400, divergence: float = 0.08
+) -> dict:
+    """
+    Name -> sequence, with each genus's species mutated from a shared ancestor so that
+    nearest neighbours mean something
+    """
+    ancestors = {}
+    seqs = {}
+    for name in names:
+        genus = genus_of(name)
+        if genus not in ancestors:
+            ancestors[genus] = random_seq(rng, length)
+        seqs[name] = mutate(rng, ancestors[genus], divergence)
+    return seqs
+
+
+def write_query(fp: Path, rng: random.Random, length: int = 1400) -> Path:
+    with open(fp, "w") as f:
+        f.write(f">UNKNOWN\n{random_seq(rng, length)}\n")
+    return fp
+
+
+def write_type_species(
+    fp: Path, names: list, rng: random.Random, length: int = 1400
+) -> Path:
+    with open(fp, "w") as f:
+        for name in names:
+            f.write(f">{name}\t{genus_of(name)} species\n{random_seq(rng, length)}\n")
+    return fp
+
+
+def write_tree(fp: Path, names: list, rng: random.Random) -> Path:
+    """
+    Random topology over names plus UNKNOWN, with branch lengths and bootstrap supports
+    """
+    nodes = [Tree(name=name) for name in names + ["UNKNOWN"]]
+    while len(nodes) > 1:
+        parent = Tree()
+        for _ in range(2):
+            child = nodes.pop(rng.randrange(len(nodes)))
+            parent.add_child(child, dist=rng.uniform(0.001, 0.2))
+        parent.support = rng.randint(0, 100)
+        nodes.append(parent)
+    t = nodes[0]
+    t.write(outfile=str(fp))
+    return fp
+
+
+def write_fastapairs(
+    fp: Path, names: list, rng: random.Random, length: int = 1400
+) -> Path:
+    """
+    vsearch --fastapairs style output as OutputDir.reduce_subtree reads it
+    """
+    query = random_seq(rng, length)
+    with open(fp, "w") as f:
+        for name in names:
+            f.write(f">{name}\t{genus_of(name)} species\n{random_seq(rng, length)}\n")
+            f.write(f">UNKNOWN\n{query}\n\n")
+    return fp
+
+
+def write_ltp_alignment(
+    fp: Path, names: list, rng: random.Random, length: int = 5000
+) -> Path:
+    """
+    Raw LTP style alignment (dots, Us, ambiguity codes) for DBDir.clean_alignment
+    """
+    with open(fp, "w") as f:
+        for name in names:
+            f.write(
+                f">{name}\n{''.join(rng.choice(LTP_CHARS) for _ in range(length))}\n"
+            )
+    return fp
@@ -0,0 +1,126 @@
+"""
+Placement wall time against the whole reference and against the clade
+ReferencePruner cuts out around the query's hits, on generated references. Uses the fake
+tools unless --real is given and raxmlHPC is on the PATH
+
+    python -m tests.benchmark.prune --sizes 200 1000 --output prune.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from ete3 import Tree
+from pathlib import Path
+from .. import INC
+from src.GenusFinder.CLI import FAKE_TOOLS_ENV, RAxMLTreeBuilder
+from src.GenusFinder.CladeIndex import CladeIndex
+from src.GenusFinder.Prune import ReferencePruner
+from .generate import clustered_seqs, leaf_names, mutate
+
+N_GENERA = 10
+
+
+def reference_tree(seqs: dict) -> Tree:
+    """
+    Genera as clades, so the pruned neighbourhood means something
+    """
+    t = Tree()
+    genera = {}
+    for name in seqs:
+        if name[0] not in genera:
+            genera[name[0]] = t.add_child(dist=0.1)
+        genera[name[0]].add_child(name=name, dist=0.02)
+    return t
+
+
+def place(d: Path, aligned_fp: Path, tree_fp: Path, query: str) -> float:
+    combined_fp = d / "combined.fasta"
+    shutil.copy(aligned_fp, combined_fp)
+    with open(combined_fp, "a") as f:
+        f.write(f">UNKNOWN\n{query}\n")
+    start = time.perf_counter()
+    RAxMLTreeBuilder().call(
+        f="y", m="GTRCAT", n="combined", p=10000, s=combined_fp, t=tree_fp, w=d
+    )
+    return time.perf_counter() - start
+
+
+def run(sizes: list = None, length: int = 300, seed: int = 42) -> dict:
+    results = {}
+    for n in sizes if sizes else [200, 1000]:
+        rng = random.Random(seed)
+        names = leaf_names(n, N_GENERA)
+        seqs = clustered_seqs(names, rng, length)
+        t = reference_tree(seqs)
+        target = rng.choice(names)
+        query = mutate(rng, seqs[target], 0.02)
+        hits = [(target, 98.0)] + [(m, 90.0) for m in names if m[0] == target[0]]
+
+        d = Path(tempfile.mkdtemp())
+        try:
+            aligned_fp, tree_fp = d / "reference.fasta", d / "reference.newick"
+            with open(aligned_fp, "w") as f:
+                for name, seq in seqs.items():
+                    f.write(f">{name}\n{seq}\n")
+            t.write(outfile=str(tree_fp))
+            full = place(d, aligned_fp, tree_fp, query)
+
+            start = time.perf_counter()
+            info = ReferencePruner().call(
+                CladeIndex(t, lambda name: name[0]),
+                lambda ns: {m: seqs[m] for m in ns},
+                hits,
+                d / "pruned.newick",
+                d / "pruned.fasta",
+            )
+            prune_s = time.perf_counter() - start
+            pruned = place(d, d / "pruned.fasta", d / "pruned.newick", query)
+        finally:
+            shutil.rmtree(d)
+
+        results[f"n={n}"] = {
+            "full_place_s": full,
+            "prune_s": prune_s,
+            "pruned_place_s": pruned,
+            "full_leaves": n,
+            "pruned_leaves": info["leaves"],
+            "full_columns": length,
+            "pruned_columns": info["columns"],
+            "speedup": full / (pruned + prune_s),
+        }
+        print(f"n={n}: {json.dumps(results[f'n={n}'])}", file=sys.stderr)
+
+    return {"seed": seed, "results": results}
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Pruned reference placement benchmark")
+    p.add_argument("--output", help="JSON file to write (Default: stdout)")
+    p.add_argument("--sizes", type=int, nargs="+", default=[200, 1000])
+    p.add_argument("--length", type=int, default=300)
+    p.add_argument(
+        "--real", help="use raxmlHPC rather than the fake tools", action="store_true"
+    )
+
+    args = p.parse_args(argv)
+    logging.basicConfig()
+    logging.getLogger().setLevel(logging.WARNING)
+    if not args.real:
+        os.environ[FAKE_TOOLS_ENV] = "1"
+
+    results = run(args.sizes, args.length)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+    else:
+        json.dump(results, sys.stdout, indent=1)
+
+
+if __name__ == "__main__":
+    main()
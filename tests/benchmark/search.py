@@ -0,0 +1,177 @@
+"""
+Recall and latency of the k-mer index against exhaustive search (and vsearch, if it's on
+the PATH, against both the FASTA and a prebuilt UDB) for nearest type species lookups on
+generated data
+
+    python -m tests.benchmark.search --sizes 200 1000 --queries 20 --output search.json
+"""
+
+import argparse
+import json
+import logging
+import random
+import shutil
+import statistics
+import subprocess as sp
+import sys
+import tempfile
+import time
+from pathlib import Path
+from .. import INC
+from src.GenusFinder.KmerIndex import KmerIndex, identity
+from .generate import clustered_seqs, genus_of, leaf_names, mutate
+
+N_GENERA = 10
+
+
+def brute_force(seqs: dict, query: str, top_n: int, min_id: float) -> list:
+    hits = [(identity(query, s), name) for name, s in seqs.items()]
+    hits = sorted((h for h in hits if h[0] >= min_id), key=lambda h: -h[0])
+    return [name for _, name in hits[:top_n]]
+
+
+def vsearch(
+    d: Path, db_fp: Path, query: str, top_n: int, min_id: float, threads: int = 1
+) -> list:
+    query_fp, userout_fp = d / "query.fasta", d / "userout.tsv"
+    with open(query_fp, "w") as f:
+        f.write(f">UNKNOWN\n{query}\n")
+    sp.run(
+        [
+            "vsearch",
+            "--usearch_global",
+            str(query_fp),
+            "--db",
+            str(db_fp),
+            "--id",
+            str(min_id),
+            "--maxaccepts",
+            str(top_n),
+            "--maxrejects",
+            "0",
+            "--threads",
+            str(threads),
+            "--userout",
+            str(userout_fp),
+            "--userfields",
+            "target",
+            "--quiet",
+        ],
+        check=True,
+    )
+    with open(userout_fp) as f:
+        return [l.strip() for l in f]
+
+
+def timed_call(f):
+    start = time.perf_counter()
+    ret = f()
+    return ret, time.perf_counter() - start
+
+
+def recall(found: list, expected: list) -> float:
+    return len(set(found) & set(expected)) / len(expected) if expected else 1.0
+
+
+def run(
+    sizes: list = None,
+    n_queries: int = 10,
+    top_n: int = 50,
+    min_id: float = 0.8,
+    seed: int = 42,
+) -> dict:
+    results = {}
+    for n in sizes if sizes else [200, 1000]:
+        rng = random.Random(seed)
+        names = leaf_names(n, N_GENERA)
+        seqs = clustered_seqs(names, rng)
+        d = Path(tempfile.mkdtemp())
+        try:
+            db_fp = d / "type_species.fasta"
+            with open(db_fp, "w") as f:
+                for name, seq in seqs.items():
+                    f.write(f">{name}\t{genus_of(name)} species\n{seq}\n")
+            _, build_s = timed_call(lambda: KmerIndex.build(db_fp, d / "kmers"))
+            index, load_s = timed_call(lambda: KmerIndex(d / "kmers"))
+
+            methods = {
+                "kmer": lambda q: index.search(q, top_n, min_id),
+                "kmer_unrefined": lambda q: index.search(q, top_n, min_id, False),
+            }
+            references = {"brute_force": lambda q: brute_force(seqs, q, top_n, min_id)}
+            udb_build_s = None
+            if shutil.which("vsearch"):
+                references["vsearch"] = lambda q: vsearch(d, db_fp, q, top_n, min_id)
+                udb_fp = d / "type_species.udb"
+                _, udb_build_s = timed_call(
+                    lambda: sp.run(
+                        [
+                            "vsearch",
+                            "--makeudb_usearch",
+                            str(db_fp),
+                            "--output",
+                            str(udb_fp),
+                            "--quiet",
+                        ],
+                        check=True,
+                    )
+                )
+                references["vsearch_udb"] = lambda q: vsearch(
+                    d, udb_fp, q, top_n, min_id
+                )
+
+            stats = {m: {"latency_s": []} for m in list(methods) + list(references)}
+            for m in methods:
+                for r in references:
+                    stats[m][f"recall_vs_{r}"] = []
+            for _ in range(n_queries):
+                query = mutate(rng, seqs[rng.choice(names)], 0.02)
+                expected = {}
+                for r, f in references.items():
+                    expected[r], t = timed_call(lambda: f(query))
+                    stats[r]["latency_s"].append(t)
+                for m, f in methods.items():
+                    hits, t = timed_call(lambda: f(query))
+                    stats[m]["latency_s"].append(t)
+                    found = [label.split("\t")[0] for label, _ in hits]
+                    for r in references:
+                        stats[m][f"recall_vs_{r}"].append(recall(found, expected[r]))
+
+            results[f"n={n}"] = {
+                "build_s": build_s,
+                "load_s": load_s,
+                "udb_build_s": udb_build_s,
+                **{
+                    m: {k: statistics.mean(v) for k, v in s.items()}
+                    for m, s in stats.items()
+                },
+            }
+        finally:
+            shutil.rmtree(d)
+        print(f"n={n}: {json.dumps(results[f'n={n}'])}", file=sys.stderr)
+
+    return {"top_n": top_n, "min_id": min_id, "seed": seed, "results": results}
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="k-mer index search benchmark")
+    p.add_argument("--output", help="JSON file to write (Default: stdout)")
+    p.add_argument("--sizes", type=int, nargs="+", default=[200, 1000])
+    p.add_argument("--queries", type=int, default=10)
+    p.add_argument("--top_n", type=int, default=50)
+    p.add_argument("--id", type=float, default=0.8)
+
+    args = p.parse_args(argv)
+    logging.basicConfig()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    results = run(args.sizes, args.queries, args.top_n, args.id)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+    else:
+        json.dump(results, sys.stdout, indent=1)
+
+
+if __name__ == "__main__":
+    main()
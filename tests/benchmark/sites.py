@@ -0,0 +1,136 @@
+"""
+Subtree wall time and probabilities from the aligned neighbourhood as it is against its
+site patterns (compress_sites), on generated neighbourhoods padded the way
+DBDir.clean_alignment pads LTP, with three gap columns after every base. Uses the fake
+tools unless --real is given and raxmlHPC is on the PATH
+
+    python -m tests.benchmark.sites --sizes 20 50 --queries 3 --output sites.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from .. import INC
+from src.GenusFinder.Algorithms import Algorithms
+from src.GenusFinder.Bipartitions import place_supports
+from src.GenusFinder.Bootstrap import max_change
+from src.GenusFinder.CLI import FAKE_TOOLS_ENV, RAxMLTreeBuilder
+from src.GenusFinder.SitePatterns import compress_sites
+from .generate import clustered_seqs, genus_of, leaf_names, mutate
+
+N_GENERA = 4
+
+
+def write_neighbourhood(d: Path, n: int, rng: random.Random, length: int) -> dict:
+    names = leaf_names(n, N_GENERA)
+    seqs = clustered_seqs(names, rng, length)
+    query = mutate(rng, seqs[rng.choice(names)], 0.03)
+    with open(d / "aligned.fasta", "w") as f:
+        for name, seq in list(seqs.items()) + [("UNKNOWN", query)]:
+            f.write(f">{name}\n{''.join(c + '---' for c in seq)}\n")
+    with open(d / "type_species.fasta", "w") as f:
+        for name, seq in seqs.items():
+            f.write(f">{name}\t{genus_of(name)} species\n{seq}\n")
+    with open(d / "query.fasta", "w") as f:
+        f.write(f">UNKNOWN\n{query}\n")
+    return {name: genus_of(name) for name in names}
+
+
+def subtree(d: Path, lookup: dict, aligned_fp: Path, weights_fp: Path = None) -> dict:
+    RAxMLTreeBuilder().call(
+        a=weights_fp, m="GTRCAT", n="subtree2", p=10000, s=aligned_fp, w=d
+    )
+    RAxMLTreeBuilder().call(
+        a=weights_fp,
+        b=392781,
+        N=100,
+        m="GTRCAT",
+        n="subtree1",
+        p=10000,
+        s=aligned_fp,
+        w=d,
+    )
+    a = Algorithms(
+        place_supports(d / "RAxML_bestTree.subtree2", d / "RAxML_bootstrap.subtree1"),
+        d / "type_species.fasta",
+        d / "query.fasta",
+        lookup,
+    )
+    return {"distance": a.distance_probs(), "bootstrap": a.bootstrap_probs()}
+
+
+def run(sizes: list = None, n_queries: int = 3, length: int = 300, seed: int = 42):
+    results = {}
+    for n in sizes if sizes else [20, 50]:
+        rng = random.Random(seed)
+        stats = {"plain_s": [], "compressed_s": [], "patterns": [], "max_diff": []}
+        for _ in range(n_queries):
+            d = Path(tempfile.mkdtemp())
+            try:
+                lookup = write_neighbourhood(d, n, rng, length)
+
+                start = time.perf_counter()
+                plain = subtree(d, lookup, d / "aligned.fasta")
+                stats["plain_s"].append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                info = compress_sites(
+                    d / "aligned.fasta", d / "patterns.fasta", d / "weights.txt"
+                )
+                compressed = subtree(d, lookup, d / "patterns.fasta", d / "weights.txt")
+                stats["compressed_s"].append(time.perf_counter() - start)
+
+                stats["patterns"].append(info["patterns"] / info["columns"])
+                stats["max_diff"].append(
+                    max(max_change(plain[k], compressed[k]) for k in plain)
+                )
+            finally:
+                shutil.rmtree(d)
+
+        results[f"n={n}"] = {
+            "columns": 4 * length,
+            "pattern_fraction": statistics.mean(stats["patterns"]),
+            "plain_s": statistics.mean(stats["plain_s"]),
+            "compressed_s": statistics.mean(stats["compressed_s"]),
+            "speedup": sum(stats["plain_s"]) / sum(stats["compressed_s"]),
+            "max_prob_diff": max(stats["max_diff"]),
+        }
+        print(f"n={n}: {json.dumps(results[f'n={n}'])}", file=sys.stderr)
+
+    return {"seed": seed, "results": results}
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Site pattern compression benchmark")
+    p.add_argument("--output", help="JSON file to write (Default: stdout)")
+    p.add_argument("--sizes", type=int, nargs="+", default=[20, 50])
+    p.add_argument("--queries", type=int, default=3)
+    p.add_argument("--length", type=int, default=300)
+    p.add_argument(
+        "--real", help="use raxmlHPC rather than the fake tools", action="store_true"
+    )
+
+    args = p.parse_args(argv)
+    logging.basicConfig()
+    logging.getLogger().setLevel(logging.WARNING)
+    if not args.real:
+        os.environ[FAKE_TOOLS_ENV] = "1"
+
+    results = run(args.sizes, args.queries, args.length)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+    else:
+        json.dump(results, sys.stdout, indent=1)
+
+
+if __name__ == "__main__":
+    main()
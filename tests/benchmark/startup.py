@@ -0,0 +1,147 @@
+"""
+Start-up cost of the entry points: each one's cumulative import time (python -X importtime)
+and, for idgenus with the fake tools, the time from process start to the first tool
+launching. Flags anything over its budget rather than failing, timings being noisy
+
+    python -m tests.benchmark.startup --repeats 5 --output startup.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import statistics
+import subprocess as sp
+import sys
+import tempfile
+import time
+from pathlib import Path
+from .. import INC
+from src.GenusFinder.CLI import FAKE_TOOLS_ENV
+from src.GenusFinder.fake_tools import LOG_ENV
+from ..e2e.test_fake_tools import write_db
+
+REPO_FP = Path(__file__).parents[2]
+
+# Short runs over many small jobs are dominated by start-up, keep it well under these
+IMPORT_BUDGET_S = 0.25  # Cumulative import time of an entry point module
+FIRST_TOOL_BUDGET_S = 1.5  # Process start to the first external tool launching
+ENTRY_POINTS = [
+    "src.GenusFinder.command",
+    "src.GenusFinder.prepare_strain_data",
+    "src.GenusFinder.train_command",
+]
+
+
+def import_profile(module: str) -> list:
+    """
+    (self_s, cumulative_s, name) for each import, from python -X importtime
+    """
+    res = sp.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_FP,
+        # The console scripts import GenusFinder as installed
+        env=dict(os.environ, PYTHONPATH=str(REPO_FP / "src")),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    profile = []
+    for line in res.stderr.splitlines():
+        m = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|\s*(\S+)", line)
+        if m:
+            profile.append((int(m[1]) / 1e6, int(m[2]) / 1e6, m[3]))
+    return profile
+
+
+def first_tool(temp_dir: Path, seq: str) -> tuple:
+    """
+    (name, seconds from process start) of the first tool an idgenus run launches
+    """
+    log_fp = temp_dir / "launches.tsv"
+    output_fp = temp_dir / "output"
+    shutil.rmtree(output_fp, ignore_errors=True)
+    if log_fp.exists():
+        os.remove(log_fp)
+    env = dict(os.environ, **{FAKE_TOOLS_ENV: "1", LOG_ENV: str(log_fp)})
+    start = time.time()
+    sp.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys; from src.GenusFinder.command import main; main(sys.argv[1:])",
+            "--seq",
+            seq,
+            "--output",
+            str(output_fp),
+            "--db",
+            str(temp_dir / "db"),
+            "--subtree_only",
+        ],
+        cwd=REPO_FP,
+        env=env,
+        check=True,
+        capture_output=True,
+    )
+    with open(log_fp) as f:
+        name, launched = f.readline().strip().split("\t")
+    return name, float(launched) - start
+
+
+def run(repeats: int = 3) -> dict:
+    results = {}
+    for module in ENTRY_POINTS:
+        times = []
+        for _ in range(repeats):
+            profile = import_profile(module)
+            times.append(next(c for _, c, name in profile if name == module))
+        median = statistics.median(times)
+        results[module] = {
+            "import_s": median,
+            "over_budget": median > IMPORT_BUDGET_S,
+            "slowest": [name for _, _, name in sorted(profile, reverse=True)[:10]],
+        }
+
+    temp_dir = Path(tempfile.mkdtemp())
+    try:
+        seq = write_db(temp_dir / "db", random.Random(42))
+        launches = [first_tool(temp_dir, seq) for _ in range(repeats)]
+    finally:
+        shutil.rmtree(temp_dir)
+    median = statistics.median(s for _, s in launches)
+    results["first_tool"] = {
+        "tool": launches[0][0],
+        "launch_s": median,
+        "over_budget": median > FIRST_TOOL_BUDGET_S,
+    }
+    for name, r in results.items():
+        if r["over_budget"]:
+            logging.warning(f"{name} is over its start-up budget: {r}")
+    return {
+        "budgets": {"import_s": IMPORT_BUDGET_S, "first_tool_s": FIRST_TOOL_BUDGET_S},
+        "results": results,
+    }
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Entry point start-up benchmark")
+    p.add_argument("--output", help="JSON file to write (Default: stdout)")
+    p.add_argument("--repeats", type=int, default=3)
+
+    args = p.parse_args(argv)
+    logging.basicConfig()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    results = run(args.repeats)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+    else:
+        json.dump(results, sys.stdout, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Disk footprint, streaming read throughput and random record reads of compressed DB
+files against plain text, on a generated LTP-style alignment and type species FASTA
+
+    python -m tests.benchmark.storage --sizes 200 1000 --output storage.json
+"""
+
+import argparse
+import json
+import logging
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from .. import INC
+from src.GenusFinder.DBDir import DBDir
+from src.GenusFinder.Storage import BlockReader, compress, compressed_fp, open_text
+from .generate import leaf_names, write_ltp_alignment, write_type_species
+
+N_GENERA = 10
+
+
+def codecs() -> list:
+    try:
+        import zstandard
+    except ImportError:
+        return ["gzip"]
+    return ["gzip", "zstd"]
+
+
+def stream(fp: Path) -> int:
+    n = 0
+    with open_text(fp) as f:
+        for line in f:
+            n += len(line)
+    return n
+
+
+def bench_file(fp: Path, rng: random.Random, n_random: int = 100) -> dict:
+    plain_size = fp.stat().st_size
+    start = time.perf_counter()
+    stream(fp)
+    results = {
+        "plain": {
+            "bytes": plain_size,
+            "stream_mb_s": plain_size / 1e6 / (time.perf_counter() - start),
+        }
+    }
+
+    for codec in codecs():
+        start = time.perf_counter()
+        packed = compress(fp, compressed_fp(fp, codec), codec)
+        compress_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        stream(packed)
+        stream_s = time.perf_counter() - start
+
+        with BlockReader(packed) as reader:
+            names = rng.sample(reader.names(), min(n_random, len(reader)))
+            times = []
+            for name in names:
+                start = time.perf_counter()
+                reader.get(name)
+                times.append(time.perf_counter() - start)
+
+        results[codec] = {
+            "bytes": packed.stat().st_size,
+            "ratio": plain_size / packed.stat().st_size,
+            "compress_s": compress_s,
+            "stream_mb_s": plain_size / 1e6 / stream_s,
+            "random_read_s": statistics.median(times),
+        }
+    return results
+
+
+def run(sizes: list = None, seed: int = 42) -> dict:
+    results = {}
+    for n in sizes if sizes else [200, 1000]:
+        rng = random.Random(seed)
+        names = leaf_names(n, N_GENERA)
+        d = Path(tempfile.mkdtemp())
+        try:
+            db = DBDir(d / "db", "")
+            write_ltp_alignment(db.LTP_aligned_fp, names, rng)
+            db.clean_alignment()
+            results[f"aligned[n={n}]"] = bench_file(db.LTP_aligned_fp, rng)
+            write_type_species(db.type_species_fp, names, rng)
+            results[f"type_species[n={n}]"] = bench_file(db.type_species_fp, rng)
+        finally:
+            shutil.rmtree(d)
+        for name in (f"aligned[n={n}]", f"type_species[n={n}]"):
+            print(f"{name}: {json.dumps(results[name])}", file=sys.stderr)
+
+    return {"seed": seed, "results": results}
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Compressed DB storage benchmark")
+    p.add_argument("--output", help="JSON file to write (Default: stdout)")
+    p.add_argument("--sizes", type=int, nargs="+", default=[200, 1000])
+
+    args = p.parse_args(argv)
+    logging.basicConfig()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    results = run(args.sizes)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+    else:
+        json.dump(results, sys.stdout, indent=1)
+
+
+if __name__ == "__main__":
+    main()
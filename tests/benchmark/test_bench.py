@@ -0,0 +1,53 @@
+from . import bootstrap, prune, search, sites, startup, storage
+from src.GenusFinder.CLI import FAKE_TOOLS_ENV
+from .bench import BENCHMARKS, compare, run
+
+
+def test_run_all():
+    results = run([50], 1)
+    assert len(results["results"]) == len(BENCHMARKS)
+
+
+def test_compare():
+    baseline = {"results": {"a[n=50]": {"median_s": 1.0}, "b[n=50]": {"median_s": 1.0}}}
+    current = {"results": {"a[n=50]": {"median_s": 1.1}, "b[n=50]": {"median_s": 1.5}}}
+    regressions = compare(baseline, current, 0.2)
+    assert [r["benchmark"] for r in regressions] == ["b[n=50]"]
+
+
+def test_search_recall():
+    results = search.run([60], 2, top_n=5)["results"]["n=60"]
+    assert results["kmer"]["recall_vs_brute_force"] == 1.0
+
+
+def test_storage():
+    results = storage.run([50])["results"]["type_species[n=50]"]
+    assert results["gzip"]["bytes"] < results["plain"]["bytes"]
+
+
+def test_adaptive_bootstrap(monkeypatch):
+    monkeypatch.setenv(FAKE_TOOLS_ENV, "1")
+    results = bootstrap.run([12], 1)["results"]["n=12"]
+    assert results["mean_replicates"] < 100
+    assert results["max_prob_diff"] < 0.05
+
+
+def test_prune(monkeypatch):
+    monkeypatch.setenv(FAKE_TOOLS_ENV, "1")
+    results = prune.run([600], length=60)["results"]["n=600"]
+    # What placement has to work through, rather than how long it took
+    assert results["pruned_leaves"] < results["full_leaves"] / 2
+    assert results["pruned_columns"] <= results["full_columns"]
+
+
+def test_sites(monkeypatch):
+    monkeypatch.setenv(FAKE_TOOLS_ENV, "1")
+    results = sites.run([12], 1, length=60)["results"]["n=12"]
+    assert results["pattern_fraction"] <= 0.25
+    assert results["max_prob_diff"] == 0
+
+
+def test_startup():
+    results = startup.run(1)["results"]
+    assert results["first_tool"]["tool"] == "vsearch"
+    assert set(results) == set(startup.ENTRY_POINTS) | {"first_tool"}
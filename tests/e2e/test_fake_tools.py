@@ -0,0 +1,488 @@
+import json
+import os
+import pytest
+import random
+import tempfile
+from pathlib import Path
+from .. import INC
+from src.GenusFinder.CLI import FAKE_TOOLS_ENV
+from src.GenusFinder.DBDir import LTP_VERSION, release_dir
+from src.GenusFinder.command import main
+
+
+def mutate(seq: str, rate: float, rng: random.Random) -> str:
+    return "".join(rng.choice("ACGT") if rng.random() < rate else c for c in seq)
+
+
+def write_db(db_fp: Path, rng: random.Random) -> str:
+    base = "".join(rng.choice("ACGT") for _ in range(300))
+    os.makedirs(release_dir(db_fp, LTP_VERSION))
+    with open(release_dir(db_fp, LTP_VERSION) / "type_species.fasta", "w") as f:
+        for i in range(20):
+            genus = ["Alpha", "Beta", "Gamma"][i % 3]
+            seq = mutate(base, 0.02 * (i % 3 + 1), rng)
+            f.write(f">{genus[0]}{i:06d}\t{genus} species{i}\n{seq}\n")
+    return mutate(base, 0.01, rng)
+
+
+def test_subtree_method_fake_tools():
+    temp_dir = Path(tempfile.mkdtemp())
+    output_fp = temp_dir / "output"
+    db_fp = temp_dir / "db"
+    seq = write_db(db_fp, random.Random(42))
+    argv = [
+        "--seq",
+        seq,
+        "--output",
+        str(output_fp),
+        "--db",
+        str(db_fp),
+        "--subtree_only",
+        "--fake_tools",
+    ]
+
+    try:
+        main(argv)
+
+        with open(output_fp / "probabilities.tsv") as f:
+            content = f.read()
+        assert "Bootstrap-based subtree probabilities" in content
+        assert "Alpha" in content
+        assert (output_fp / "metrics.json").exists()
+
+        # Nothing changed, so the tools shouldn't run again
+        info_mtime = (output_fp / "RAxML_info.subtree1").stat().st_mtime_ns
+        main(argv)
+        assert (output_fp / "RAxML_info.subtree1").stat().st_mtime_ns == info_mtime
+    finally:
+        os.environ.pop(FAKE_TOOLS_ENV, None)
+
+
+def test_subtree_method_kmer_searcher():
+    temp_dir = Path(tempfile.mkdtemp())
+    output_fp = temp_dir / "output"
+    db_fp = temp_dir / "db"
+    seq = write_db(db_fp, random.Random(42))
+
+    try:
+        main(
+            [
+                "--seq",
+                seq,
+                "--output",
+                str(output_fp),
+                "--db",
+                str(db_fp),
+                "--subtree_only",
+                "--fake_tools",
+                "--searcher",
+                "kmer",
+            ]
+        )
+
+        kmers_fp = release_dir(db_fp, LTP_VERSION) / "type_species_kmers"
+        assert (kmers_fp / "postings.npy").exists()
+        with open(output_fp / "probabilities.tsv") as f:
+            assert "Bootstrap-based subtree probabilities" in f.read()
+    finally:
+        os.environ.pop(FAKE_TOOLS_ENV, None)
+
+
+def test_batch_results():
+    temp_dir = Path(tempfile.mkdtemp())
+    output_fp = temp_dir / "output"
+    db_fp = temp_dir / "db"
+    rng = random.Random(42)
+    seq = write_db(db_fp, rng)
+    batch_fp = temp_dir / "batch.fasta"
+    with open(batch_fp, "w") as f:
+        for i in range(3):
+            f.write(f">query{i} sample\n{mutate(seq, 0.01, rng)}\n")
+    # From an earlier run into the same output, not part of this one's summary
+    os.makedirs(output_fp / "old_query")
+    with open(output_fp / "old_query" / "metrics.json", "w") as f:
+        json.dump({"wall_s": 1.0, "child_maxrss_kb": 0, "records": []}, f)
+
+    try:
+        main(
+            [
+                "--seq",
+                str(batch_fp),
+                "--output",
+                str(output_fp),
+                "--db",
+                str(db_fp),
+                "--subtree_only",
+                "--fake_tools",
+                "--workers",
+                "2",
+                "--results",
+                str(temp_dir / "results.tsv"),
+            ]
+        )
+
+        with open(temp_dir / "results.tsv") as f:
+            rows = [l.rstrip("\n").split("\t") for l in f][1:]
+        assert {r[0] for r in rows} == {"query0", "query1", "query2"}
+        assert {r[1] for r in rows} == {"subtree_distance", "subtree_bootstrap"}
+        assert (output_fp / "query1" / "probabilities.tsv").exists()
+        with open(output_fp / "batch_metrics.json") as f:
+            assert json.load(f)["queries"] == 3
+    finally:
+        os.environ.pop(FAKE_TOOLS_ENV, None)
+
+
+def test_batch_dereplicate():
+    temp_dir = Path(tempfile.mkdtemp())
+    output_fp = temp_dir / "output"
+    db_fp = temp_dir / "db"
+    rng = random.Random(42)
+    seq = write_db(db_fp, rng)
+    other = mutate(seq, 0.01, rng)
+    batch_fp = temp_dir / "batch.fasta"
+    with open(batch_fp, "w") as f:
+        f.write(f">query0\n{seq}\n>query1\n{seq.lower()}\n>query2\n{other}\n")
+        f.write(f">query3\n{other[:200]}\n")
+
+    try:
+        main(
+            [
+                "--seq",
+                str(batch_fp),
+                "--output",
+                str(output_fp),
+                "--db",
+                str(db_fp),
+                "--subtree_only",
+                "--fake_tools",
+                "--dereplicate",
+                "contained",
+                "--results",
+                str(temp_dir / "results.tsv"),
+            ]
+        )
+
+        with open(temp_dir / "results.tsv") as f:
+            rows = [l.rstrip("\n").split("\t") for l in f][1:]
+        by_query = {}
+        for q, m, g, p in rows:
+            by_query.setdefault(q, set()).add((m, g, p))
+        assert set(by_query) == {"query0", "query1", "query2", "query3"}
+        assert by_query["query0"] == by_query["query1"]
+        assert by_query["query2"] == by_query["query3"]
+
+        # Only the representatives ran
+        assert not (output_fp / "query1" / "metrics.json").exists()
+        assert (output_fp / "query1" / "probabilities.tsv").exists()
+        with open(output_fp / "query3" / "dereplicated.json") as f:
+            assert json.load(f) == {
+                "representative": "query2",
+                "output": str(output_fp / "query2"),
+                "relation": "contained",
+            }
+        with open(output_fp / "batch_metrics.json") as f:
+            summary = json.load(f)
+        assert summary["queries"] == 2
+        assert summary["dereplication"]["reduction"] == 0.5
+        assert summary["dereplication"]["time_saved_s"] > 0
+    finally:
+        os.environ.pop(FAKE_TOOLS_ENV, None)
+
+
+def test_scratch_workspace():
+    temp_dir = Path(tempfile.mkdtemp())
+    output_fp = temp_dir / "output"
+    db_fp = temp_dir / "db"
+    scratch_fp = temp_dir / "scratch"
+    seq = write_db(db_fp, random.Random(42))
+
+    argv = ["--seq", seq, "--output", str(output_fp), "--db", str(db_fp)]
+    argv += ["--subtree_only", "--fake_tools", "--scratch", str(scratch_fp)]
+
+    try:
+        main(argv + ["--archive"])
+
+        assert list(scratch_fp.iterdir()) == []
+        assert sorted(p.name for p in output_fp.iterdir()) == [
+            "RAxML_bipartitions.final",
+            "artifacts.tar.gz",
+            "metrics.json",
+            "pipeline_state.json",
+            "probabilities.tsv",
+            "query.fasta",
+        ]
+        with open(output_fp / "metrics.json") as f:
+            io = json.load(f)["io"]
+        assert io["scratch"]
+        assert io["copied_bytes"] < io["intermediate_bytes"]
+        probs = (output_fp / "probabilities.tsv").read_text()
+
+        # A fresh workspace, but the previous run's results and archive are restored
+        main(argv + ["--archive"])
+        with open(output_fp / "metrics.json") as f:
+            stages = {r["stage"] for r in json.load(f)["records"]}
+        assert "stage:subtree_probs" in stages
+        assert not {"stage:search", "stage:align", "stage:bootstraps"} & stages
+        assert (output_fp / "probabilities.tsv").read_text() == probs
+        assert list(scratch_fp.iterdir()) == []
+    finally:
+        os.environ.pop(FAKE_TOOLS_ENV, None)
+
+
+def test_fast_path():
+    temp_dir = Path(tempfile.mkdtemp())
+    output_fp = temp_dir / "output"
+    db_fp = temp_dir / "db"
+    rng = random.Random(42)
+    seq = write_db(db_fp, rng)
+    with open(release_dir(db_fp, LTP_VERSION) / "type_species.fasta") as f:
+        alpha = f.readlines()[1].strip()
+    batch_fp = temp_dir / "batch.fasta"
+    with open(batch_fp, "w") as f:
+        f.write(f">known\n{alpha}\n>novel\n{mutate(seq, 0.05, rng)}\n")
+
+    try:
+        main(
+            [
+                "--seq",
+                str(batch_fp),
+                "--output",
+                str(output_fp),
+                "--db",
+                str(db_fp),
+                "--subtree_only",
+                "--fake_tools",
+                "--fast_path",
+                "--fast_min_hits",
+                "1",
+                "--results",
+                str(temp_dir / "results.tsv"),
+            ]
+        )
+
+        with open(output_fp / "known" / "probabilities.tsv") as f:
+            assert f.readline().startswith("Tier: fast_path (1 hits")
+        assert not (output_fp / "known" / "RAxML_bipartitions.final").exists()
+        with open(output_fp / "novel" / "probabilities.tsv") as f:
+            assert f.readline().startswith("Tier: tree")
+        assert (output_fp / "novel" / "RAxML_bipartitions.final").exists()
+
+        with open(temp_dir / "results.tsv") as f:
+            rows = [l.rstrip("\n").split("\t") for l in f][1:]
+        assert [r[1:] for r in rows if r[0] == "known"] == [
+            ["fast_path", "Alpha", "1.0"]
+        ]
+        with open(output_fp / "batch_metrics.json") as f:
+            summary = json.load(f)
+        assert summary["tiers"] == {"fast_path": 1, "tree": 1}
+        assert summary["fast_path_fraction"] == 0.5
+    finally:
+        os.environ.pop(FAKE_TOOLS_ENV, None)
+
+
+def test_identify_in_memory():
+    from src.GenusFinder.DBDir import DBDir
+    from src.GenusFinder.FastPath import FastPath
+    from src.GenusFinder.Identify import identify_seq
+
+    temp_dir = Path(tempfile.mkdtemp())
+    output_fp = temp_dir / "output"
+    db_fp = temp_dir / "db"
+    rng = random.Random(42)
+    seq = write_db(db_fp, rng)
+    with open(release_dir(db_fp, LTP_VERSION) / "type_species.fasta") as f:
+        alpha = f.readlines()[1].strip()
+
+    try:
+        main(
+            [
+                "--seq",
+                seq,
+                "--output",
+                str(output_fp),
+                "--db",
+                str(db_fp),
+                "--subtree_only",
+                "--fake_tools",
+                "--searcher",
+                "kmer",
+                "--results",
+                str(temp_dir / "results.tsv"),
+            ]
+        )
+        with open(temp_dir / "results.tsv") as f:
+            rows = [l.rstrip("\n").split("\t") for l in f][1:]
+
+        db = DBDir(db_fp, "")
+        streamed = []
+        result = identify_seq(
+            seq,
+            db,
+            work_fp=temp_dir / "work",
+            on_probs=lambda method, probs: streamed.append(method),
+        )
+        # The same answer as going through the output dir
+        assert result["tier"] == "tree"
+        assert streamed == ["subtree_distance", "subtree_bootstrap"]
+        in_memory = [
+            [method, genus.split(" ")[0], p]
+            for method, probs in result["probs"].items()
+            for genus, p in probs.items()
+        ]
+        assert [r[1:3] for r in rows] == [r[:2] for r in in_memory]
+        assert [float(r[3]) for r in rows] == pytest.approx([r[2] for r in in_memory])
+        # Only the tools' files were written
+        assert not (temp_dir / "work" / "query.fasta").exists()
+        assert (temp_dir / "work" / "nearest_seqs_aligned.fasta").exists()
+
+        result = identify_seq(
+            alpha, db, fast_path=FastPath(min_hits=1), work_fp=temp_dir / "fast"
+        )
+        assert result["tier"] == "fast_path"
+        assert result["probs"] == {"fast_path": {"Alpha": 1.0}}
+        assert not (temp_dir / "fast").exists()
+    finally:
+        os.environ.pop(FAKE_TOOLS_ENV, None)
+
+
+def test_adaptive_bootstrap():
+    temp_dir = Path(tempfile.mkdtemp())
+    output_fp = temp_dir / "output"
+    db_fp = temp_dir / "db"
+    seq = write_db(db_fp, random.Random(42))
+
+    try:
+        main(
+            [
+                "--seq",
+                seq,
+                "--output",
+                str(output_fp),
+                "--db",
+                str(db_fp),
+                "--subtree_only",
+                "--fake_tools",
+                "--adaptive_bootstrap",
+                "--bootstrap_min",
+                "20",
+                "--bootstrap_max",
+                "40",
+            ]
+        )
+
+        with open(output_fp / "probabilities.tsv") as f:
+            assert "Bootstrap-based subtree probabilities" in f.read()
+        with open(output_fp / "RAxML_bootstrap.subtree1") as f:
+            replicates = len(f.readlines())
+        with open(output_fp / "metrics.json") as f:
+            info = json.load(f)["bootstrap"]
+        assert info["replicates"] == replicates
+        assert 20 <= replicates <= 40
+    finally:
+        os.environ.pop(FAKE_TOOLS_ENV, None)
+
+
+def write_full_db(db_fp: Path, rng: random.Random) -> str:
+    """
+    Type species plus the LTP alignment and tree the full tree method places into
+    """
+    base = "".join(rng.choice("ACGT") for _ in range(300))
+    d = release_dir(db_fp, LTP_VERSION)
+    os.makedirs(d)
+    clades = []
+    with open(d / "type_species.fasta", "w") as f_ts, open(
+        d / f"LTP_{LTP_VERSION}_aligned.fasta", "w"
+    ) as f_al:
+        for g, genus in enumerate(["Alpha", "Beta", "Gamma"]):
+            genus_base = mutate(base, 0.1, rng)
+            leaves = []
+            for i in range(20):
+                name = f"{genus[0]}{g * 20 + i:06d}"
+                seq = mutate(genus_base, 0.01, rng)
+                f_ts.write(f">{name}\t{genus} species{i}\n{seq}\n")
+                f_al.write(f">{name}\n{seq}\n")
+                leaves.append(f"{name}:{rng.uniform(0.005, 0.02):.4f}")
+            clades.append(f"({','.join(leaves)}):0.2")
+    with open(d / f"LTP_all_{LTP_VERSION}.ntree", "w") as f:
+        f.write(f"({','.join(clades)});\n")
+    return mutate(genus_base, 0.01, rng)
+
+
+@pytest.mark.parametrize("prune", [False, True])
+def test_full_tree_method(prune, monkeypatch):
+    from src.GenusFinder.Algorithms import Algorithms
+
+    temp_dir = Path(tempfile.mkdtemp())
+    output_fp = temp_dir / "output"
+    db_fp = temp_dir / "db"
+    seq = write_full_db(db_fp, random.Random(7))
+    argv = ["--seq", seq, "--output", str(output_fp), "--db", str(db_fp)]
+    argv += ["--fake_tools", "--prune_reference"] if prune else ["--fake_tools"]
+    train = Algorithms.train
+    trained_on = []
+
+    def spy(self, training_tree, *args, **kwargs):
+        trained_on.append(len(training_tree))
+        return train(self, training_tree, *args, **kwargs)
+
+    monkeypatch.setattr(Algorithms, "train", spy)
+
+    try:
+        main(argv)
+
+        # Curves are always fit on the whole LTP tree, pruning or not
+        assert trained_on == [60]
+
+        with open(output_fp / "probabilities.tsv") as f:
+            content = f.read()
+        assert "Full tree alignment probabilities" in content
+        full = content.split("Full tree alignment probabilities")[1]
+        assert full.split()[0] == "Gamma"
+    finally:
+        os.environ.pop(FAKE_TOOLS_ENV, None)
+
+
+def test_compress_sites():
+    temp_dir = Path(tempfile.mkdtemp())
+    db_fp = temp_dir / "db"
+    seq = write_full_db(db_fp, random.Random(11))
+
+    try:
+        probs = {}
+        for compress in [False, True]:
+            output_fp = temp_dir / f"output_{compress}"
+            argv = ["--seq", seq, "--output", str(output_fp), "--db", str(db_fp)]
+            main(argv + ["--fake_tools"] + (["--compress_sites"] if compress else []))
+            with open(output_fp / "probabilities.tsv") as f:
+                probs[compress] = f.read()
+
+        # Same trees from the site patterns, so the same probabilities
+        assert probs[True] == probs[False]
+        with open(temp_dir / "output_True" / "metrics.json") as f:
+            sites = json.load(f)["sites"]
+        assert set(sites) == {"compress_sites", "compress_combined"}
+        assert sites["compress_combined"]["patterns"] < 300
+        assert (temp_dir / "output_True" / "combined_weights.txt").exists()
+    finally:
+        os.environ.pop(FAKE_TOOLS_ENV, None)
+
+
+@pytest.mark.parametrize("mode", ["cprofile", "sample"])
+def test_profile(mode):
+    temp_dir = Path(tempfile.mkdtemp())
+    output_fp = temp_dir / "output"
+    db_fp = temp_dir / "db"
+    seq = write_db(db_fp, random.Random(42))
+
+    try:
+        argv = ["--seq", seq, "--output", str(output_fp), "--db", str(db_fp)]
+        main(argv + ["--subtree_only", "--fake_tools", "--profile", mode])
+
+        profiles = {fp.name for fp in (output_fp / "profile").iterdir()}
+        # Sampling can miss stages shorter than the interval, but not one running vsearch
+        assert "stage_search.folded" in profiles
+        assert ("stage_search.prof" in profiles) == (mode == "cprofile")
+        if mode == "cprofile":
+            assert "stage_subtree_probs.folded" in profiles
+    finally:
+        os.environ.pop(FAKE_TOOLS_ENV, None)
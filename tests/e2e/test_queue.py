@@ -0,0 +1,62 @@
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from pathlib import Path
+from .. import INC
+from src.GenusFinder.WorkQueue import WorkQueue
+from src.GenusFinder.command import main
+from .test_fake_tools import mutate, write_db
+
+
+def run(argv: list):
+    main(argv)
+
+
+def test_queue_workers():
+    temp_dir = Path(tempfile.mkdtemp())
+    output_fp = temp_dir / "output"
+    db_fp = temp_dir / "db"
+    queue_fp = temp_dir / "queue"
+    rng = random.Random(42)
+    seq = write_db(db_fp, rng)
+    with open(temp_dir / "batch.fasta", "w") as f:
+        for i in range(9):
+            f.write(f">query{i}\n{mutate(seq, 0.01, rng)}\n")
+    common = ["--output", str(output_fp), "--db", str(db_fp), "--queue", str(queue_fp)]
+    common += ["--subtree_only", "--fake_tools", "--results", str(temp_dir / "r.tsv")]
+    common += ["--lease", "2"]
+
+    ctx = multiprocessing.get_context("spawn")
+    coordinator = ctx.Process(
+        target=run,
+        args=(common + ["--seq", str(temp_dir / "batch.fasta"), "--shard_size", "3"],),
+    )
+    coordinator.start()
+    queue = WorkQueue(queue_fp, lease_s=2)
+    while not queue.info_fp.exists():
+        time.sleep(0.05)
+
+    # A worker that claims a shard then dies without renewing its lease
+    crashed = queue.claim("crashed")
+    workers = [ctx.Process(target=run, args=(common + ["--worker"],)) for _ in range(3)]
+    for w in workers:
+        w.start()
+    for p in workers + [coordinator]:
+        p.join(120)
+        assert p.exitcode == 0
+
+    done = queue.done()
+    assert len(done) == 3
+    assert done[crashed.name]["attempt"] == 1
+    assert "crashed" not in {info["worker"] for info in done.values()}
+    for i in range(9):
+        with open(output_fp / f"query{i}" / "probabilities.tsv") as f:
+            assert "Bootstrap-based subtree probabilities" in f.read()
+    with open(temp_dir / "r.tsv") as f:
+        rows = [l.split("\t") for l in f.read().splitlines()[1:]]
+    assert {r[0] for r in rows} == {f"query{i}" for i in range(9)}
+    with open(output_fp / "batch_metrics.json") as f:
+        assert json.load(f)["queries"] == 9
@@ -0,0 +1,146 @@
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from .. import INC
+from src.GenusFinder.CLI import FAKE_TOOLS_ENV, RAxMLTreeBuilder
+from src.GenusFinder.DBDir import LTP_VERSION, DBDir, release_dir
+from src.GenusFinder.FastPath import FastPath
+from src.GenusFinder.Prune import ReferencePruner
+from src.GenusFinder.server import (
+    IdentificationService,
+    make_server,
+    request_identification,
+)
+from .test_fake_tools import write_db, write_full_db
+
+
+@pytest.fixture(params=["unix", "tcp"])
+def server_fixture(request, monkeypatch):
+    temp_dir = Path(tempfile.mkdtemp())
+    monkeypatch.setenv(FAKE_TOOLS_ENV, "1")
+    seq = write_db(temp_dir / "db", random.Random(42))
+    service = IdentificationService(DBDir(temp_dir / "db", ""), temp_dir / "jobs", 2)
+    address = (
+        str(temp_dir / "genusd.sock") if request.param == "unix" else "127.0.0.1:0"
+    )
+    server = make_server(service, address)
+    if request.param == "tcp":
+        address = f"127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    yield address, seq, temp_dir
+
+    server.shutdown()
+    server.server_close()
+    service.shutdown()
+    shutil.rmtree(temp_dir)
+
+
+def test_identify(server_fixture):
+    address, seq, temp_dir = server_fixture
+    events = list(request_identification(address, seq))
+    assert events[0]["event"] == "accepted"
+    assert events[-1]["event"] == "done"
+    probs = [e for e in events if e["event"] == "probabilities"]
+    assert len(probs) == 2
+    assert "Alpha" in probs[0]["probs"]
+    # Job files are cleaned up once the results are streamed
+    assert not os.listdir(temp_dir / "jobs")
+
+
+def test_identify_bad_request(server_fixture):
+    address, seq, _ = server_fixture
+    for id in ["high", None]:
+        with pytest.raises(RuntimeError, match="400"):
+            list(request_identification(address, seq, id))
+    # The server is still up
+    assert list(request_identification(address, seq))[-1]["event"] == "done"
+
+
+def test_identify_concurrent(server_fixture):
+    address, seq, _ = server_fixture
+    with ThreadPoolExecutor(3) as ex:
+        results = list(
+            ex.map(lambda s: list(request_identification(address, s)), [seq] * 3)
+        )
+    assert all(r[-1]["event"] == "done" for r in results)
+
+
+def test_identify_tool_error(server_fixture, monkeypatch):
+    address, seq, _ = server_fixture
+    monkeypatch.setattr(
+        RAxMLTreeBuilder,
+        "executable",
+        lambda self: [sys.executable, "-c", "import sys; sys.exit(2)"],
+    )
+    events = list(request_identification(address, seq))
+    # The job fails with what went wrong, rather than taking the worker down with it
+    assert events[-1]["event"] == "error"
+    assert events[-1]["tool"]["tool"] == "raxmlHPC"
+    assert events[-1]["tool"]["returncode"] == 2
+
+    monkeypatch.undo()
+    monkeypatch.setenv(FAKE_TOOLS_ENV, "1")
+    assert list(request_identification(address, seq))[-1]["event"] == "done"
+
+
+def test_service_fast_path(monkeypatch):
+    temp_dir = Path(tempfile.mkdtemp())
+    monkeypatch.setenv(FAKE_TOOLS_ENV, "1")
+    write_db(temp_dir / "db", random.Random(42))
+    with open(release_dir(temp_dir / "db", LTP_VERSION) / "type_species.fasta") as f:
+        alpha = f.readlines()[1].strip()
+    service = IdentificationService(
+        DBDir(temp_dir / "db", ""),
+        temp_dir / "jobs",
+        fast_path=FastPath(min_hits=1),
+    )
+
+    try:
+        events = service.submit(alpha)
+        received = [events.get(timeout=30)]
+        while received[-1]["event"] not in ("done", "error"):
+            received.append(events.get(timeout=30))
+        assert received[-1]["event"] == "done"
+        assert [e["method"] for e in received if e["event"] == "probabilities"] == [
+            "Fast path probabilities (search identity)"
+        ]
+    finally:
+        service.shutdown()
+        shutil.rmtree(temp_dir)
+
+
+@pytest.mark.parametrize("prune", [False, True])
+def test_service_full_tree(prune, monkeypatch):
+    temp_dir = Path(tempfile.mkdtemp())
+    monkeypatch.setenv(FAKE_TOOLS_ENV, "1")
+    seq = write_full_db(temp_dir / "db", random.Random(7))
+    db = DBDir(temp_dir / "db", "")
+    service = IdentificationService(
+        db,
+        temp_dir / "jobs",
+        full_tree=True,
+        pruner=ReferencePruner(min_leaves=10) if prune else None,
+    )
+    # The reference is loaded with the service, not by the first job
+    assert db.LTP_tree is not None and db.LTP_clade_index is not None
+
+    try:
+        events = service.submit(seq)
+        received = [events.get(timeout=60)]
+        while received[-1]["event"] not in ("done", "error"):
+            received.append(events.get(timeout=60))
+        assert received[-1]["event"] == "done"
+        probs = {e["method"]: e["probs"] for e in received if "probs" in e}
+        full = probs["Full tree alignment probabilities"]
+        assert max(full, key=full.get) == "Gamma"
+        assert len(probs) == 3
+    finally:
+        service.shutdown()
+        shutil.rmtree(temp_dir)
@@ -0,0 +1,134 @@
+import pytest
+import shutil
+import tempfile
+from .. import INC
+from src.GenusFinder.Algorithms import Algorithms
+from pathlib import Path
+
+
+@pytest.fixture
+def algorithms_fixture():
+    temp_dir = Path(tempfile.mkdtemp())
+    with open(temp_dir / "tree.nwk", "w") as f:
+        f.write("((UNKNOWN:0.1,A000001:0.1)90:0.1,(B000002:0.2,B000003:0.2)80:0.1);\n")
+    with open(temp_dir / "type_species.fasta", "w") as f:
+        f.write(">A000001\tGenusA species\nACGT\n")
+        f.write(">B000002\tGenusB species\nACGG\n")
+        f.write(">B000003\tGenusB species\nACGC\n")
+    with open(temp_dir / "query.fasta", "w") as f:
+        f.write(">UNKNOWN\nACGA\n")
+
+    yield Algorithms(
+        temp_dir / "tree.nwk",
+        temp_dir / "type_species.fasta",
+        temp_dir / "query.fasta",
+    )
+
+    shutil.rmtree(temp_dir)
+
+
+def test_get_genus(algorithms_fixture):
+    a: Algorithms = algorithms_fixture
+    assert a.get_genus("B000002") == "GenusB"
+    assert a.get_genus("B000002", {"B000002": "Cached"}) == "Cached"
+
+
+def test_distance_probs(algorithms_fixture):
+    a: Algorithms = algorithms_fixture
+    probs = a.distance_probs()
+    assert list(probs) == ["GenusA", "GenusB"]
+    assert sum(probs.values()) == pytest.approx(1)
+
+
+def test_bootstrap_probs(algorithms_fixture):
+    a: Algorithms = algorithms_fixture
+    probs = a.bootstrap_probs()
+    assert list(probs) == ["GenusA", "GenusB"]
+    assert sum(probs.values()) == pytest.approx(1)
+
+
+def test_score_matches_predict_proba():
+    import numpy as np
+    from sklearn.linear_model import LogisticRegression
+
+    rng = np.random.default_rng(1)
+    lrs = {}
+    for i in range(5):
+        X = rng.uniform(0, 0.2, (40, 1))
+        y = (X[:, 0] + rng.normal(0, 0.03, 40) < 0.1).astype(int)
+        lrs[f"S{i}"] = LogisticRegression().fit(X * 50, y)
+
+    names, coefs, intercepts = Algorithms.stack_models(lrs)
+    D = rng.uniform(0, 0.3, (7, len(names)))
+    P = Algorithms.score(D, coefs, intercepts)
+    assert P.shape == (7, 5)
+    for j, name in enumerate(names):
+        expected = lrs[name].predict_proba(D[:, j : j + 1] * 50)[:, 1]
+        assert P[:, j] == pytest.approx(expected)
+    assert Algorithms.probability_for(lrs["S0"], D[0, 0]) == pytest.approx(P[0, 0])
+
+
+def test_by_genus():
+    import numpy as np
+
+    P = np.array([[0.2, 0.9, 0.4], [0.7, 0.1, 0.3]])
+    genera, G = Algorithms.by_genus(P, ["B", "A", "B"])
+    assert genera == ["A", "B"]
+    assert G.tolist() == [[0.9, 0.4], [0.1, 0.7]]
+
+
+def test_distances_to(algorithms_fixture):
+    a: Algorithms = algorithms_fixture
+    dists = a.distances_to("UNKNOWN")
+    for name in ["A000001", "B000002", "B000003"]:
+        assert dists[name] == pytest.approx(a.distance_to_unknown(name))
+
+
+def test_train():
+    import random
+    from ete3 import Tree
+
+    temp_dir = Path(tempfile.mkdtemp())
+    rng = random.Random(3)
+    t = Tree()
+    for g in "AB":
+        clade = t.add_child(dist=0.3)
+        for i in range(20):
+            clade.add_child(name=f"{g}{i:06d}", dist=rng.uniform(0.01, 0.05))
+    training_fp = temp_dir / "training.nwk"
+    t.write(outfile=str(training_fp))
+    # The query placed next to A000000
+    placed = t.copy()
+    leaf = placed.search_nodes(name="A000000")[0]
+    leaf.up.add_child(name="QUERY___UNKNOWN", dist=0.01)
+    with open(temp_dir / "combined.nwk", "w") as f:
+        f.write(placed.write() + "\n")
+    with open(temp_dir / "type_species.fasta", "w") as f:
+        f.write(">A000000\tGenusA species\nACGT\n")
+    with open(temp_dir / "query.fasta", "w") as f:
+        f.write(">UNKNOWN\nACGA\n")
+
+    try:
+        lookup = {l: f"Genus{l[0]}" for l in t.get_leaf_names()}
+        a = Algorithms(
+            temp_dir / "combined.nwk",
+            temp_dir / "type_species.fasta",
+            temp_dir / "query.fasta",
+            lookup,
+        )
+        assert a.query_name == "QUERY___UNKNOWN"
+        probs = a.train(training_fp, min_neighbors=30)
+        assert list(probs) == ["GenusA", "GenusB"]
+        assert probs["GenusA"] > 0.5 > probs["GenusB"]
+
+        # Species with no genus are left out rather than failing
+        del lookup["B000003"]
+        a = Algorithms(
+            temp_dir / "combined.nwk",
+            temp_dir / "type_species.fasta",
+            temp_dir / "query.fasta",
+            lookup,
+        )
+        assert list(a.train(training_fp, min_neighbors=30)) == ["GenusA", "GenusB"]
+    finally:
+        shutil.rmtree(temp_dir)
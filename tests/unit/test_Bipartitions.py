@@ -0,0 +1,122 @@
+import pytest
+import random
+import shutil
+import tempfile
+from ete3 import Tree
+from .. import INC
+from src.GenusFinder.Algorithms import Algorithms
+from src.GenusFinder.Bipartitions import SplitCounter, place_supports
+from pathlib import Path
+
+
+@pytest.fixture
+def temp_dir():
+    temp_dir = Path(tempfile.mkdtemp())
+    yield temp_dir
+    shutil.rmtree(temp_dir)
+
+
+def random_tree(names: list, rng: random.Random) -> Tree:
+    nodes = [Tree(name=name) for name in names]
+    while len(nodes) > 1:
+        parent = Tree()
+        for _ in range(2):
+            child = nodes.pop(rng.randrange(len(nodes)))
+            parent.add_child(child, dist=rng.uniform(0.001, 0.2))
+        nodes.append(parent)
+    return nodes[0]
+
+
+def expected_supports(best: Tree, boots: list) -> list:
+    """
+    Percentage of boots with each non-root internal node's bipartition, the slow way
+    """
+    everything = frozenset(best.get_leaf_names())
+    ref = sorted(everything)[0]
+
+    def splits(t: Tree) -> set:
+        out = set()
+        for n in t.traverse():
+            side = frozenset(n.get_leaf_names())
+            out.add(everything - side if ref in side else side)
+        return out
+
+    boot_splits = [splits(b) for b in boots]
+    supports = []
+    for n in best.traverse("postorder"):
+        if n.is_leaf() or not n.up:
+            continue
+        side = frozenset(n.get_leaf_names())
+        side = everything - side if ref in side else side
+        supports.append(round(100 * sum(side in s for s in boot_splits) / len(boots)))
+    return supports
+
+
+def test_supports_match_bipartitions():
+    rng = random.Random(4)
+    names = [f"L{i:03d}" for i in range(30)]
+    best = random_tree(names, rng)
+    # Mostly the best tree with a few of its leaves moved, so supports vary
+    boots = []
+    for _ in range(50):
+        b = best.copy()
+        for _ in range(rng.randint(0, 3)):
+            leaf = b.search_nodes(name=rng.choice(names))[0]
+            leaf.detach()
+            for n in list(b.traverse()):
+                if not n.is_leaf() and len(n.children) == 1:
+                    n.delete()
+            target = rng.choice(list(b.traverse())[1:])
+            new = target.up.add_child(dist=0.01)
+            new.add_child(target.detach())
+            new.add_child(leaf)
+        boots.append(b)
+
+    counter = SplitCounter(names)
+    for b in boots:
+        counter.add(b.write(format=1))
+    counter.support(best)
+    supports = [
+        n.support for n in best.traverse("postorder") if not n.is_leaf() and n.up
+    ]
+    assert supports == expected_supports(best, boots)
+    assert 0 < min(supports) < 100
+
+
+def test_rooting_doesnt_matter():
+    rng = random.Random(2)
+    names = [f"L{i:03d}" for i in range(12)]
+    t = random_tree(names, rng)
+    rerooted = t.copy()
+    rerooted.set_outgroup(rerooted.search_nodes(name="L007")[0])
+
+    counter = SplitCounter(names)
+    counter.add(t.write(format=1))
+    counter.add(rerooted.write(format=1))
+    assert set(counter.counts.values()) == {2}
+
+
+def test_place_supports(temp_dir):
+    rng = random.Random(8)
+    names = ["UNKNOWN"] + [f"{'AB'[i % 2]}{i:06d}" for i in range(1, 16)]
+    best = random_tree(names, rng)
+    best.write(outfile=str(temp_dir / "best.nwk"))
+    with open(temp_dir / "boots.nwk", "w") as f:
+        for i in range(20):
+            f.write((best if i % 2 else random_tree(names, rng)).write() + "\n")
+
+    t = place_supports(
+        temp_dir / "best.nwk", temp_dir / "boots.nwk", temp_dir / "supported.nwk"
+    )
+    with open(temp_dir / "type_species.fasta", "w") as f:
+        for name in names[1:]:
+            f.write(f">{name}\tGenus{name[0]} species\nACGT\n")
+    with open(temp_dir / "query.fasta", "w") as f:
+        f.write(">UNKNOWN\nACGT\n")
+
+    # Written like RAxML_bipartitions, so reading it back gives the same probabilities
+    args = [temp_dir / "type_species.fasta", temp_dir / "query.fasta"]
+    in_memory = Algorithms(t, *args).bootstrap_probs()
+    from_file = Algorithms(temp_dir / "supported.nwk", *args).bootstrap_probs()
+    assert in_memory == pytest.approx(from_file)
+    assert list(in_memory) == list(from_file)
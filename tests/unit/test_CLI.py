@@ -1,6 +1,19 @@
 import pytest
+import shutil
+import tempfile
 from .. import INC
-from src.GenusFinder.CLI import CLI, MuscleAligner, RAxMLTreeBuilder
+from src.GenusFinder.CLI import (
+    CLI,
+    FAKE_TOOLS_ENV,
+    FAKE_TOOLS_FP,
+    TOOL_TIMEOUT_ENV,
+    MuscleAligner,
+    RAxMLTreeBuilder,
+    ToolError,
+    timeout_for,
+)
+from src.GenusFinder.fake_tools import LATENCY_ENV
+from pathlib import Path
 
 
 @pytest.fixture
@@ -13,6 +26,81 @@ def raxml_fixture():
     yield RAxMLTreeBuilder()
 
 
+@pytest.fixture
+def temp_dir():
+    temp_dir = Path(tempfile.mkdtemp())
+    yield temp_dir
+    shutil.rmtree(temp_dir)
+
+
 def test_muscle_call(muscle_fixture):
     cli: MuscleAligner = muscle_fixture
     # cli.call()
+
+
+def test_fake_executable(raxml_fixture, monkeypatch):
+    cli: RAxMLTreeBuilder = raxml_fixture
+    assert cli.executable() == ["raxmlHPC"]
+    monkeypatch.setenv(FAKE_TOOLS_ENV, "1")
+    assert cli.executable()[-2:] == [str(FAKE_TOOLS_FP), "raxmlHPC"]
+
+
+def test_tool_error(temp_dir, monkeypatch):
+    monkeypatch.setenv(FAKE_TOOLS_ENV, "1")
+    with open(temp_dir / "aligned.fasta", "w") as f:
+        f.write(">A\nACGT\n>A\nACGA\n")
+
+    with pytest.raises(ToolError) as e:
+        RAxMLTreeBuilder().call(
+            m="GTRCAT", n="t", p=10000, s=temp_dir / "aligned.fasta", w=temp_dir
+        )
+    assert e.value.result.status == "failed"
+    assert e.value.result.returncode == 1
+    assert e.value.result.to_dict()["tool"] == "raxmlHPC"
+
+
+def test_stale_removed_on_run(temp_dir, monkeypatch):
+    monkeypatch.setenv(FAKE_TOOLS_ENV, "1")
+    with open(temp_dir / "aligned.fasta", "w") as f:
+        f.write(">A\nACGT\n>B\nACGA\n>C\nTCGA\n")
+    with open(temp_dir / "RAxML_info.t", "w") as f:
+        f.write("an earlier run\n")
+
+    job = RAxMLTreeBuilder(defer=True).call(
+        m="GTRCAT", n="t", p=10000, s=temp_dir / "aligned.fasta", w=temp_dir
+    )
+    # Only cleared once the tool actually runs
+    assert (temp_dir / "RAxML_info.t").exists()
+    job.before()
+    assert not (temp_dir / "RAxML_info.t").exists()
+
+    with open(temp_dir / "RAxML_info.t", "w") as f:
+        f.write("an earlier run\n")
+    RAxMLTreeBuilder().call(
+        m="GTRCAT", n="t", p=10000, s=temp_dir / "aligned.fasta", w=temp_dir
+    )
+    assert (temp_dir / "RAxML_bestTree.t").exists()
+
+
+def test_timeout_for(monkeypatch):
+    assert timeout_for("muscle") is None
+    monkeypatch.setenv(TOOL_TIMEOUT_ENV, "30")
+    assert timeout_for("muscle") == 30.0
+    monkeypatch.setenv(TOOL_TIMEOUT_ENV, "muscle=600, raxmlHPC=3600")
+    assert timeout_for("raxmlHPC") == 3600.0
+    assert timeout_for("vsearch") is None
+
+
+def test_tool_timeout(temp_dir, monkeypatch):
+    monkeypatch.setenv(FAKE_TOOLS_ENV, "1")
+    monkeypatch.setenv(LATENCY_ENV, "raxmlHPC=30")
+    monkeypatch.setenv(TOOL_TIMEOUT_ENV, "raxmlHPC=0.5")
+    with open(temp_dir / "aligned.fasta", "w") as f:
+        f.write(">A\nACGT\n>B\nACGA\n>C\nTCGA\n")
+
+    args = dict(m="GTRCAT", n="t", p=10000, s=temp_dir / "aligned.fasta", w=temp_dir)
+    with pytest.raises(ToolError) as e:
+        RAxMLTreeBuilder().call(**args)
+    assert e.value.result.status == "timeout"
+    # Deferred jobs get the same limit
+    assert RAxMLTreeBuilder(defer=True).call(**args).timeout == 0.5
@@ -0,0 +1,81 @@
+import pytest
+import random
+from ete3 import Tree
+from .. import INC
+from src.GenusFinder.Algorithms import Algorithms
+from src.GenusFinder.CladeIndex import CladeIndex
+
+
+def random_tree(n: int, rng: random.Random) -> Tree:
+    nodes = [Tree(name=f"{'ABCD'[i % 4]}{i:06d}") for i in range(n)]
+    while len(nodes) > 1:
+        parent = Tree()
+        for _ in range(2):
+            child = nodes.pop(rng.randrange(len(nodes)))
+            parent.add_child(child, dist=rng.uniform(0.001, 0.2))
+        nodes.append(parent)
+    return nodes[0]
+
+
+@pytest.fixture
+def tree_fixture():
+    t = random_tree(200, random.Random(3))
+    # The query has no genus, so it's left out of the counts
+    genus = lambda name: None if name == "A000000" else name[0]
+    yield t, genus, CladeIndex(t, genus)
+
+
+def climb(node: Tree, min_leaves: int) -> Tree:
+    while len(node) < min_leaves and node.up:
+        node = node.up
+    return node
+
+
+def test_clade(tree_fixture):
+    t, _, index = tree_fixture
+    for leaf in t.get_leaves()[::7]:
+        for min_leaves in [1, 2, 30, 150, 500]:
+            node = index.clade([leaf.name], min_leaves)
+            assert index.nodes[node] is climb(leaf, min_leaves)
+            assert index.leaves(node) == climb(leaf, min_leaves).get_leaf_names()
+
+
+def test_clade_of_several(tree_fixture):
+    t, _, index = tree_fixture
+    rng = random.Random(5)
+    for _ in range(20):
+        names = rng.sample(t.get_leaf_names(), 3)
+        expected = climb(t.get_common_ancestor(names), 20)
+        assert index.nodes[index.clade(names, 20)] is expected
+
+
+def test_histogram_and_count(tree_fixture):
+    t, genus, index = tree_fixture
+    for i, node in enumerate(index.nodes):
+        expected = {}
+        for name in node.get_leaf_names():
+            if genus(name):
+                expected[genus(name)] = expected.get(genus(name), 0) + 1
+        assert index.histogram(i) == expected
+        assert index.count(i, "B") == expected.get("B", 0)
+    assert index.count(index.root, "Z") == 0
+
+
+def test_distances(tree_fixture):
+    t, _, index = tree_fixture
+    leaf = t.get_leaves()[10]
+    node = index.clade([leaf.name], 40)
+    expected = [leaf.get_distance(name) for name in index.leaves(node)]
+    assert index.distances(leaf.name, node) == pytest.approx(expected)
+    with pytest.raises(ValueError):
+        index.distances(t.get_leaves()[10].name, index.leaf(t.get_leaves()[11].name))
+
+
+def test_learn_curve_with_index(tree_fixture):
+    t, genus, index = tree_fixture
+    name = t.get_leaf_names()[5]
+    # Building the index itself or sharing one gives the same curve
+    lr = Algorithms.learn_curve(name, t, genus)
+    shared = Algorithms.learn_curve(name, t, index=index)
+    assert shared.coef_ == pytest.approx(lr.coef_)
+    assert shared.intercept_ == pytest.approx(lr.intercept_)
@@ -1,9 +1,13 @@
+import multiprocessing
 import os
 import pytest
 import shutil
 import tempfile
+import time
 from .. import INC
-from src.GenusFinder.DBDir import DBDir
+from src.GenusFinder.CLI import FAKE_TOOLS_ENV, VsearchSearcher
+from src.GenusFinder.DBDir import LTP_VERSION, DBDir
+from src.GenusFinder.Manifest import sha256
 from pathlib import Path
 
 
@@ -26,7 +30,7 @@ def test_get_16S_db(db_fixture):
 def test_get_LTP_aligned(db_fixture):
     db = db_fixture
     with open(db.LTP_aligned_fp, "w") as f:
-        f.write(" ")
+        f.write(">A000001\nAC-T\n")
     assert db.get_LTP_aligned().exists()
     assert db.get_LTP_aligned().stat().st_size > 0
 
@@ -53,3 +57,201 @@ def test_get_LTP_csv(db_fixture):
         f.write(" ")
     assert db.get_LTP_csv().exists()
     assert db.get_LTP_csv().stat().st_size > 0
+
+
+def test_type_species_udb(db_fixture, monkeypatch):
+    monkeypatch.setenv(FAKE_TOOLS_ENV, "1")
+    db = db_fixture
+    with open(db.type_species_fp, "w") as f:
+        f.write(">AB000001\tAlpha beta\nACGT\n")
+    udb = db.get_type_species_udb()
+    entry = db.manifest.get(db.type_species_udb_fp)
+    assert udb == db.type_species_udb_fp
+    assert entry["params"]["source_sha256"] == sha256(db.type_species_fp)
+    assert entry["source"] == [db.manifest.key(db.type_species_fp)]
+
+    # Reused while the source is unchanged, without hashing it again
+    mtime = udb.stat().st_mtime_ns
+    hashed = []
+    monkeypatch.setattr(
+        "src.GenusFinder.DBDir.sha256", lambda fp: hashed.append(fp) or sha256(fp)
+    )
+    assert DBDir(db.root_fp, "").get_type_species_udb().stat().st_mtime_ns == mtime
+    assert hashed == []
+
+    with open(db.type_species_fp, "a") as f:
+        f.write(">AB000002\tGamma delta\nACGA\n")
+    # A search that already has the old one open keeps reading it
+    with open(udb) as old:
+        DBDir(db.root_fp, "").get_type_species_udb()
+        assert "AB000002" not in old.read()
+    with open(udb) as f:
+        assert "AB000002" in f.read()
+    entry = db.manifest.get(db.type_species_udb_fp)
+    assert entry["params"]["source_sha256"] == sha256(db.type_species_fp)
+
+
+def test_type_species_udb_compressed(monkeypatch):
+    monkeypatch.setenv(FAKE_TOOLS_ENV, "1")
+    temp_dir = Path(tempfile.mkdtemp())
+    db = DBDir(temp_dir / "db", "", "gzip", temp_dir / "scratch")
+    with open(db.type_species_fp, "w") as f:
+        f.write(">AB000001\tAlpha beta\nACGT\n")
+    try:
+        udb = db.get_type_species_udb()
+        # Stored plain for vsearch to read, however the rest of the DB is stored
+        assert udb == db.type_species_udb_fp
+        assert db.stored(db.type_species_udb_fp) == udb
+        assert "compression" not in db.manifest.get(udb)["params"]
+
+        with open(temp_dir / "query.fasta", "w") as f:
+            f.write(">UNKNOWN\nACGT\n")
+        VsearchSearcher().call_udb(
+            temp_dir / "query.fasta",
+            udb,
+            0.9,
+            temp_dir / "hits.fasta",
+            temp_dir / "hits.tsv",
+        )
+        with open(temp_dir / "hits.tsv") as f:
+            assert "AB000001" in f.read()
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test_LTP_tree_object(db_fixture):
+    db = db_fixture
+    with open(db.LTP_tree_fp, "w") as f:
+        f.write("(('A000001 Alpha':0.1,'A000002':0.2)Inner:0.3,\n'B000003':0.4);\n")
+    t = db.get_LTP_tree_object()
+    assert sorted(t.get_leaf_names()) == ["A000001 Alpha", "A000002", "B000003"]
+    assert t.search_nodes(name="Inner")
+    assert db.get_LTP_tree_object() is t
+
+
+def test_releases_side_by_side(db_fixture):
+    db = db_fixture
+    old = DBDir(db.root_fp, "", ltp_version="01_2022")
+    assert db.LTP_VERSION == LTP_VERSION
+    assert old.LTP_tree_fp == db.root_fp / "LTP_01_2022" / "tree_LTP_all_01_2022.ntree"
+    assert old.type_species_fp.parent != db.type_species_fp.parent
+
+
+def test_manifest(db_fixture):
+    db = db_fixture
+    with open(db.LTP_blastdb_fp, "w") as f:
+        f.write(">x [accession=AB000001] [organism=Alpha beta]\nACGU\n")
+    db.get_type_species()
+
+    blastdb = db.manifest.get(db.LTP_blastdb_fp)
+    assert blastdb["source"] == ["existing"]
+    assert blastdb["validated"] is None
+    type_species = db.manifest.get(db.type_species_fp)
+    assert type_species["version"] == LTP_VERSION
+    assert type_species["source"] == [db.manifest.key(db.LTP_blastdb_fp)]
+    assert type_species["sha256"] == sha256(db.type_species_fp)
+    assert db.manifest.verify() == []
+
+    with open(db.type_species_fp, "a") as f:
+        f.write(">AB000002\tGamma delta\nAACC\n")
+    assert db.manifest.verify() == [db.manifest.key(db.type_species_fp)]
+
+
+def write_raw_alignment(fp: Path):
+    with open(fp, "w") as f:
+        f.write(">A000001\n..ACGU-N\n>A000002\n..AC.URY\n")
+
+
+def test_alignment_validated_once(db_fixture, monkeypatch):
+    db = db_fixture
+    raw_fp = db.root_fp / "raw_aligned.fasta"
+    write_raw_alignment(raw_fp)
+    monkeypatch.setattr(db, "url_for", lambda name: raw_fp.resolve().as_uri())
+
+    assert db.get_LTP_aligned() == db.LTP_aligned_fp
+    entry = db.manifest.get(db.LTP_aligned_fp)
+    assert entry["validated"] is True
+    assert entry["params"]["cleaned"]
+
+    def fail():
+        raise AssertionError("Validated again")
+
+    monkeypatch.setattr(db, "verify_alignment", fail)
+    db.get_LTP_aligned()
+
+
+def test_verify_alignment(db_fixture):
+    db = db_fixture
+    with open(db.LTP_aligned_fp, "w") as f:
+        f.write(">A000001\nAC-T\n>A000002\nA--T\n")
+    assert db.verify_alignment()
+
+    with open(db.LTP_aligned_fp, "w") as f:
+        f.write(">A000001\nAC-T\n>A000002\nA--TT\n")
+    assert not db.verify_alignment()
+
+    with open(db.LTP_aligned_fp, "w") as f:
+        f.write(">A000001\nAC.T\n")
+    assert not db.verify_alignment()
+
+
+def test_adopted_alignment_validated(db_fixture):
+    db = db_fixture
+    with open(db.LTP_aligned_fp, "w") as f:
+        f.write(">A000001\nAC.T\n")
+    # Put there by hand, so it's validated when it's first found
+    with pytest.raises(ValueError):
+        db.get_LTP_aligned()
+    assert db.manifest.get(db.LTP_aligned_fp)["validated"] is False
+    assert not db.validate()
+
+
+def test_genus_index_shared(db_fixture):
+    from concurrent.futures import ThreadPoolExecutor
+
+    db = db_fixture
+    with open(db.type_species_fp, "w") as f:
+        for i in range(1000):
+            f.write(f">AB{i:06d}\tGenus{i % 7} species\nACGT\n")
+    with ThreadPoolExecutor(8) as ex:
+        indexes = list(ex.map(lambda _: db.get_genus_index(), range(8)))
+    # Parsed once, and nobody sees it half filled
+    assert all(index is indexes[0] for index in indexes)
+    assert len(indexes[0]) == 1000
+
+
+def build_concurrently(root_fp: Path, log_fp: Path, compression: str) -> str:
+    db = DBDir(root_fp, "", compression)
+    generate = db._generate_type_species
+
+    def logged(out_fp):
+        with open(log_fp, "a") as f:
+            f.write(f"{os.getpid()}\n")
+        # Keep the build going long enough for everyone else to pile up behind it
+        time.sleep(0.5)
+        generate(out_fp)
+
+    db._generate_type_species = logged
+    with open(db.get_type_species()) as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("compression", [None, "gzip"])
+def test_shared_db_contention(db_fixture, compression):
+    db = db_fixture
+    with open(db.LTP_blastdb_fp, "w") as f:
+        for i in range(500):
+            f.write(f">x [accession=AB{i:06d}] [organism=Alpha beta]\nACGU\n")
+    log_fp = db.root_fp / "builds.log"
+
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(12) as pool:
+        contents = pool.starmap(
+            build_concurrently, [(db.root_fp, log_fp, compression)] * 24
+        )
+
+    assert len(log_fp.read_text().split()) == 1
+    assert len(set(contents)) == 1
+    assert contents[0].count(">") == 500
+    assert db.manifest.verify() == []
+    assert not list(db.release_fp.glob(".*.tmp"))
@@ -0,0 +1,82 @@
+import json
+import shutil
+import tempfile
+import pytest
+from .. import INC
+from src.GenusFinder.Dereplicate import dereplicate, fan_out, normalize, reduction
+from pathlib import Path
+
+
+@pytest.fixture
+def temp_dir():
+    temp_dir = Path(tempfile.mkdtemp())
+    yield temp_dir
+    shutil.rmtree(temp_dir)
+
+
+def test_normalize():
+    assert normalize("acgu-\nAC.GT ") == "ACGTACGT"
+
+
+def test_exact():
+    batch = [("a", "ACGT"), ("b", "acgt"), ("c", "ACGA"), ("d", "AC-GT")]
+    assert dereplicate(batch) == [
+        (0, "unique"),
+        (0, "exact"),
+        (2, "unique"),
+        (0, "exact"),
+    ]
+
+
+def test_contained():
+    batch = [
+        ("prefix", "ACGT"),
+        ("long", "ACGTTTGCA"),
+        ("suffix", "TTGCA"),
+        ("other", "GGGG"),
+        ("middle", "GTTTG"),
+        ("chain", "ACGTTT"),
+        ("copy", "acgttt"),
+    ]
+    # Only prefixes and suffixes count, middle isn't either
+    assert dereplicate(batch, contained=True) == [
+        (1, "contained"),
+        (1, "unique"),
+        (1, "contained"),
+        (3, "unique"),
+        (4, "unique"),
+        (1, "contained"),
+        (1, "contained"),
+    ]
+    assert dereplicate(batch) == [
+        (0, "unique"),
+        (1, "unique"),
+        (2, "unique"),
+        (3, "unique"),
+        (4, "unique"),
+        (5, "unique"),
+        (5, "exact"),
+    ]
+    assert reduction(dereplicate(batch, contained=True)) == {
+        "queries": 7,
+        "unique": 3,
+        "exact": 0,
+        "contained": 4,
+    }
+
+
+def test_fan_out(temp_dir):
+    rep_fp = temp_dir / "a"
+    rep_fp.mkdir()
+    with open(rep_fp / "probabilities.tsv", "w") as f:
+        f.write("Alpha\t1.0\n")
+    (temp_dir / "b").mkdir()
+    with open(temp_dir / "b" / "metrics.json", "w") as f:
+        f.write("{}")
+    fan_out(rep_fp, "a", temp_dir / "b", "exact")
+    # Left from when b was run itself
+    assert not (temp_dir / "b" / "metrics.json").exists()
+    with open(temp_dir / "b" / "probabilities.tsv") as f:
+        assert f.read() == "Alpha\t1.0\n"
+    with open(temp_dir / "b" / "dereplicated.json") as f:
+        assert json.load(f)["representative"] == "a"
@@ -0,0 +1,47 @@
+import pytest
+import shutil
+import tempfile
+from .. import INC
+from src.GenusFinder.FastPath import FastPath, read_hits
+from pathlib import Path
+
+LOOKUP = {"A1": "Alpha", "A2": "Alpha", "A3": "Alpha", "B1": "Beta", "B2": "Beta"}
+
+
+@pytest.fixture
+def temp_dir():
+    temp_dir = Path(tempfile.mkdtemp())
+    yield temp_dir
+    shutil.rmtree(temp_dir)
+
+
+def test_read_hits(temp_dir):
+    fp = temp_dir / "hits.tsv"
+    with open(fp, "w") as f:
+        f.write("B1\tUNKNOWN\t97.5\nA1\tUNKNOWN\t99.7\n\n")
+    assert read_hits(fp) == [("A1", 99.7), ("B1", 97.5)]
+
+
+def test_unanimous():
+    hits = [("A1", 100.0), ("A2", 99.5), ("A3", 99.1), ("B1", 97.0)]
+    probs, reason = FastPath().call(hits, LOOKUP)
+    assert probs == {"Alpha": 1.0}
+    assert "3 hits" in reason
+
+
+def test_too_few_hits():
+    hits = [("A1", 100.0), ("A2", 99.5), ("B1", 98.0)]
+    assert FastPath().call(hits, LOOKUP)[0] is None
+    assert FastPath(min_hits=2).call(hits, LOOKUP)[0] == {"Alpha": 1.0}
+
+
+def test_disagreement():
+    hits = [("A1", 100.0), ("A2", 99.5), ("A3", 99.4), ("B1", 99.2)]
+    assert FastPath().call(hits, LOOKUP)[0] is None
+    probs, _ = FastPath(min_agreement=0.75).call(hits, LOOKUP)
+    assert probs == {"Alpha": 0.75, "Beta": 0.25}
+
+
+def test_unknown_genus():
+    hits = [("X1", 100.0), ("X2", 100.0), ("X3", 100.0)]
+    assert FastPath().call(hits, LOOKUP)[0] is None
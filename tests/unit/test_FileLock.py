@@ -0,0 +1,71 @@
+import multiprocessing
+import pytest
+import shutil
+import tempfile
+import threading
+import time
+from .. import INC
+from src.GenusFinder.FileLock import FileLock
+from pathlib import Path
+
+
+@pytest.fixture
+def temp_dir():
+    temp_dir = Path(tempfile.mkdtemp())
+    yield temp_dir
+    shutil.rmtree(temp_dir)
+
+
+def increment(temp_dir: Path, n: int):
+    # Non-atomic read-modify-write, only correct if the lock excludes everyone else
+    for _ in range(n):
+        with FileLock(temp_dir / "counter.lock"):
+            fp = temp_dir / "counter"
+            value = int(fp.read_text()) if fp.exists() else 0
+            time.sleep(0.001)
+            fp.write_text(str(value + 1))
+
+
+def test_processes(temp_dir):
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=increment, args=(temp_dir, 10)) for _ in range(8)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+        assert p.exitcode == 0
+    assert (temp_dir / "counter").read_text() == "80"
+
+
+def test_threads(temp_dir):
+    threads = [
+        threading.Thread(target=increment, args=(temp_dir, 10)) for _ in range(8)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert (temp_dir / "counter").read_text() == "80"
+
+
+def hold(fp: Path, held, release):
+    with FileLock(fp):
+        held.set()
+        release.wait(10)
+
+
+def test_timeout(temp_dir):
+    ctx = multiprocessing.get_context("spawn")
+    held, release = ctx.Event(), ctx.Event()
+    p = ctx.Process(target=hold, args=(temp_dir / "x.lock", held, release))
+    p.start()
+    try:
+        assert held.wait(10)
+        with pytest.raises(TimeoutError):
+            with FileLock(temp_dir / "x.lock", timeout=0.2):
+                pass
+    finally:
+        release.set()
+        p.join()
+    with FileLock(temp_dir / "x.lock", timeout=5):
+        pass
@@ -0,0 +1,94 @@
+import random
+import pytest
+import shutil
+import tempfile
+from .. import INC
+from src.GenusFinder.DBDir import DBDir
+from src.GenusFinder.KmerIndex import KmerIndex, KmerSearcher, identity, kmer_codes
+from src.GenusFinder.OutputDir import OutputDir
+from pathlib import Path
+
+
+def random_seq(rng: random.Random, length: int) -> str:
+    return "".join(rng.choice("ACGT") for _ in range(length))
+
+
+def mutate(rng: random.Random, seq: str, n: int) -> str:
+    seq = list(seq)
+    for i in rng.sample(range(len(seq)), n):
+        seq[i] = "ACGT"["ACGT".index(seq[i]) - 1]
+    return "".join(seq)
+
+
+@pytest.fixture
+def db_fixture():
+    temp_dir = Path(tempfile.mkdtemp())
+    rng = random.Random(7)
+    db = DBDir(temp_dir / "db", "")
+    seqs = {f"A{i:06d}": random_seq(rng, 300) for i in range(40)}
+    with open(db.type_species_fp, "w") as f:
+        for name, seq in seqs.items():
+            f.write(f">{name}\tGenus{name[0]} species\n{seq}\n")
+
+    yield db, seqs, rng
+
+    shutil.rmtree(temp_dir)
+
+
+def test_kmer_codes():
+    # ACG = 0b000110, CGT = 0b011011, N breaks the k-mers it's in
+    assert list(kmer_codes("ACGTNACG", 3)) == [0b000110, 0b011011]
+    assert len(kmer_codes("AC", 3)) == 0
+
+
+def test_identity():
+    assert identity("ACGTACGT", "ACGTACGT") == 1.0
+    assert identity("ACGTTCGT", "ACGTACGT") == 0.875
+    # End gaps in the longer sequence are free
+    assert identity("CGTACG", "TTTTACGTACGTTTT") == 1.0
+
+
+def test_search(db_fixture):
+    db, seqs, rng = db_fixture
+    index = db.get_kmer_index()
+    assert len(index) == len(seqs)
+    assert index.get_seq(3) == seqs["A000003"]
+
+    query = mutate(rng, seqs["A000012"], 6)
+    hits = index.search(query, 5)
+    assert hits[0][0] == "A000012\tGenusA species"
+    assert hits[0][1] == pytest.approx(1 - 6 / 300)
+    # Unrelated random sequences share few 8-mers
+    assert index.search(query, 5, 0.9) == hits[:1]
+
+    estimate = index.search(query, 5, refine=False)
+    assert estimate[0][0] == hits[0][0]
+    assert 0.9 < estimate[0][1] <= 1.0
+
+
+def test_index_reused_until_source_changes(db_fixture):
+    db, seqs, rng = db_fixture
+    db.get_kmer_index()
+    mtime = (db.kmer_index_fp / "postings.npy").stat().st_mtime_ns
+
+    assert DBDir(db.root_fp, "").get_kmer_index().meta["n"] == len(seqs)
+    assert (db.kmer_index_fp / "postings.npy").stat().st_mtime_ns == mtime
+
+    with open(db.type_species_fp, "a") as f:
+        f.write(f">B000001\tGenusB species\n{random_seq(rng, 300)}\n")
+    assert db.get_kmer_index().meta["n"] == len(seqs) + 1
+
+
+def test_searcher_output_reduces(db_fixture):
+    db, seqs, rng = db_fixture
+    out = OutputDir(
+        db.root_fp.parent / "output", mutate(rng, seqs["A000020"], 3), False
+    )
+    KmerSearcher(db.get_kmer_index()).call(
+        db.get_type_species(), out.get_query(), 0.9, out.get_nearest_seqs()
+    )
+    out.reduce_subtree()
+
+    with open(out.nearest_seqs_reduced_fp) as f:
+        headers = [l.strip() for l in f if l[0] == ">"]
+    assert headers == ["> A000020\tGenusA species", ">UNKNOWN"]
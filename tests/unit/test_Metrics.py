@@ -0,0 +1,119 @@
+import contextvars
+import json
+import pytest
+import shutil
+import subprocess as sp
+import sys
+import tempfile
+import threading
+from .. import INC
+from src.GenusFinder.Metrics import (
+    Metrics,
+    find_metrics,
+    percentile,
+    reset_current,
+    run_child,
+    set_current,
+    summarize,
+    timed,
+)
+from pathlib import Path
+
+
+@pytest.fixture
+def temp_dir():
+    temp_dir = Path(tempfile.mkdtemp())
+    yield temp_dir
+    shutil.rmtree(temp_dir)
+
+
+@pytest.fixture
+def metrics_fixture():
+    metrics = Metrics()
+    token = set_current(metrics)
+    yield metrics
+    reset_current(token)
+
+
+def test_timed_without_metrics():
+    with timed("nothing"):
+        pass
+
+
+def test_timed_context(metrics_fixture):
+    metrics: Metrics = metrics_fixture
+    with timed("child"):
+        run_child(["true"])
+    (record,) = metrics.records
+    assert record["stage"] == "child"
+    assert record["ok"]
+    assert record["wall_s"] >= 0
+    assert record["child_maxrss_kb"] > 0
+
+
+def test_timed_decorator_failure(metrics_fixture):
+    metrics: Metrics = metrics_fixture
+
+    @timed("fails")
+    def f():
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        f()
+    assert not metrics.records[0]["ok"]
+
+
+def test_child_usage_per_stage(metrics_fixture):
+    metrics: Metrics = metrics_fixture
+    busy = "import time\nstart = time.process_time()\nwhile time.process_time() - start < 0.3: pass"
+
+    def stage(name: str, args: list):
+        with timed(name):
+            run_child(args)
+
+    # The idle stage runs across the whole of the busy one, but only counts its own child
+    threads = [
+        threading.Thread(
+            target=contextvars.copy_context().run, args=(stage, name, args)
+        )
+        for name, args in [
+            ("idle", ["sleep", "0.8"]),
+            ("busy", [sys.executable, "-c", busy]),
+        ]
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    records = {r["stage"]: r for r in metrics.records}
+    assert records["busy"]["child_cpu_s"] >= 0.25
+    assert records["idle"]["child_cpu_s"] < 0.1
+
+
+def test_run_child_failures():
+    with pytest.raises(sp.CalledProcessError):
+        run_child(["false"])
+    with pytest.raises(sp.TimeoutExpired):
+        run_child(["sleep", "10"], timeout=0.2)
+
+
+def test_percentile():
+    assert percentile([1, 2, 3, 4, 5], 50) == 3
+    assert percentile([1, 2], 50) == 1.5
+    assert percentile([], 90) == 0.0
+
+
+def test_summarize(temp_dir, metrics_fixture):
+    metrics: Metrics = metrics_fixture
+    with timed("stage:search"):
+        pass
+    for i in range(3):
+        (temp_dir / str(i)).mkdir()
+        metrics.write(temp_dir / str(i) / "metrics.json")
+
+    fps = find_metrics([temp_dir])
+    assert len(fps) == 3
+    summary = summarize(fps)
+    assert summary["queries"] == 3
+    assert summary["stages"]["stage:search"]["count"] == 3
+    assert json.dumps(summary)
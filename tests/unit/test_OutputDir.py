@@ -1,6 +1,7 @@
 import os
 import pytest
 import shutil
+import tarfile
 import tempfile
 from .. import INC
 from src.GenusFinder.OutputDir import OutputDir
@@ -54,3 +55,34 @@ def test_query_as_seq(out_overwrite_seq_fixture):
 def test_overwrite(out_overwrite_seq_fixture):
     out: OutputDir = out_overwrite_seq_fixture
     assert len(os.listdir(out.root_fp)) == 1
+
+
+def test_scratch_finish(temp_dir):
+    scratch = temp_dir / "scratch"
+    out = OutputDir(temp_dir / "output", "ACGT", False, scratch=scratch)
+    assert out.root_fp.parent == scratch
+    out.write_probs({"GENUS1": 0.95})
+    with open(out.get_bootstraps(), "w") as f:
+        f.write("(A,B,C);\n" * 100)
+
+    io = out.finish(archive=True)
+
+    assert not out.root_fp.exists()
+    assert (temp_dir / "output" / "probabilities.tsv").exists()
+    assert (temp_dir / "output" / "query.fasta").exists()
+    assert not (temp_dir / "output" / out.get_bootstraps().name).exists()
+    with tarfile.open(out.archive_fp) as tar:
+        assert tar.getnames() == [out.get_bootstraps().name]
+    assert io["files"] == 3
+    assert io["copied_bytes"] < io["intermediate_bytes"]
+    assert io["archive_bytes"] > 0
+    shutil.rmtree(temp_dir)
+
+
+def test_finish_without_scratch(out_fixture):
+    out: OutputDir = out_fixture
+    out.write_probs({"GENUS1": 0.95})
+    io = out.finish()
+    assert not io["scratch"]
+    assert io["copied_bytes"] == 0
+    assert out.probs_fp.exists()
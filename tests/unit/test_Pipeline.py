@@ -0,0 +1,162 @@
+import pytest
+import shutil
+import tempfile
+import threading
+from .. import INC
+from src.GenusFinder.Pipeline import Pipeline, Stage
+from pathlib import Path
+
+
+@pytest.fixture
+def temp_dir():
+    temp_dir = Path(tempfile.mkdtemp())
+    with open(temp_dir / "input.txt", "w") as f:
+        f.write("ACGT")
+
+    yield temp_dir
+
+    shutil.rmtree(temp_dir)
+
+
+def build_pipeline(
+    temp_dir: Path, calls: list, params: dict = None, state_fp: Path = None
+) -> Pipeline:
+    state_fp = state_fp if state_fp else temp_dir / "state.json"
+    pipeline = Pipeline(state_fp, 2, temp_dir)
+
+    def copy(src: str, dst: str):
+        def f():
+            calls.append(dst)
+            shutil.copy(temp_dir / src, temp_dir / dst)
+
+        return f
+
+    pipeline.add(
+        Stage(
+            "first",
+            copy("input.txt", "first.txt"),
+            inputs=[temp_dir / "input.txt"],
+            outputs=[temp_dir / "first.txt"],
+            params=params,
+        )
+    )
+    pipeline.add(
+        Stage(
+            "second",
+            copy("first.txt", "second.txt"),
+            inputs=[temp_dir / "first.txt"],
+            outputs=[temp_dir / "second.txt"],
+        )
+    )
+    return pipeline
+
+
+def test_dependencies(temp_dir):
+    pipeline = build_pipeline(temp_dir, [])
+    assert pipeline.dependencies(pipeline.stages["first"]) == set()
+    assert pipeline.dependencies(pipeline.stages["second"]) == {"first"}
+
+
+def test_run_order(temp_dir):
+    calls = []
+    build_pipeline(temp_dir, calls).run()
+    assert calls == ["first.txt", "second.txt"]
+    assert (temp_dir / "second.txt").read_text() == "ACGT"
+
+
+def test_skip_unchanged(temp_dir):
+    build_pipeline(temp_dir, []).run()
+    calls = []
+    build_pipeline(temp_dir, calls).run()
+    assert calls == []
+
+
+def test_rerun_changed_input(temp_dir):
+    build_pipeline(temp_dir, []).run()
+    with open(temp_dir / "input.txt", "w") as f:
+        f.write("TTTT")
+    calls = []
+    build_pipeline(temp_dir, calls).run()
+    assert calls == ["first.txt", "second.txt"]
+    assert (temp_dir / "second.txt").read_text() == "TTTT"
+
+
+def test_rerun_changed_params(temp_dir):
+    build_pipeline(temp_dir, [], {"id": 0.9}).run()
+    calls = []
+    build_pipeline(temp_dir, calls, {"id": 0.8}).run()
+    assert calls == ["first.txt"]
+
+
+def test_skip_moved_root(temp_dir):
+    # Like a --scratch workspace, a new directory each run with the state kept outside it
+    first, second = temp_dir / "first", temp_dir / "second"
+    first.mkdir()
+    shutil.copy(temp_dir / "input.txt", first)
+    build_pipeline(first, [], state_fp=temp_dir / "state.json").run()
+    shutil.copytree(first, second)
+    calls = []
+    build_pipeline(second, calls, state_fp=temp_dir / "state.json").run()
+    assert calls == []
+
+
+def test_rerun_missing_output(temp_dir):
+    build_pipeline(temp_dir, []).run()
+    (temp_dir / "second.txt").unlink()
+    calls = []
+    build_pipeline(temp_dir, calls).run()
+    assert calls == ["second.txt"]
+
+
+def test_failed_stage_not_reused(temp_dir):
+    pipeline = Pipeline(temp_dir / "state.json")
+
+    def partial():
+        with open(temp_dir / "out.txt", "w") as f:
+            f.write("partial")
+        raise RuntimeError("Tool crashed")
+
+    pipeline.add(Stage("crash", partial, outputs=[temp_dir / "out.txt"]))
+    with pytest.raises(RuntimeError):
+        pipeline.run()
+
+    calls = []
+    pipeline = Pipeline(temp_dir / "state.json")
+    pipeline.add(
+        Stage("crash", lambda: calls.append(1), outputs=[temp_dir / "out.txt"])
+    )
+    pipeline.run()
+    assert calls == [1]
+    assert not (temp_dir / "out.txt").exists()
+
+
+def test_independent_stages_concurrent(temp_dir):
+    pipeline = Pipeline(temp_dir / "state.json", 2)
+    barrier = threading.Barrier(2, timeout=5)
+    pipeline.add(Stage("a", barrier.wait, cache=False))
+    pipeline.add(Stage("b", barrier.wait, cache=False))
+    # Deadlocks (and the barrier times out) unless both run at once
+    pipeline.run()
+
+
+def test_when(temp_dir):
+    pipeline = Pipeline(temp_dir / "state.json", 2)
+    decision = {}
+    calls = []
+
+    def never_resolved():
+        raise AssertionError("Inputs of a skipped stage were resolved")
+
+    pipeline.add(Stage("decide", lambda: decision.update(tree=False), cache=False))
+    pipeline.add(
+        Stage(
+            "tree",
+            lambda: calls.append("tree"),
+            inputs=[never_resolved],
+            after=["decide"],
+            when=lambda: decision["tree"],
+        )
+    )
+    pipeline.add(Stage("probs", lambda: calls.append("probs"), after=["tree"]))
+    pipeline.run()
+    assert calls == ["probs"]
@@ -0,0 +1,116 @@
+import contextvars
+import pstats
+import pytest
+import shutil
+import tempfile
+import threading
+import time
+from .. import INC
+from src.GenusFinder.Metrics import timed
+from src.GenusFinder.Profile import Profiler, collapse, profiled, profiling
+from pathlib import Path
+
+
+@pytest.fixture
+def temp_dir():
+    temp_dir = Path(tempfile.mkdtemp())
+    yield temp_dir
+    shutil.rmtree(temp_dir)
+
+
+def busy(s: float = 0.1) -> int:
+    n = 0
+    end = time.perf_counter() + s
+    while time.perf_counter() < end:
+        n += inner()
+    return n
+
+
+def inner() -> int:
+    return sum(range(100))
+
+
+def read_folded(fp: Path) -> dict:
+    stacks = {}
+    with open(fp) as f:
+        for line in f:
+            stack, count = line.rsplit(" ", 1)
+            stacks[stack] = int(count)
+    return stacks
+
+
+def test_profiling_off(temp_dir):
+    with profiling(temp_dir / "profile", None) as profiler:
+        with timed("stage:busy"):
+            busy(0.01)
+    assert profiler is None
+    assert not (temp_dir / "profile").exists()
+
+
+def test_cprofile_stages(temp_dir):
+    with profiling(temp_dir, "cprofile"):
+        with timed("stage:busy"):
+            # Nested timed blocks are part of the stage, not stages of their own
+            with timed("DBDir.inner"):
+                busy()
+        with timed("stage:busy"):
+            busy(0.01)
+
+    assert sorted(fp.name for fp in temp_dir.iterdir()) == [
+        "stage_busy.folded",
+        "stage_busy.prof",
+    ]
+    stats = pstats.Stats(str(temp_dir / "stage_busy.prof"))
+    # Both runs of the stage are in its profile
+    assert [s[1] for f, s in stats.stats.items() if f[2] == "busy"] == [2]
+
+    stacks = read_folded(temp_dir / "stage_busy.folded")
+    assert all(s.startswith("stage:busy;") for s in stacks)
+    assert any(s.endswith("test_Profile.py:busy;test_Profile.py:inner") for s in stacks)
+
+
+def test_sample_stage(temp_dir):
+    with profiling(temp_dir, "sample", 0.001):
+        with profiled("stage:busy"):
+            busy(0.2)
+
+    assert [fp.name for fp in temp_dir.iterdir()] == ["stage_busy.folded"]
+    stacks = read_folded(temp_dir / "stage_busy.folded")
+    assert sum(stacks.values()) > 20
+    assert any("test_Profile.py:busy" in s for s in stacks)
+    assert not any("Profile.py:stage" in s for s in stacks)
+
+
+def test_concurrent_stages(temp_dir):
+    with profiling(temp_dir, "cprofile"):
+        threads = [
+            threading.Thread(
+                target=contextvars.copy_context().run, args=(run_stage, f"stage:{i}")
+            )
+            for i in range(3)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    for i in range(3):
+        assert (temp_dir / f"stage_{i}.prof").exists()
+
+
+def run_stage(name: str):
+    with timed(name):
+        busy(0.05)
+
+
+def test_collapse():
+    profiler = Profiler(Path("unused"))
+    with profiler.stage("s"):
+        busy(0.05)
+    stats = pstats.Stats(profiler.profiles["s"][0]).stats
+
+    stacks = collapse(stats, "s")
+    total_us = sum(tt for _, _, tt, _, _ in stats.values()) * 1e6
+    # Every function's own time is spread over its paths, minus rounding
+    assert sum(stacks.values()) == pytest.approx(total_us, rel=0.05)
+    assert all(s.startswith("s;") for s in stacks)
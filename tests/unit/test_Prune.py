@@ -0,0 +1,120 @@
+import pytest
+import shutil
+import tempfile
+from .. import INC
+from ete3 import Tree
+from src.GenusFinder.DBDir import DBDir
+from src.GenusFinder.CladeIndex import CladeIndex
+from src.GenusFinder.Prune import ReferencePruner, accession, induced_newick
+from pathlib import Path
+
+NEWICK = "((A:1,B:2):1,(C:1,(D:1,E:1):0.5):2,F:3);"
+ALIGNED = {
+    "A": "AC--GT-",
+    "B": "AC--GTA",
+    "C": "A-T-GT-",
+    "D": "A---GG-",
+    "E": "A---CG-",
+    "F": "TTTTTTT",
+}
+# LTP labels leaves with more than the accession, quoted since they have spaces and commas
+LTP_NEWICK = (
+    "(('A000001 Alpha one, T':1,'A000002 Alpha two':2):1,"
+    "('B000003 Beta three':1,('B000004 Beta four, T':1,'B000005 Beta (five)':1):0.5):2,"
+    "'C000006 Gamma six':3);"
+)
+LTP_ALIGNED = dict(
+    zip(
+        ["A000001", "A000002", "B000003", "B000004", "B000005", "C000006"],
+        ALIGNED.values(),
+    )
+)
+
+
+def index(newick: str) -> CladeIndex:
+    return CladeIndex(Tree(newick, quoted_node_names=True), lambda name: name[0])
+
+
+@pytest.fixture
+def temp_dir():
+    temp_dir = Path(tempfile.mkdtemp())
+    yield temp_dir
+    shutil.rmtree(temp_dir)
+
+
+def test_induced_newick():
+    t = Tree(NEWICK)
+    pruned = Tree(induced_newick(t, {"A", "D", "E"}))
+    assert sorted(pruned.get_leaf_names()) == ["A", "D", "E"]
+    for a, b in [("A", "D"), ("D", "E"), ("A", "E")]:
+        assert pruned.get_distance(a, b) == pytest.approx(t.get_distance(a, b))
+    assert Tree(NEWICK).write() == t.write()
+
+
+def test_induced_newick_quoted():
+    t = Tree(LTP_NEWICK, quoted_node_names=True)
+    keep = {"A000001 Alpha one, T", "B000005 Beta (five)"}
+    pruned = Tree(induced_newick(t, keep), quoted_node_names=True)
+    assert sorted(pruned.get_leaf_names()) == sorted(keep)
+    pruned = Tree(induced_newick(t, keep, accession))
+    assert sorted(pruned.get_leaf_names()) == ["A000001", "B000005"]
+    assert pruned.get_distance("A000001", "B000005") == pytest.approx(5.5)
+
+
+def test_clade():
+    t = index(NEWICK)
+    pruner = ReferencePruner(min_leaves=2, n_hits=2)
+    assert pruner.clade(t, [("D", 99.0), ("E", 98.0)]) == (["D", "E"], "C")
+    assert pruner.clade(t, [("A", 99.0)]) == (["A", "B"], "C")
+    # Only the n_hits best count
+    assert pruner.clade(t, [("D", 99.0), ("E", 98.0), ("A", 97.0)])[0] == ["D", "E"]
+    assert sorted(pruner.clade(t, [("X", 99.0)])[0]) == sorted(ALIGNED)
+    assert ReferencePruner(min_leaves=3).clade(t, [("D", 99.0)]) == (
+        ["C", "D", "E"],
+        "A",
+    )
+
+
+def test_call(temp_dir):
+    info = ReferencePruner(min_leaves=2).call(
+        index(NEWICK),
+        lambda names: {n: ALIGNED[n] for n in names},
+        [("D", 99.0), ("E", 98.0)],
+        temp_dir / "pruned.newick",
+        temp_dir / "pruned.fasta",
+    )
+    assert info["leaves"] == 3
+    assert info["columns"] == 4
+    assert (temp_dir / "pruned.fasta").read_text() == (">D\nA-GG\n>E\nA-CG\n>C\nATGT\n")
+    pruned = Tree(str(temp_dir / "pruned.newick"))
+    assert sorted(pruned.get_leaf_names()) == ["C", "D", "E"]
+
+
+def test_call_LTP_names(temp_dir):
+    # The hits and the alignment only go by accession
+    info = ReferencePruner(min_leaves=2).call(
+        index(LTP_NEWICK),
+        lambda names: {n: LTP_ALIGNED[n] for n in names if n in LTP_ALIGNED},
+        [("B000004", 99.0), ("B000005", 98.0)],
+        temp_dir / "pruned.newick",
+        temp_dir / "pruned.fasta",
+    )
+    assert info["leaves"] == 3
+    assert info["outgroup"] == "B000003 Beta three"
+    assert (temp_dir / "pruned.fasta").read_text() == (
+        ">B000004\nA-GG\n>B000005\nA-CG\n>B000003\nATGT\n"
+    )
+    pruned = Tree(str(temp_dir / "pruned.newick"))
+    assert sorted(pruned.get_leaf_names()) == ["B000003", "B000004", "B000005"]
+
+
+@pytest.mark.parametrize("compression", [None, "gzip"])
+def test_LTP_aligned_records(temp_dir, compression):
+    db = DBDir(temp_dir / "db", "", compression, temp_dir / "scratch")
+    with open(db.LTP_aligned_fp, "w") as f:
+        for name, seq in ALIGNED.items():
+            f.write(f">{name} some description\n{seq}\n")
+    assert db.get_LTP_aligned_records(["E", "A", "X"]) == {
+        "E": ALIGNED["E"],
+        "A": ALIGNED["A"],
+    }
@@ -0,0 +1,96 @@
+import json
+import pytest
+import shutil
+import tempfile
+import threading
+import time
+from .. import INC
+from src.GenusFinder.OutputDir import OutputDir
+from src.GenusFinder.Results import COLUMNS, ResultsWriter
+from pathlib import Path
+
+
+@pytest.fixture
+def temp_dir():
+    temp_dir = Path(tempfile.mkdtemp())
+    yield temp_dir
+    shutil.rmtree(temp_dir)
+
+
+def test_tsv(temp_dir):
+    with ResultsWriter(temp_dir / "results.tsv") as results:
+        results.add("q1", "subtree_distance", {"Alpha species": 0.9, "Beta": 0.00001})
+
+    with open(temp_dir / "results.tsv") as f:
+        assert f.read().splitlines() == [
+            "\t".join(COLUMNS),
+            "q1\tsubtree_distance\tAlpha\t0.9",
+        ]
+
+    # Appends without repeating the header
+    with ResultsWriter(temp_dir / "results.tsv") as results:
+        results.add("q2", "subtree_distance", {"Beta": 0.5})
+    with open(temp_dir / "results.tsv") as f:
+        assert len(f.read().splitlines()) == 3
+
+
+def test_jsonl_from_many_threads(temp_dir):
+    results = ResultsWriter(temp_dir / "results.jsonl", buffer_rows=7)
+
+    def worker(n: int):
+        for i in range(25):
+            results.add(f"q{n}", "subtree_bootstrap", {f"G{i}": 0.5, f"H{i}": 0.25})
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    results.close()
+
+    with open(temp_dir / "results.jsonl") as f:
+        rows = [json.loads(l) for l in f]
+    assert len(rows) == results.rows_written == 4 * 25 * 2
+    assert set(rows[0]) == set(COLUMNS)
+    assert sum(r["query"] == "q3" for r in rows) == 50
+
+
+def test_flush_while_trickling(temp_dir):
+    results = ResultsWriter(temp_dir / "results.tsv", buffer_rows=1000, flush_s=0.2)
+    try:
+        # Never a gap as long as flush_s, and never a full buffer
+        for i in range(30):
+            results.add(f"q{i}", "subtree_distance", {"Alpha": 0.9})
+            time.sleep(0.03)
+        with open(temp_dir / "results.tsv") as f:
+            assert len(f.read().splitlines()) > 1
+    finally:
+        results.close()
+    assert results.rows_written == 30
+
+
+def test_parquet(temp_dir):
+    pq = pytest.importorskip("pyarrow.parquet")
+    with ResultsWriter(temp_dir / "results.parquet", buffer_rows=1) as results:
+        results.add("q1", "full_tree", {"Alpha": 0.9, "Beta": 0.1})
+        results.add("q2", "full_tree", {"Alpha": 0.2})
+    assert pq.read_table(temp_dir / "results.parquet").num_rows == 3
+
+
+def test_unknown_format(temp_dir):
+    with pytest.raises(ValueError):
+        ResultsWriter(temp_dir / "results.csv")
+
+
+def test_output_dir_rows(temp_dir):
+    with ResultsWriter(temp_dir / "results.tsv") as results:
+        out = OutputDir(temp_dir / "out", "ACGT", False, results, "seq1")
+        out.write_probs({"Alpha": 0.75}, "Some header", "w", "subtree_distance")
+        out.write_probs({"Beta": 0.25}, "Other header")
+
+    with open(temp_dir / "results.tsv") as f:
+        assert f.read().splitlines()[1:] == [
+            "seq1\tsubtree_distance\tAlpha\t0.75",
+            "seq1\tOther header\tBeta\t0.25",
+        ]
+    assert out.probs_fp.exists()
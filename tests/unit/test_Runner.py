@@ -0,0 +1,129 @@
+import asyncio
+import os
+import pytest
+import shutil
+import sys
+import tempfile
+import time
+from .. import INC
+from src.GenusFinder.CLI import FAKE_TOOLS_ENV, MuscleAligner, RAxMLTreeBuilder
+from src.GenusFinder.Runner import ToolJob, ToolRunner
+from pathlib import Path
+
+
+@pytest.fixture
+def temp_dir():
+    temp_dir = Path(tempfile.mkdtemp())
+    yield temp_dir
+    shutil.rmtree(temp_dir)
+
+
+def python(code: str) -> ToolJob:
+    return ToolJob("python", [sys.executable, "-c", code])
+
+
+def test_captures_output():
+    runner = ToolRunner()
+    runner.add(python("import sys; print('out'); print('err', file=sys.stderr)"), "a")
+    runner.add(python("import sys; sys.exit(3)"), "b")
+    results = runner.run()
+
+    assert results["a"].ok
+    assert results["a"].stdout == "out\n"
+    assert results["a"].stderr == "err\n"
+    assert results["b"].status == "failed"
+    assert results["b"].returncode == 3
+    assert results["b"].to_dict()["error"] == "returned code 3"
+
+
+def test_bounded_concurrency():
+    runner = ToolRunner(max_concurrency=2)
+    for i in range(4):
+        runner.add(python("import time; time.sleep(0.5)"), f"sleep{i}")
+    start = time.perf_counter()
+    results = runner.run()
+    elapsed = time.perf_counter() - start
+
+    assert all(r.ok for r in results.values())
+    # Two at a time, so two rounds
+    assert 1.0 <= elapsed < 1.9
+
+
+def test_timeout_cancels_dependents():
+    runner = ToolRunner()
+    runner.add(python("import time; time.sleep(30)"), "slow", timeout=0.5)
+    runner.add(python("print('never')"), "after_slow", after=["slow"])
+    runner.add(python("print('after')"), "after_after", after=["after_slow"])
+    runner.add(python("print('fine')"), "independent")
+    start = time.perf_counter()
+    results = runner.run()
+
+    assert time.perf_counter() - start < 10
+    assert results["slow"].status == "timeout"
+    assert results["after_slow"].status == "cancelled"
+    assert results["after_slow"].error == "slow timeout"
+    assert results["after_after"].status == "cancelled"
+    assert results["independent"].stdout == "fine\n"
+
+
+def test_cancel():
+    runner = ToolRunner()
+    runner.add(python("import time; time.sleep(30)"), "slow")
+    runner.add(python("print('never')"), "after_slow", after=["slow"])
+
+    async def main():
+        run = asyncio.ensure_future(runner.run_async())
+        await asyncio.sleep(0.5)
+        assert runner.cancel("slow")
+        return await run
+
+    start = time.perf_counter()
+    results = asyncio.run(main())
+    assert time.perf_counter() - start < 10
+    assert results["slow"].status == "cancelled"
+    assert results["after_slow"].status == "cancelled"
+
+
+def test_missing_tool():
+    runner = ToolRunner()
+    runner.add(ToolJob("nope", ["genusfinder-no-such-tool"]))
+    assert runner.run()["nope"].status == "failed"
+
+
+def test_bad_dependencies():
+    runner = ToolRunner()
+    runner.add(python("pass"), "a", after=["b"])
+    runner.add(python("pass"), "b", after=["a"])
+    with pytest.raises(ValueError):
+        runner.run()
+    with pytest.raises(ValueError):
+        runner.add(python("pass"), "a")
+
+
+def test_deferred_wrappers(temp_dir, monkeypatch):
+    monkeypatch.setenv(FAKE_TOOLS_ENV, "1")
+    with open(temp_dir / "seqs.fasta", "w") as f:
+        for i, seq in enumerate(["ACGTACGT", "ACGTACGA", "ACGAACGA", "TCGAACGA"]):
+            f.write(f">S{i}\n{seq}\n")
+
+    runner = ToolRunner()
+    runner.add(
+        MuscleAligner(defer=True).call_simple(
+            temp_dir / "seqs.fasta", temp_dir / "aligned.fasta"
+        ),
+        "align",
+    )
+    for n in ["a", "b"]:
+        runner.add(
+            RAxMLTreeBuilder(defer=True).call(
+                m="GTRCAT", n=n, p=10000, s=temp_dir / "aligned.fasta", w=temp_dir
+            ),
+            f"tree_{n}",
+            after=["align"],
+        )
+    results = runner.run()
+
+    assert [r.job.tool for r in results.values()] == ["muscle", "raxmlHPC", "raxmlHPC"]
+    assert all(r.ok for r in results.values())
+    assert (temp_dir / "RAxML_bestTree.a").exists()
+    assert (temp_dir / "RAxML_bestTree.b").exists()
@@ -0,0 +1,98 @@
+import collections
+import pytest
+import shutil
+import tempfile
+from .. import INC
+from src.GenusFinder.SitePatterns import compress_sites, hash_columns
+from pathlib import Path
+
+ALIGNED = {
+    "A": "A---C---A---C---",
+    "B": "A---C---G---C---",
+    "C": "T---C---G---C---",
+}
+
+
+@pytest.fixture
+def temp_dir():
+    temp_dir = Path(tempfile.mkdtemp())
+    yield temp_dir
+    shutil.rmtree(temp_dir)
+
+
+def read(fp: Path) -> dict:
+    with open(fp) as f:
+        lines = f.read().split()
+    return {lines[i][1:]: lines[i + 1] for i in range(0, len(lines), 2)}
+
+
+def test_compress_sites(temp_dir):
+    with open(temp_dir / "aligned.fasta", "w") as f:
+        for name, seq in ALIGNED.items():
+            f.write(f">{name} some description\n{seq}\n")
+
+    info = compress_sites(
+        temp_dir / "aligned.fasta", temp_dir / "patterns.fasta", temp_dir / "weights"
+    )
+    patterns = read(temp_dir / "patterns.fasta")
+    with open(temp_dir / "weights") as f:
+        weights = [int(w) for w in f.read().split()]
+
+    assert info == {"columns": 16, "informative_columns": 4, "patterns": 3}
+    # First appearance order, the repeated C column counted twice
+    assert patterns == {"A": "ACA", "B": "ACG", "C": "TCG"}
+    assert weights == [1, 2, 1]
+
+
+def test_compress_sites_keeps_columns(temp_dir):
+    import random
+
+    rng = random.Random(5)
+    aligned = {
+        f"S{i}": "".join(rng.choice("AC-") + "---" for _ in range(50)) for i in range(6)
+    }
+    with open(temp_dir / "aligned.fasta", "w") as f:
+        for name, seq in aligned.items():
+            f.write(f">{name}\n{seq}\n")
+
+    compress_sites(
+        temp_dir / "aligned.fasta", temp_dir / "patterns.fasta", temp_dir / "weights"
+    )
+    patterns = read(temp_dir / "patterns.fasta")
+    with open(temp_dir / "weights") as f:
+        weights = [int(w) for w in f.read().split()]
+
+    # Expanding the patterns by their weights gives back every column that isn't all gaps
+    columns = lambda seqs, names: [
+        "".join(seqs[n][i] for n in names) for i in range(len(seqs[names[0]]))
+    ]
+    original = collections.Counter(
+        c for c in columns(aligned, list(aligned)) if set(c) != {"-"}
+    )
+    expanded = collections.Counter()
+    for c, w in zip(columns(patterns, list(aligned)), weights):
+        expanded[c] += w
+    assert expanded == original
+
+
+def test_compress_sites_ragged(temp_dir):
+    with open(temp_dir / "aligned.fasta", "w") as f:
+        f.write(">A\nACGT\n>B\nACG\n")
+    with pytest.raises(ValueError):
+        compress_sites(
+            temp_dir / "aligned.fasta", temp_dir / "patterns.fasta", temp_dir / "w"
+        )
+
+
+def test_hash_columns(temp_dir):
+    with open(temp_dir / "aligned.fasta", "w") as f:
+        for name, seq in ALIGNED.items():
+            f.write(f">{name}\n{seq}\n")
+
+    hashes, informative = hash_columns(temp_dir / "aligned.fasta")
+
+    assert list(informative) == [i % 4 == 0 for i in range(16)]
+    # The two C columns share a hash, as do the all-gap ones, and the others differ
+    assert (hashes[4] == hashes[12]).all()
+    assert len({tuple(h) for h in hashes[informative]}) == 3
+    assert (hashes[1] == hashes[2]).all()
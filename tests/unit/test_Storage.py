@@ -0,0 +1,82 @@
+import pytest
+import random
+import shutil
+import tempfile
+from .. import INC
+from src.GenusFinder.DBDir import DBDir
+from src.GenusFinder.Storage import (
+    BlockReader,
+    compress,
+    compressed_fp,
+    materialize,
+    open_text,
+)
+from pathlib import Path
+
+CODECS = ["gzip", "zstd"]
+
+
+@pytest.fixture
+def temp_dir():
+    temp_dir = Path(tempfile.mkdtemp())
+    yield temp_dir
+    shutil.rmtree(temp_dir)
+
+
+def write_fasta(fp: Path, n: int = 200) -> dict:
+    rng = random.Random(1)
+    seqs = {
+        f"A{i:06d}": "".join(rng.choice("ACGT") for _ in range(500)) for i in range(n)
+    }
+    with open(fp, "w") as f:
+        for name, seq in seqs.items():
+            f.write(f">{name}\tGenusA species\n{seq[:250]}\n{seq[250:]}\n")
+    return seqs
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_round_trip(temp_dir, codec):
+    if codec == "zstd":
+        pytest.importorskip("zstandard")
+    fp = temp_dir / "seqs.fasta"
+    seqs = write_fasta(fp)
+    packed = compress(fp, compressed_fp(fp, codec), codec, block_size=4096)
+
+    with open(fp) as f_plain, open_text(packed) as f_packed:
+        assert f_plain.read() == f_packed.read()
+
+    with BlockReader(packed) as reader:
+        assert len(reader) == len(seqs)
+        assert len(reader.index["blocks"]) > 1
+        for name in ["A000000", "A000123", "A000199"]:
+            desc, seq = reader.get(name)
+            assert desc == f"{name}\tGenusA species"
+            assert seq == seqs[name]
+
+
+def test_materialize(temp_dir):
+    fp = temp_dir / "seqs.fasta"
+    write_fasta(fp)
+    packed = compress(fp, compressed_fp(fp, "gzip"))
+
+    plain = materialize(packed, temp_dir / "scratch")
+    assert plain == temp_dir / "scratch" / "seqs.fasta"
+    assert plain.read_bytes() == fp.read_bytes()
+    mtime = plain.stat().st_mtime_ns
+    assert materialize(packed, temp_dir / "scratch").stat().st_mtime_ns == mtime
+    assert materialize(fp, temp_dir / "scratch") == fp
+
+
+def test_compressed_db(temp_dir):
+    db = DBDir(temp_dir / "db", "", "gzip", temp_dir / "scratch")
+    with open(db.LTP_blastdb_fp, "w") as f:
+        f.write(">x [accession=AB000001] [organism=Alpha beta]\nACGU\n")
+        f.write(">y [accession=AB000002] [organism=Gamma delta]\nAACC\n")
+
+    type_species = db.get_type_species()
+    assert not db.type_species_fp.exists()
+    assert compressed_fp(db.type_species_fp, "gzip").exists()
+    assert type_species.parent == db.scratch_fp
+    with open(type_species) as f:
+        assert f.read() == ">AB000001\tAlpha beta\nACGT\n>AB000002\tGamma delta\nAACC\n"
+    assert db.get_genus_index() == {"AB000001": "Alpha", "AB000002": "Gamma"}
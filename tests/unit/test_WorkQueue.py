@@ -0,0 +1,99 @@
+import json
+import multiprocessing
+import os
+import pytest
+import shutil
+import tempfile
+import time
+from .. import INC
+from src.GenusFinder.WorkQueue import WorkQueue
+from pathlib import Path
+
+
+@pytest.fixture
+def temp_dir():
+    temp_dir = Path(tempfile.mkdtemp())
+    yield temp_dir
+    shutil.rmtree(temp_dir)
+
+
+def queue_batch(queue: WorkQueue, n: int, shard_size: int = 1):
+    batch = [(f"q{i} desc", "ACGT") for i in range(n)]
+    return queue.enqueue(batch, [f"q{i}" for i in range(n)], shard_size)
+
+
+def claim_all(fp: Path, worker: str, claims):
+    queue = WorkQueue(fp)
+    while True:
+        shard = queue.claim(worker)
+        if shard is None:
+            return
+        claims.put(shard.name)
+
+
+def test_enqueue(temp_dir):
+    queue = WorkQueue(temp_dir)
+    assert queue_batch(queue, 5, 2) == 3
+    shard = queue.shards("pending")[0]
+    assert (shard.name, shard.attempt) == ("00000", 0)
+    assert shard.read() == ([("q0 desc", "ACGT"), ("q1 desc", "ACGT")], ["q0", "q1"])
+    with pytest.raises(ValueError):
+        queue_batch(queue, 1)
+
+
+def test_claims_are_exclusive(temp_dir):
+    queue = WorkQueue(temp_dir)
+    queue_batch(queue, 40)
+    ctx = multiprocessing.get_context("spawn")
+    claims = ctx.Queue()
+    procs = [
+        ctx.Process(target=claim_all, args=(temp_dir, f"w{i}", claims))
+        for i in range(4)
+    ]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+        assert p.exitcode == 0
+
+    names = [claims.get() for _ in range(40)]
+    assert sorted(names) == [f"{i:05d}" for i in range(40)]
+    assert queue.status()["claimed"] == 40
+
+
+def test_reclaim(temp_dir):
+    queue = WorkQueue(temp_dir, lease_s=60, max_attempts=2)
+    queue_batch(queue, 2)
+    first, second = queue.claim("a"), queue.claim("b")
+    assert queue.reclaim() == []
+
+    # a stops renewing
+    stale = time.time() - 120
+    os.utime(first.lease_fp, (stale, stale))
+    assert queue.reclaim() == [first.name]
+    assert not first.lease_fp.exists()
+    assert not queue.complete(first, {})
+
+    retry = queue.claim("c")
+    assert (retry.name, retry.attempt) == (first.name, 1)
+    assert queue.complete(retry, {"failed": []})
+    assert queue.done() == {first.name: {"failed": [], "attempt": 1}}
+
+    # Out of attempts
+    os.utime(second.lease_fp, (stale, stale))
+    queue.reclaim()
+    second_retry = queue.claim("d")
+    os.utime(second_retry.lease_fp, (stale, stale))
+    queue.reclaim()
+    assert [s.name for s in queue.shards("failed")] == [second.name]
+    assert queue.finished()
+
+
+def test_lease_renewal(temp_dir):
+    queue = WorkQueue(temp_dir, lease_s=0.4)
+    queue_batch(queue, 1)
+    shard = queue.claim("a")
+    with queue.lease(shard):
+        time.sleep(1.0)
+        assert queue.reclaim() == []
+    assert queue.complete(shard, {})
@@ -0,0 +1,50 @@
+import os
+import subprocess as sp
+import sys
+import pytest
+from pathlib import Path
+from .. import INC
+
+REPO_FP = Path(__file__).parents[2]
+
+# None of these should be loaded just to start an entry point, timings are in
+# tests/benchmark/startup.py
+HEAVY_MODULES = ["sklearn", "ete3", "numpy", "eutils", "requests", "tqdm"]
+ENTRY_POINTS = [
+    "src.GenusFinder.command",
+    "src.GenusFinder.prepare_strain_data",
+    "src.GenusFinder.train_command",
+]
+
+
+def loaded_modules(module: str) -> set:
+    """
+    Names of every module loaded by importing module in a fresh interpreter
+    """
+    res = sp.run(
+        [
+            sys.executable,
+            "-c",
+            f"import sys, {module}; print('\\n'.join(sys.modules))",
+        ],
+        cwd=REPO_FP,
+        # The console scripts import GenusFinder as installed
+        env=dict(os.environ, PYTHONPATH=str(REPO_FP / "src")),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return set(res.stdout.split())
+
+
+@pytest.mark.parametrize("module", ENTRY_POINTS)
+def test_no_heavy_imports(module):
+    loaded = {name.split(".")[0] for name in loaded_modules(module)}
+    assert not loaded & set(HEAVY_MODULES)
+
+
+def test_algorithms_defers_numpy_users():
+    # Algorithms is loaded by every query, sklearn and CladeIndex only once they're used
+    loaded = loaded_modules("GenusFinder.Algorithms")
+    assert "sklearn" not in {name.split(".")[0] for name in loaded}
+    assert "GenusFinder.CladeIndex" not in loaded